@@ -0,0 +1,314 @@
+"""
+Reproducible timings of the recommendation hot paths: the samplers'
+updates, process_events and grade, and the DatabaseDriver calls behind
+every observation and every ranking.
+
+Each benchmark runs at every combination of the scale's arms, samples and
+users that it depends on, with seeded data. Results are written as JSON
+and can be compared against a stored baseline from the same machine; a
+benchmark whose best time is more than `tolerance` slower than the
+baseline's fails the run.
+
+    python benchmarks.py --out results.json
+    python benchmarks.py --scale medium --update-baseline benchmark_baseline.json
+    python benchmarks.py --scale medium --baseline benchmark_baseline.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from database_driver import DatabaseDriver
+from mvsampling.binomial_sampling import BinomialBandit
+from mvsampling.events import EVENT_DTYPE
+from mvsampling.mvsampling import HandsTable
+
+# arms per optimization, samples per optimization, users
+SCALES = {
+    "tiny": {"arms": [2], "samples": [50], "users": [2]},
+    "small": {"arms": [3], "samples": [1000], "users": [1, 10]},
+    "medium": {"arms": [3, 10], "samples": [10000], "users": [1, 100]},
+    "large": {"arms": [3, 10, 30], "samples": [100000], "users": [1, 1000]},
+}
+REPEAT = 5
+# Allowed slowdown against the baseline before a benchmark counts as a regression.
+TOLERANCE = 0.25
+# Same number of draws as the bot's recommendation.
+RANKING_DRAWS = 10000
+# Same window as the bot's recommendation, in days.
+WINDOW_DAYS = 91
+# add_option calls timed per repeat.
+ADD_OPTION_CALLS = 200
+SEED = 0
+
+
+def _events(arms, samples, binary=False):
+    """Seeded columnar events spread over a year, `samples` of them."""
+    rng = np.random.default_rng(SEED)
+    events = np.zeros(samples, dtype=EVENT_DTYPE)
+    start = np.datetime64("2024-01-01T00:00:00", "us")
+    events["time"] = start + np.sort(rng.integers(0, 365 * 86400, samples)) * np.timedelta64(1, "s")
+    events["arm"] = rng.integers(0, arms, samples)
+    events["value"] = rng.integers(0, 2, samples) if binary else rng.normal(40, 8, samples)
+    return events
+
+
+def _names(arms):
+    return [f"option {i}" for i in range(arms)]
+
+
+def _filled_table(arms, samples):
+    events = _events(arms, samples)
+    table = HandsTable(_names(arms), history_limit=0, rng=SEED)
+    table.update_many(np.array(table.options_list)[events["arm"]], events["value"])
+    return table
+
+
+def bench_hands_update_hands(arms, samples):
+    events = _events(arms, samples)
+    names = list(np.array(_names(arms))[events["arm"]])
+    values = events["value"].tolist()
+
+    def run(table):
+        for name, value in zip(names, values):
+            table.update_hands(name, value)
+    return lambda: HandsTable(_names(arms), history_limit=0), run, samples
+
+
+def bench_hands_process_events(arms, samples):
+    events = _events(arms, samples)
+    return (lambda: HandsTable(_names(arms), history_limit=0, rng=SEED),
+            lambda table: table.process_events(events, n_draws=RANKING_DRAWS), 1)
+
+
+def bench_hands_grade(arms, samples):
+    table = _filled_table(arms, samples)
+    return lambda: table, lambda table: table.grade(n_draws=RANKING_DRAWS), 1
+
+
+def bench_binomial_update_arm(arms, samples):
+    events = _events(arms, samples, binary=True)
+    names = list(np.array(_names(arms))[events["arm"]])
+    rewards = events["value"].astype(int).tolist()
+
+    def run(bandit):
+        for name, reward in zip(names, rewards):
+            bandit.update_arm(name, reward)
+    return lambda: BinomialBandit(_names(arms), history_limit=0), run, samples
+
+
+def bench_binomial_process_events(arms, samples):
+    events = _events(arms, samples, binary=True)
+    now = events["time"].max()
+    return (lambda: BinomialBandit(_names(arms), history_limit=0, rng=SEED),
+            lambda bandit: bandit.process_events(events, now=now), 1)
+
+
+def bench_binomial_grade(arms, samples):
+    bandit = BinomialBandit(_names(arms), history_limit=0, rng=SEED)
+    events = _events(arms, samples, binary=True)
+    bandit.process_events(events, days=366, now=events["time"].max())
+    return lambda: bandit, lambda bandit: bandit.grade(), 1
+
+
+def _database(directory, arms, samples, users):
+    """
+    Path of a database with one optimization of `samples` samples per
+    user, built on first use and shared by the benchmarks that copy it.
+    """
+    path = os.path.join(directory, f"template_{arms}_{samples}_{users}.db")
+    if os.path.exists(path):
+        return path
+    db = DatabaseDriver(path, pool_size=1)
+    events = _events(arms, samples)
+    names = _names(arms)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    seconds = ((events["time"] - events["time"][0]) // np.timedelta64(1, "s")).tolist()
+    for user_id in range(1, users + 1):
+        db.import_samples(user_id, (
+            ("Commute", names[arm], value, start + timedelta(seconds=offset))
+            for arm, value, offset in zip(events["arm"].tolist(), events["value"].tolist(), seconds)
+        ))
+    # closing the only connection checkpoints the WAL into the file
+    db.close()
+    return path
+
+
+def _copies(directory, arms, samples, users):
+    """
+    setup and cleanup functions for benchmarks that write: every setup()
+    opens a fresh copy of the database (pooled, WAL, as in the bot), so each
+    repeat starts from the same state.
+    """
+    template = _database(directory, arms, samples, users)
+    opened = []
+    counter = itertools.count()
+
+    def cleanup():
+        while opened:
+            db, path = opened.pop()
+            db.close()
+            os.remove(path)
+
+    def setup():
+        cleanup()
+        path = os.path.join(directory, f"copy_{next(counter)}.db")
+        shutil.copyfile(template, path)
+        opened.append((DatabaseDriver(path, pool_size=1), path))
+        return opened[-1][0]
+    return setup, cleanup
+
+
+def bench_db_add_option(arms, samples, users, directory):
+    setup, cleanup = _copies(directory, arms, samples, users)
+    names = _names(arms)
+    rng = np.random.default_rng(SEED)
+    calls = [(int(rng.integers(1, users + 1)), names[int(rng.integers(0, arms))], float(value))
+             for value in rng.normal(40, 8, ADD_OPTION_CALLS)]
+
+    def run(db):
+        for user_id, variant, value in calls:
+            db.add_option("Commute", variant, value, user_id)
+    return setup, run, ADD_OPTION_CALLS, cleanup
+
+
+def bench_db_get_posterior(arms, samples, users, directory):
+    """
+    The windowed posterior of every user, read for the first time after a
+    year of samples: each call expires the samples older than WINDOW_DAYS.
+    """
+    setup, cleanup = _copies(directory, arms, samples, users)
+
+    def run(db):
+        for user_id in range(1, users + 1):
+            db.get_posterior("Commute", user_id, days=WINDOW_DAYS)
+    return setup, run, users, cleanup
+
+
+def bench_db_get_all_samples(arms, samples, users, directory):
+    db = DatabaseDriver(_database(directory, arms, samples, users), pool_size=1)
+    return lambda: db, lambda db: db.get_all_samples_for_optimization(users, "Commute"), 1, db.close
+
+
+# name -> (function, dimensions it is parameterized by)
+BENCHMARKS = {
+    "hands.update_hands": (bench_hands_update_hands, ("arms", "samples")),
+    "hands.process_events": (bench_hands_process_events, ("arms", "samples")),
+    "hands.grade": (bench_hands_grade, ("arms", "samples")),
+    "binomial.update_arm": (bench_binomial_update_arm, ("arms", "samples")),
+    "binomial.process_events": (bench_binomial_process_events, ("arms", "samples")),
+    "binomial.grade": (bench_binomial_grade, ("arms", "samples")),
+    "db.add_option": (bench_db_add_option, ("arms", "samples", "users")),
+    "db.get_posterior": (bench_db_get_posterior, ("arms", "samples", "users")),
+    "db.get_all_samples_for_optimization": (bench_db_get_all_samples, ("arms", "samples", "users")),
+}
+
+
+def result_key(result):
+    params = ",".join(f"{name}={value}" for name, value in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+
+def measure(setup, run, repeat):
+    """Seconds per run() over `repeat` runs, each on a fresh setup() that isn't timed."""
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmarks(scale, repeat=REPEAT, only=None):
+    """Run the benchmarks whose name starts with one of `only` (all by default)."""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (function, dims) in BENCHMARKS.items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            for values in itertools.product(*(scale[dim] for dim in dims)):
+                params = dict(zip(dims, values))
+                extra = {"directory": directory} if "users" in dims else {}
+                setup, run, ops, *cleanup = function(**params, **extra)
+                try:
+                    times = measure(setup, run, repeat)
+                finally:
+                    for close in cleanup:
+                        close()
+                result = {
+                    "name": name, "params": params, "repeat": repeat, "ops": ops,
+                    "min": min(times), "median": statistics.median(times),
+                    "per_op": min(times) / ops,
+                }
+                print(f"{result_key(result):<70} {result['min'] * 1e3:10.3f} ms"
+                      f" {result['per_op'] * 1e6:10.2f} us/op", file=sys.stderr)
+                results.append(result)
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Regressions against a baseline report: (key, baseline seconds, current
+    seconds) of every benchmark whose best time grew by more than tolerance.
+    Benchmarks missing from either side are not compared.
+    """
+    previous = {result_key(result): result["min"] for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key in previous and result["min"] > previous[key] * (1 + tolerance):
+            regressions.append((key, previous[key], result["min"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the sampler and database hot paths.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed runs per benchmark")
+    parser.add_argument("--only", action="append", help="run only benchmarks with this name prefix")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="fail if slower than this results file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--update-baseline", metavar="PATH", help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    report = {"scale": args.scale, "environment": environment(),
+              "results": run_benchmarks(SCALES[args.scale], args.repeat, args.only)}
+    for path in (args.out, args.update_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report["results"], json.load(f), args.tolerance)
+        for key, before, after in regressions:
+            print(f"Regression: {key} {before * 1e3:.3f} ms -> {after * 1e3:.3f} ms "
+                  f"({after / before - 1:+.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions against '{args.baseline}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import asyncio
+import html
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+
+# Telegram delivers about 30 messages per second to different chats; stay
+# below it so that replies to interactive users still get through.
+GLOBAL_RATE = 25
+# Messages in flight at once.
+MAX_CONCURRENCY = 8
+# Users whose optimizations are ranked together by one BatchSampler.
+PAGE_SIZE = 500
+# Same window as the interactive recommendation.
+WINDOW_DAYS = 91
+# Same number of draws as the interactive recommendation, so both name the
+# same best variant.
+RANKING_DRAWS = 10000
+# Attempts per message when Telegram answers with 429 Too Many Requests.
+MAX_ATTEMPTS = 5
+# Progress of older runs is forgotten after this many days.
+KEEP_PROGRESS_DAYS = 30
+
+
+class TokenBucket:
+    """
+    Admits `rate` acquisitions per second on average and bursts of up to
+    `capacity`. Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+def recommendations(rows, rng=None, n_draws=RANKING_DRAWS):
+    """
+    Best variant of every optimization in rows from
+    DatabaseDriver.get_all_posteriors: the one most often best in n_draws
+    Thompson draws, drawn for all of them together, as /add_observation
+    ranks them. Returns {telegram_user_id: [(optimization_name, variant_name)]}.
+    """
+    # imported here so that importing the bot doesn't load numpy
+    from mvsampling.batch import BatchSampler
+
+    if not rows:
+        return {}
+    users, ids, names, variants, te, mu, alpha, beta = zip(*rows)
+    # Currently hardcoded to maximize, like the interactive recommendation
+    sampler = BatchSampler.from_groups(ids, te, mu, alpha, beta, minimize=False, rng=rng)
+    picks = {}
+    order, _ = sampler.rank_by_prob(n_draws)
+    for start, best in zip(sampler.offsets[:-1], sampler.best(order)):
+        picks.setdefault(users[start], []).append((names[start], variants[start + best]))
+    return picks
+
+
+def format_message(picks):
+    lines = ["Today's recommendations:"]
+    lines += [f"• <b>{html.escape(name)}</b>: {html.escape(variant)}" for name, variant in picks]
+    return "\n".join(lines)
+
+
+class Broadcaster:
+    """
+    Sends every user one message with the current best variant of each of
+    their optimizations.
+
+    Users are read in pages of page_size and each page is ranked by one
+    BatchSampler, see recommendations. Messages go out with at most max_concurrency in flight
+    and no more than rate per second overall; each user gets a single
+    message per run, which also keeps within Telegram's one message per
+    second per chat. A 429 answer is retried after the delay Telegram asks
+    for.
+
+    Every delivered message is recorded under the run's key, so running the
+    same key again after an interruption only reaches the users that were
+    missed. Users who blocked the bot are recorded too and not retried;
+    other failures are logged and retried by the next run of the same key.
+    """
+
+    def __init__(self, bot, db, rate=GLOBAL_RATE, max_concurrency=MAX_CONCURRENCY,
+                 page_size=PAGE_SIZE, days=WINDOW_DAYS, rng=None):
+        self.bot = bot
+        self.db = db
+        self.page_size = page_size
+        self.days = days
+        self.rng = rng
+        self._bucket = TokenBucket(rate)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(self, run_key):
+        """Broadcast under run_key; returns (sent, skipped, failed) user counts."""
+        import numpy as np
+
+        rng = np.random.default_rng(self.rng)
+        done = set(await self.db.get_broadcast_sent(run_key))
+        counts = {'sent': 0, 'failed': 0}
+        skipped = 0
+        after = None
+        while True:
+            rows = await self.db.get_all_posteriors(days=self.days, after_user_id=after, limit=self.page_size)
+            if not rows:
+                break
+            after = rows[-1][0]
+            # thousands of draws per arm; keep them off the event loop
+            picks = await asyncio.get_running_loop().run_in_executor(None, recommendations, rows, rng)
+            pending = {user_id: user_picks for user_id, user_picks in picks.items() if user_id not in done}
+            skipped += len(picks) - len(pending)
+            await asyncio.gather(*(
+                self._deliver(run_key, user_id, format_message(user_picks), counts)
+                for user_id, user_picks in pending.items()
+            ))
+        logging.info("Broadcast %s: %d sent, %d already sent, %d failed",
+                     run_key, counts['sent'], skipped, counts['failed'])
+        return counts['sent'], skipped, counts['failed']
+
+    async def _deliver(self, run_key, user_id, text, counts):
+        async with self._semaphore:
+            for _ in range(MAX_ATTEMPTS):
+                await self._bucket.acquire()
+                try:
+                    await self.bot.send_message(user_id, text)
+                except TelegramRetryAfter as error:
+                    logging.warning("Flood limit hit, retrying %s in %ss", user_id, error.retry_after)
+                    await asyncio.sleep(error.retry_after)
+                    continue
+                except TelegramForbiddenError:
+                    logging.info("User %s blocked the bot, not retrying", user_id)
+                    await self.db.mark_broadcast_sent(run_key, user_id)
+                    counts['failed'] += 1
+                    return
+                except TelegramAPIError as error:
+                    logging.warning("Could not send recommendations to %s: %s", user_id, error)
+                    break
+                await self.db.mark_broadcast_sent(run_key, user_id)
+                counts['sent'] += 1
+                return
+            counts['failed'] += 1
+
+
+def next_run(at, now):
+    """The first datetime at time of day `at` (UTC) strictly after now."""
+    candidate = datetime.combine(now.date(), at, tzinfo=timezone.utc)
+    return candidate if candidate > now else candidate + timedelta(days=1)
+
+
+async def run_daily(broadcaster, at, clock=lambda: datetime.now(timezone.utc)):
+    """
+    Run the broadcast every day at time of day `at` (UTC), keyed by date.
+    If today's time has already passed on start, today's run is resumed at
+    once, so a restart mid-broadcast picks up where it stopped.
+    """
+    now = clock()
+    due = datetime.combine(now.date(), at, tzinfo=timezone.utc)
+    if due > now:
+        due = next_run(at, now)
+    while True:
+        delay = (due - clock()).total_seconds()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            await broadcaster.run(due.date().isoformat())
+            await broadcaster.db.prune_broadcast_log(KEEP_PROGRESS_DAYS)
+        except Exception:
+            logging.exception("Broadcast of %s failed", due.date())
+        due = next_run(at, max(due, clock()))
@@ -0,0 +1,139 @@
+"""
+Bulk import and export of observations as CSV or Parquet files.
+
+Every file holds the rows of one user with the columns
+optimization, variant, value, timestamp. Timestamps are written as UTC
+'YYYY-MM-DD HH:MM:SS' strings and may also be read as epoch seconds.
+Files are streamed in chunks, so memory use does not grow with their size.
+Parquet support needs the optional pyarrow package.
+
+    python bulk_io.py import commute.csv --user 12345
+    python bulk_io.py export backup.parquet --user 12345 --optimization "commute time"
+"""
+import argparse
+import csv
+import itertools
+from datetime import datetime, timezone
+
+from database_driver import DatabaseDriver
+
+COLUMNS = ("optimization", "variant", "value", "timestamp")
+CHUNK_SIZE = 10000
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet files need pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def _is_parquet(path):
+    return str(path).lower().endswith((".parquet", ".pq"))
+
+
+def _format_timestamp(epoch):
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def read_csv_rows(path):
+    """Yield (optimization, variant, value, timestamp) tuples from a CSV file with a header."""
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        missing = set(COLUMNS) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"CSV file '{path}' lacks the columns {sorted(missing)}.")
+        for record in reader:
+            yield tuple(record[column] for column in COLUMNS)
+
+
+def read_parquet_rows(path, batch_size=CHUNK_SIZE):
+    """Yield (optimization, variant, value, timestamp) tuples from a Parquet file."""
+    pa = _pyarrow()
+    parquet_file = pa.parquet.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=list(COLUMNS)):
+        yield from zip(*(batch.column(column).to_pylist() for column in COLUMNS))
+
+
+def read_rows(path):
+    return read_parquet_rows(path) if _is_parquet(path) else read_csv_rows(path)
+
+
+def write_csv_rows(path, rows):
+    """Write (optimization, variant, value, epoch) tuples to a CSV file, returns the row count."""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for optimization, variant, value, epoch in rows:
+            writer.writerow((optimization, variant, value, _format_timestamp(epoch)))
+            count += 1
+    return count
+
+
+def write_parquet_rows(path, rows, batch_size=CHUNK_SIZE):
+    """Write (optimization, variant, value, epoch) tuples to a Parquet file, returns the row count."""
+    pa = _pyarrow()
+    # values can be numbers or time strings, so the column is stored as text
+    schema = pa.schema([(column, pa.string()) for column in COLUMNS])
+    count = 0
+    rows = iter(rows)
+    with pa.parquet.ParquetWriter(path, schema) as writer:
+        while True:
+            chunk = list(itertools.islice(rows, batch_size))
+            if not chunk:
+                break
+            columns = list(zip(*chunk))
+            writer.write_table(pa.table({
+                "optimization": list(columns[0]),
+                "variant": list(columns[1]),
+                "value": [None if value is None else str(value) for value in columns[2]],
+                "timestamp": [_format_timestamp(epoch) for epoch in columns[3]],
+            }, schema=schema))
+            count += len(chunk)
+    return count
+
+
+def write_rows(path, rows):
+    return write_parquet_rows(path, rows) if _is_parquet(path) else write_csv_rows(path, rows)
+
+
+def import_file(db, path, user_id, chunk_size=CHUNK_SIZE):
+    """Import a CSV/Parquet file into db for user_id, returns the number of samples."""
+    return db.import_samples(user_id, read_rows(path), chunk_size=chunk_size)
+
+
+def export_file(db, path, user_id, optimization_name=None, chunk_size=CHUNK_SIZE):
+    """Export the samples of user_id (or one optimization) to a CSV/Parquet file."""
+    return write_rows(path, db.export_samples(user_id, optimization_name, chunk_size=chunk_size))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export observations as CSV or Parquet.")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("path", help="CSV file, or .parquet file (needs pyarrow)")
+    parser.add_argument("--user", type=int, required=True, help="telegram user id the rows belong to")
+    parser.add_argument("--optimization", help="export only this optimization")
+    parser.add_argument("--db", default="main_db.db", help="path to the SQLite database")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per transaction")
+    args = parser.parse_args(argv)
+
+    # pooled mode for its WAL and synchronous=NORMAL settings
+    db = DatabaseDriver(args.db, pool_size=1)
+    try:
+        if args.command == "import":
+            count = import_file(db, args.path, args.user, chunk_size=args.chunk_size)
+            print(f"Imported {count} samples from '{args.path}'.")
+        else:
+            count = export_file(db, args.path, args.user, args.optimization, chunk_size=args.chunk_size)
+            print(f"Exported {count} samples to '{args.path}'.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
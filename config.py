@@ -2,9 +2,9 @@
 import os
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
-from database_driver import DatabaseDriver
+from database_driver import AsyncDatabaseDriver
+from fsm_storage import SQLiteStorage
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,9 +15,13 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("No BOT_TOKEN provided in environment")
 
+# Time of day (HH:MM, UTC) of the daily recommendation broadcast; unset disables it
+BROADCAST_AT = os.getenv("BROADCAST_AT")
+
 bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
-storage = MemoryStorage()
+# FSM states of in-progress user flows, kept on disk so restarts don't drop them
+storage = SQLiteStorage(os.getenv("FSM_DB", "fsm_state.db"))
 dp = Dispatcher(storage=storage)
 
 # Simulated database to store optimizations
-optimizations_db = DatabaseDriver()
\ No newline at end of file
+optimizations_db = AsyncDatabaseDriver(pool_size=4, commit_delay=0.005, lazy=True)
\ No newline at end of file
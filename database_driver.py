@@ -1,24 +1,485 @@
+import math
 import sqlite3
-from datetime import datetime
+import queue
+import asyncio
+import logging
+import argparse
+import functools
+import itertools
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Prior of the normal-gamma posterior kept in variant_posterior,
+# must match the initial state of mvsampling.HandsTable.
+PRIOR_ALPHA = 0.5
+PRIOR_BETA = 0.5
+
+# Connection tuning used in pooled mode.
+POOL_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",   # WAL makes NORMAL crash-safe, only the last commit can be lost on power failure
+    "PRAGMA cache_size = -16000",    # 16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",  # map up to 256 MB of the file
+    "PRAGMA temp_store = MEMORY",
+)
+
+SECONDS_PER_DAY = 86400
+
+# change_datetime columns hold unix epoch seconds (UTC) since schema version 2
+NOW_EPOCH = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def to_epoch(value):
+    """
+    Unix epoch seconds for a sample time given as epoch number, datetime or
+    'YYYY-MM-DD HH:MM:SS' (or epoch) string. Naive datetimes and strings are
+    read as UTC, like SQLite's datetime('now'). None and '' give None.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return None if value is None else int(value)
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return None
+        if value.lstrip('-').isdigit():
+            return int(value)
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _merge_duplicates(cursor, table, key_columns, children):
+    """
+    Fold rows of `table` sharing key_columns into the oldest one, pointing
+    every (child_table, column) reference at the kept row first.
+    """
+    match = " AND ".join(f"k.{column} IS t.{column}" for column in key_columns)
+    cursor.execute("DROP TABLE IF EXISTS temp.merged_ids")
+    cursor.execute(f'''
+        CREATE TEMP TABLE merged_ids AS
+        SELECT t.id AS old_id, k.keep_id AS new_id
+        FROM {table} AS t
+        JOIN (
+            SELECT {", ".join(key_columns)}, MIN(id) AS keep_id
+            FROM {table}
+            GROUP BY {", ".join(key_columns)}
+        ) AS k
+        ON {match}
+        WHERE t.id != k.keep_id
+    ''')
+    for child_table, column in children:
+        cursor.execute(f'''
+            UPDATE {child_table}
+            SET {column} = (SELECT new_id FROM merged_ids WHERE old_id = {child_table}.{column})
+            WHERE {column} IN (SELECT old_id FROM merged_ids)
+        ''')
+    cursor.execute(f"DELETE FROM {table} WHERE id IN (SELECT old_id FROM merged_ids)")
+    merged = cursor.rowcount
+    cursor.execute("DROP TABLE temp.merged_ids")
+    if merged:
+        logging.warning("Merged %d duplicate rows of %s", merged, table)
+
+
+def _rebuild_table(cursor, table, create_sql, select_sql):
+    """
+    Replace `table` by the one in create_sql (which must create
+    `<table>_new`), filled by select_sql. Foreign keys have to be off.
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+    cursor.execute(create_sql)
+    cursor.execute(f"INSERT INTO {table}_new {select_sql}")
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    row = cursor.fetchone()
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    if row is not None:
+        # keep AUTOINCREMENT from handing out ids of deleted rows again
+        cursor.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (row[0], table)
+        )
+
+
+def _migration_unique_names(cursor):
+    """
+    Version 1: one optimization per (user, name) and one variant per
+    (optimization, name), enforced by unique indexes that also serve the
+    id lookups; a covering index for the sample window queries.
+    """
+    _merge_duplicates(cursor, "user_optimization", ("telegram_user_id", "optimization_name"),
+                      [("optimization_variant", "optimization_id"),
+                       ("optimization_samples", "optimization_id"),
+                       ("variant_posterior", "optimization_id")])
+    _merge_duplicates(cursor, "optimization_variant", ("optimization_id", "variant_name"),
+                      [("optimization_samples", "variant_id")])
+    # the unique indexes lead with the old single-column ones
+    cursor.execute("DROP INDEX IF EXISTS idx_user_optimization_user")
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_optimization_user_name
+        ON user_optimization(telegram_user_id, optimization_name)
+    ''')
+    cursor.execute("DROP INDEX IF EXISTS idx_optimization_variant_opt")
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_optimization_variant_opt_name
+        ON optimization_variant(optimization_id, variant_name)
+    ''')
+    cursor.execute("DROP INDEX IF EXISTS idx_optimization_samples_opt")
+    cursor.execute("DROP INDEX IF EXISTS idx_optimization_samples_opt_time")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_optimization_samples_opt_time
+        ON optimization_samples(optimization_id, change_datetime, variant_id, option_value)
+    ''')
+    # posteriors of merged variants are recomputed from their combined samples
+    DatabaseDriver._rebuild_posteriors(cursor)
+
+
+def _migration_epoch_datetimes(cursor):
+    """
+    Version 2: change_datetime and window_start become INTEGER unix epoch
+    seconds. SQLite can't change a column type, so the tables are rebuilt.
+    """
+    def epoch(column):
+        return (f"CASE WHEN typeof({column}) = 'text' "
+                f"THEN CAST(strftime('%s', {column}) AS INTEGER) ELSE {column} END")
+
+    _rebuild_table(cursor, "user_optimization", f'''
+        CREATE TABLE user_optimization_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            optimization_name TEXT NOT NULL,
+            change_datetime INTEGER DEFAULT ({NOW_EPOCH}),
+            telegram_user_id INTEGER,
+            FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+        )
+    ''', f"SELECT id, optimization_name, {epoch('change_datetime')}, telegram_user_id FROM user_optimization")
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_optimization_user_name
+        ON user_optimization(telegram_user_id, optimization_name)
+    ''')
+
+    _rebuild_table(cursor, "optimization_variant", f'''
+        CREATE TABLE optimization_variant_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            optimization_id INTEGER NOT NULL,
+            variant_name TEXT NOT NULL,
+            change_datetime INTEGER DEFAULT ({NOW_EPOCH}),
+            FOREIGN KEY (optimization_id) REFERENCES user_optimization(id) ON DELETE CASCADE
+        )
+    ''', f"SELECT id, optimization_id, variant_name, {epoch('change_datetime')} FROM optimization_variant")
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_optimization_variant_opt_name
+        ON optimization_variant(optimization_id, variant_name)
+    ''')
+
+    _rebuild_table(cursor, "optimization_samples", f'''
+        CREATE TABLE optimization_samples_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            optimization_id INTEGER NOT NULL,
+            variant_id INTEGER NOT NULL,
+            option_value NUMERIC,
+            change_datetime INTEGER DEFAULT ({NOW_EPOCH}),
+            FOREIGN KEY (optimization_id) REFERENCES user_optimization(id) ON DELETE CASCADE,
+            FOREIGN KEY (variant_id) REFERENCES optimization_variant(id) ON DELETE CASCADE
+        )
+    ''', f"SELECT id, optimization_id, variant_id, option_value, {epoch('change_datetime')} FROM optimization_samples")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_optimization_samples_variant ON optimization_samples(variant_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_optimization_samples_opt_time
+        ON optimization_samples(optimization_id, change_datetime, variant_id, option_value)
+    ''')
+
+    _rebuild_table(cursor, "variant_posterior", '''
+        CREATE TABLE variant_posterior_new (
+            variant_id INTEGER PRIMARY KEY,
+            optimization_id INTEGER NOT NULL,
+            Te INTEGER NOT NULL DEFAULT 0,
+            mu REAL NOT NULL DEFAULT 0.0,
+            alpha REAL NOT NULL DEFAULT 0.5,
+            beta REAL NOT NULL DEFAULT 0.5,
+            last_sample_id INTEGER NOT NULL DEFAULT 0,
+            window_start INTEGER,
+            FOREIGN KEY (variant_id) REFERENCES optimization_variant(id) ON DELETE CASCADE,
+            FOREIGN KEY (optimization_id) REFERENCES user_optimization(id) ON DELETE CASCADE
+        )
+    ''', f'''SELECT variant_id, optimization_id, Te, mu, alpha, beta, last_sample_id,
+              {epoch('window_start')} FROM variant_posterior''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_variant_posterior_opt ON variant_posterior(optimization_id)
+    ''')
+
+
+def _migration_broadcast_log(cursor):
+    """
+    Version 3: which users a scheduled broadcast run has already reached,
+    so an interrupted run resumes where it stopped.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_log (
+            run_key TEXT NOT NULL,
+            telegram_user_id INTEGER NOT NULL,
+            sent_at INTEGER NOT NULL,
+            PRIMARY KEY (run_key, telegram_user_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migration_window_days(cursor):
+    """
+    Version 4: variant_posterior.window_days records the window length its
+    window_start was computed for, so a request for another length can
+    rebuild instead of reusing the last window. Older windowed posteriors
+    don't know their length and are rebuilt from all samples.
+    """
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(variant_posterior)").fetchall()}
+    if "window_days" not in columns:
+        cursor.execute("ALTER TABLE variant_posterior ADD COLUMN window_days REAL")
+    cursor.execute(
+        "SELECT DISTINCT optimization_id FROM variant_posterior WHERE window_start IS NOT NULL AND window_days IS NULL"
+    )
+    for (optimization_id,) in cursor.fetchall():
+        DatabaseDriver._rebuild_posteriors(cursor, optimization_id)
+
+
+# Schema upgrades; the database's PRAGMA user_version is the number of
+# migrations already applied. Append new ones, never edit released ones.
+MIGRATIONS = (
+    _migration_unique_names,
+    _migration_epoch_datetimes,
+    _migration_broadcast_log,
+    _migration_window_days,
+)
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+class IdCache:
+    """
+    Bounded LRU map from name lookups to row ids, shared between threads.
+    Keys are ('optimization', user_id, optimization_name) and
+    ('variant', optimization_id, variant_name).
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """Drop every key for which predicate(key) is true."""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
 
 class DatabaseDriver:
-    def __init__(self, db_name='main_db.db'):
+    """
+    Access to the optimizations database.
+
+    By default a single connection serves every call. With pool_size > 0 the
+    database runs in WAL mode with one writer connection plus pool_size
+    read-only connections, so reads from other threads proceed while a write
+    is in progress. Every call uses its own cursor and the writer is guarded
+    by a lock, so one driver can be shared between threads.
+
+    Optimization and variant ids are resolved through an LRU cache of
+    id_cache_size entries (0 disables it), so a repeated add_option is a
+    single INSERT plus the posterior upsert. Only lookups on the writer
+    connection fill the cache, which keeps it consistent with
+    remove_optimization/remove_variant; pooled readers only consult it.
+    """
+
+    # Methods that never write; AsyncDatabaseDriver runs them on reader threads.
+    READ_METHODS = frozenset({
+        'get_optimizations', 'get_optimization_summaries',
+        'get_all_optimizations', 'get_variants',
+        'retrieve_optimization_id', 'get_optimization_name',
+        'get_samples_in_window', 'get_all_samples_for_optimization',
+        'id_cache_info', 'get_broadcast_sent', 'get_posterior_version',
+    })
+
+    def __init__(self, db_name='main_db.db', pool_size=0, id_cache_size=1024):
         self.db_name = db_name
-        self.conn = sqlite3.connect(self.db_name)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("PRAGMA foreign_keys = ON")  # Enable foreign key enforcement
+        self.pool_size = pool_size
+        self._ids = IdCache(id_cache_size)
+        self._write_lock = threading.RLock()
+        self._transaction_depth = 0
+        self.conn = self._connect()
+        if pool_size:
+            self.conn.execute("PRAGMA journal_mode = WAL")
         self.create_tables()
+        self._readers = None
+        if pool_size and db_name != ':memory:':
+            self._readers = queue.Queue()
+            for _ in range(pool_size):
+                reader = self._connect()
+                reader.execute("PRAGMA query_only = ON")
+                self._readers.put(reader)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")  # Enable foreign key enforcement
+        if self.pool_size:
+            for pragma in POOL_PRAGMAS:
+                conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def _reading(self):
+        """Cursor on a pooled reader, or on the writer when there is no pool."""
+        if self._readers is None:
+            with self._write_lock:
+                yield self.conn.cursor()
+            return
+        conn = self._readers.get()
+        try:
+            yield conn.cursor()
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def _writing(self):
+        """
+        Cursor on the writer; commits when the block succeeds, rolls back otherwise.
+        Inside transaction() the block runs in a savepoint instead and the
+        commit is left to the enclosing transaction.
+        """
+        with self._write_lock:
+            cursor = self.conn.cursor()
+            if self._transaction_depth:
+                cursor.execute("SAVEPOINT write_call")
+                try:
+                    yield cursor
+                except Exception:
+                    cursor.execute("ROLLBACK TO write_call")
+                    self._ids.clear()
+                    raise
+                finally:
+                    cursor.execute("RELEASE write_call")
+                return
+            try:
+                yield cursor
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                # the call may have cached ids of rows it created
+                self._ids.clear()
+                raise
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group several writes into one transaction and one commit.
+        Each write inside keeps its own savepoint, so a failing call only
+        undoes its own changes; the transaction is rolled back only when
+        the block itself raises.
+        """
+        with self._write_lock:
+            if self._transaction_depth == 0:
+                self.conn.execute("BEGIN")
+            self._transaction_depth += 1
+            try:
+                yield self
+            except Exception:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self.conn.rollback()
+                    # ids cached inside the transaction may name rolled back rows
+                    self._ids.clear()
+                raise
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                try:
+                    self.conn.commit()
+                except Exception:
+                    # e.g. SQLITE_BUSY: callers see the batch as failed, so it must not linger
+                    self.conn.rollback()
+                    self._ids.clear()
+                    raise
+
+    def execute_batch(self, calls):
+        """
+        Run several method calls in one transaction (group commit).
+        calls: iterable of (method_name, args, kwargs).
+        Returns a list of (result, exception) pairs in call order; a call
+        that raised is rolled back on its own and the others still commit.
+        """
+        outcomes = []
+        with self.transaction():
+            for name, args, kwargs in calls:
+                try:
+                    outcomes.append((getattr(self, name)(*args, **kwargs), None))
+                except Exception as error:
+                    outcomes.append((None, error))
+        return outcomes
 
     def create_tables(self):
+        """
+        Create the schema, or bring an existing database up to date by
+        applying the MIGRATIONS it hasn't seen yet.
+        """
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            with self._writing() as cursor:
+                self._create_tables(cursor)
+        self._migrate(version)
+
+    def _migrate(self, version):
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            # table rebuilds must not cascade; the pragma is a no-op inside a transaction
+            self.conn.execute("PRAGMA foreign_keys = OFF")
+            try:
+                with self.transaction(), self._writing() as cursor:
+                    migration(cursor)
+                    cursor.execute("PRAGMA foreign_key_check")
+                    if cursor.fetchone() is not None:
+                        raise sqlite3.IntegrityError(f"Migration {number} left dangling foreign keys.")
+                    cursor.execute(f"PRAGMA user_version = {number}")
+            finally:
+                self.conn.execute("PRAGMA foreign_keys = ON")
+            logging.info("Migrated %s to schema version %d", self.db_name, number)
+
+    def _create_tables(self, cursor):
+        """Schema version 0, which MIGRATIONS start from."""
         # Users table using telegram_user_id as the primary key
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 telegram_user_id INTEGER PRIMARY KEY
             )
         ''')
 
         # User Optimization table linked to users table by telegram_user_id
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS user_optimization (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 optimization_name TEXT NOT NULL,
@@ -29,7 +490,7 @@ class DatabaseDriver:
         ''')
 
         # Optimization Variant table linked to user_optimization (user info can be derived via join)
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS optimization_variant (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 optimization_id INTEGER NOT NULL,
@@ -40,7 +501,7 @@ class DatabaseDriver:
         ''')
 
         # Optimization Samples table linked to user_optimization and optimization_variant
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS optimization_samples (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 optimization_id INTEGER NOT NULL,
@@ -52,104 +513,173 @@ class DatabaseDriver:
             )
         ''')
 
+        # Per-variant posterior sufficient statistics, maintained by add_option so
+        # that recommendations don't need to replay every sample. Databases
+        # from before this table get it filled by the first migration.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS variant_posterior (
+                variant_id INTEGER PRIMARY KEY,
+                optimization_id INTEGER NOT NULL,
+                Te INTEGER NOT NULL DEFAULT 0,
+                mu REAL NOT NULL DEFAULT 0.0,
+                alpha REAL NOT NULL DEFAULT 0.5,
+                beta REAL NOT NULL DEFAULT 0.5,
+                last_sample_id INTEGER NOT NULL DEFAULT 0,
+                window_start TEXT,
+                FOREIGN KEY (variant_id) REFERENCES optimization_variant(id) ON DELETE CASCADE,
+                FOREIGN KEY (optimization_id) REFERENCES user_optimization(id) ON DELETE CASCADE
+            )
+        ''')
+
         # Add indexes on foreign key columns for improved query performance
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_user_optimization_user ON user_optimization(telegram_user_id)
         ''')
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_optimization_variant_opt ON optimization_variant(optimization_id)
         ''')
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_optimization_samples_opt ON optimization_samples(optimization_id)
         ''')
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_optimization_samples_variant ON optimization_samples(variant_id)
         ''')
-
-        self.conn.commit()
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_variant_posterior_opt ON variant_posterior(optimization_id)
+        ''')
+        # Window queries filter samples of one optimization by time
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_optimization_samples_opt_time
+            ON optimization_samples(optimization_id, change_datetime)
+        ''')
 
 
     def add_optimization(self, optimization_name, telegram_user_id):
-        # Ensure the user exists or insert them
-        self.cursor.execute(
-            "SELECT telegram_user_id FROM users WHERE telegram_user_id = ?",
-            (telegram_user_id,)
-        )
-        user_row = self.cursor.fetchone()
-        if user_row is None:
-            self.cursor.execute(
-                "INSERT INTO users (telegram_user_id) VALUES (?)",
+        with self._writing() as cursor:
+            # Ensure the user exists or insert them
+            cursor.execute(
+                "INSERT OR IGNORE INTO users (telegram_user_id) VALUES (?)",
                 (telegram_user_id,)
             )
-            self.conn.commit()
-            user_id = self.cursor.lastrowid
-        else:
-            user_id = user_row[0]
-
-        self.cursor.execute(
-            '''
-            INSERT INTO user_optimization (optimization_name, telegram_user_id)
-            VALUES (?, ?)
-            ''',
-            (optimization_name, user_id)
-        )
-        self.conn.commit()
+            try:
+                cursor.execute(
+                    '''
+                    INSERT INTO user_optimization (optimization_name, telegram_user_id)
+                    VALUES (?, ?)
+                    ''',
+                    (optimization_name, telegram_user_id)
+                )
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Optimization '{optimization_name}' already exists.") from None
 
     def get_optimizations(self, user_id):
         # Get all optimizations for a specific user by telegram_user_id
-
-        self.cursor.execute(
-            '''
-            SELECT optimization_name, change_datetime, id 
-            FROM user_optimization 
-            WHERE telegram_user_id = ?
-            ''',
-            (user_id,)
-        )
-        return self.cursor.fetchall()
+        with self._reading() as cursor:
+            cursor.execute(
+                '''
+                SELECT optimization_name, change_datetime, id 
+                FROM user_optimization 
+                WHERE telegram_user_id = ?
+                ORDER BY id
+                ''',
+                (user_id,)
+            )
+            return cursor.fetchall()
     
+    def get_optimization_summaries(self, user_id):
+        """
+        A user's optimizations with their variant and sample counts in one
+        query, instead of a get_variants call per optimization.
+        Returns a list of tuples, oldest optimization first:
+        optimization_name, change_datetime, id, variant_count, sample_count,
+        last_activity (newest change_datetime of the optimization, its
+        variants and samples)
+        """
+        with self._reading() as cursor:
+            cursor.execute(
+                '''
+                SELECT
+                o.optimization_name,
+                o.change_datetime,
+                o.id,
+                (SELECT COUNT(*) FROM optimization_variant WHERE optimization_id = o.id),
+                (SELECT COUNT(*) FROM optimization_samples WHERE optimization_id = o.id),
+                MAX(
+                    o.change_datetime,
+                    COALESCE((SELECT MAX(change_datetime) FROM optimization_variant
+                              WHERE optimization_id = o.id), o.change_datetime),
+                    COALESCE((SELECT MAX(change_datetime) FROM optimization_samples
+                              WHERE optimization_id = o.id), o.change_datetime)
+                )
+                FROM user_optimization AS o
+                WHERE o.telegram_user_id = ?
+                ORDER BY o.id
+                ''',
+                (user_id,)
+            )
+            return cursor.fetchall()
+
     def get_all_optimizations(self):
-        self.cursor.execute(
-            '''
-            SELECT optimization_name, change_datetime, telegram_user_id
-            FROM user_optimization
-            '''
-        )
-        return self.cursor.fetchall()
+        with self._reading() as cursor:
+            cursor.execute(
+                '''
+                SELECT optimization_name, change_datetime, telegram_user_id
+                FROM user_optimization
+                '''
+            )
+            return cursor.fetchall()
     
     def add_variant(self, optimization_name, variant_name, user_id):
         '''
         optimization_variant and user_optimization tables are used
         to store the optimization name and its variants.
         '''
-        # get optimization_id from optimization_name and user_id
-        optimization_id = self.retrieve_optimization_id(optimization_name, user_id)
-        print(optimization_id)
-
-        self.cursor.execute(
-            '''
-            INSERT INTO optimization_variant (optimization_id, variant_name)
-            VALUES (?, ?)
-            ''',
-            (optimization_id, variant_name)
-        )
-        self.conn.commit()
+        with self._writing() as cursor:
+            # get optimization_id from optimization_name and user_id
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+            try:
+                cursor.execute(
+                    '''
+                    INSERT INTO optimization_variant (optimization_id, variant_name)
+                    VALUES (?, ?)
+                    ''',
+                    (optimization_id, variant_name)
+                )
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Variant '{variant_name}' already exists in optimization '{optimization_name}'.") from None
+            cursor.execute(
+                '''
+                INSERT INTO variant_posterior (variant_id, optimization_id, alpha, beta)
+                VALUES (?, ?, ?, ?)
+                ''',
+                (cursor.lastrowid, optimization_id, PRIOR_ALPHA, PRIOR_BETA)
+            )
     
     def get_variants(self, optimization_name, user_id):
-        # get optimization_id from optimization_name and user_id
-        optimization_id = self.retrieve_optimization_id(optimization_name, user_id)
-        self.cursor.execute(
-            '''
-            SELECT variant_name, change_datetime
-            FROM optimization_variant
-            WHERE optimization_id = ?
-            ''',
-            (optimization_id,)
-        )
-        return self.cursor.fetchall()
+        with self._reading() as cursor:
+            # get optimization_id from optimization_name and user_id
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+            cursor.execute(
+                '''
+                SELECT variant_name, change_datetime
+                FROM optimization_variant
+                WHERE optimization_id = ?
+                ORDER BY id
+                ''',
+                (optimization_id,)
+            )
+            return cursor.fetchall()
 
     def retrieve_optimization_id(self, optimization_name, user_id):
-        self.cursor.execute(
+        with self._reading() as cursor:
+            return self._optimization_id(cursor, optimization_name, user_id)
+
+    def _optimization_id(self, cursor, optimization_name, user_id):
+        key = ('optimization', user_id, optimization_name)
+        optimization_id = self._ids.get(key)
+        if optimization_id is not None:
+            return optimization_id
+        cursor.execute(
             '''
             SELECT id
             FROM user_optimization
@@ -157,22 +687,51 @@ class DatabaseDriver:
             ''',
             (optimization_name, user_id)
         )
-        optimization_id = int(self.cursor.fetchone()[0])
+        optimization_id = int(cursor.fetchone()[0])
+        if cursor.connection is self.conn:
+            self._ids.put(key, optimization_id)
         return optimization_id
 
+    def _variant_id(self, cursor, optimization_id, variant_name):
+        """Id of the named variant, None when the optimization has no such variant."""
+        key = ('variant', optimization_id, variant_name)
+        variant_id = self._ids.get(key)
+        if variant_id is not None:
+            return variant_id
+        cursor.execute(
+            '''
+            SELECT id
+            FROM optimization_variant
+            WHERE optimization_id = ? AND variant_name = ?
+            ''',
+            (optimization_id, variant_name)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        variant_id = int(row[0])
+        if cursor.connection is self.conn:
+            self._ids.put(key, variant_id)
+        return variant_id
+
+    def id_cache_info(self):
+        """Hits, misses, maxsize and current size of the id cache."""
+        return self._ids.info()
+
     def get_optimization_name(self, optimization_id) -> str:
         """
         Retrieve the optimization name based on the optimization_id.
         """
-        self.cursor.execute(
-            '''
-            SELECT optimization_name
-            FROM user_optimization
-            WHERE id = ?
-            ''',
-            (optimization_id,)
-        )
-        optimization_name = self.cursor.fetchone()[0]
+        with self._reading() as cursor:
+            cursor.execute(
+                '''
+                SELECT optimization_name
+                FROM user_optimization
+                WHERE id = ?
+                ''',
+                (optimization_id,)
+            )
+            optimization_name = cursor.fetchone()[0]
         return optimization_name
     
     def remove_optimization(self, optimization_name, user_id):
@@ -180,40 +739,45 @@ class DatabaseDriver:
         Remove a specific optimization by its name and user ID,
         and also remove all associated variants and samples.
         """
-        self.cursor.execute(
-            '''
-            SELECT id, telegram_user_id
-            FROM user_optimization
-            WHERE optimization_name = ? AND telegram_user_id = ?
-            ''',
-            (optimization_name, user_id)
-        )
-        optimization_id, telegram_user_id = self.cursor.fetchone()
-        self.cursor.execute(
-            '''
-            DELETE FROM user_optimization
-            WHERE id = ? AND telegram_user_id = ?
-            ''',
-            (optimization_id, telegram_user_id)
-        )
-        self.conn.commit()
+        with self._writing() as cursor:
+            cursor.execute(
+                '''
+                SELECT id, telegram_user_id
+                FROM user_optimization
+                WHERE optimization_name = ? AND telegram_user_id = ?
+                ''',
+                (optimization_name, user_id)
+            )
+            optimization_id, telegram_user_id = cursor.fetchone()
+            cursor.execute(
+                '''
+                DELETE FROM user_optimization
+                WHERE id = ? AND telegram_user_id = ?
+                ''',
+                (optimization_id, telegram_user_id)
+            )
+            self._ids.invalidate(
+                lambda key: key == ('optimization', user_id, optimization_name)
+                or key[:2] == ('variant', optimization_id)
+            )
     
     def remove_variant(self, optimization_name, variant_name, user_id):
         """
         Remove a specific variant from an optimization.
         """
-        # Find optimization by user and optimization name
-        optimization_id = self.retrieve_optimization_id(optimization_name, user_id)
+        with self._writing() as cursor:
+            # Find optimization by user and optimization name
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
 
-        # Remove the variant itself.
-        self.cursor.execute(
-            '''
-            DELETE FROM optimization_variant
-            WHERE optimization_id = ? AND variant_name = ?
-            ''',
-            (optimization_id, variant_name)
-        )
-        self.conn.commit()
+            # Remove the variant itself.
+            cursor.execute(
+                '''
+                DELETE FROM optimization_variant
+                WHERE optimization_id = ? AND variant_name = ?
+                ''',
+                (optimization_id, variant_name)
+            )
+            self._ids.invalidate(lambda key: key == ('variant', optimization_id, variant_name))
     
     def add_option(self, optimization_name, variant_name, option_value, user_id):
         """
@@ -221,35 +785,541 @@ class DatabaseDriver:
         Uses the normalized schema:
           - Retrieves optimization_id from user_optimization using optimization_name and user_id.
           - Retrieves variant_id from optimization_variant using optimization_id and variant_name.
+            Both lookups are served from the id cache when possible.
           - Inserts a record into optimization_samples with optimization_id, variant_id,
             the provided option_value, and the current datetime.
+        The variant's posterior is updated in the same transaction when
+        SQLite stores the value as a number. A value SQLite reads as an
+        infinite number (e.g. '1e400') raises ValueError and is not stored.
+        """
+        with self._writing() as cursor:
+            # Retrieve the optimization id
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+
+            # Retrieve the variant_id from optimization_variant
+            variant_id = self._variant_id(cursor, optimization_id, variant_name)
+            if variant_id is None:
+                raise ValueError(f"No variant '{variant_name}' found for optimization '{optimization_name}'.")
+
+            # Insert into optimization_samples table with optimization_id, variant_id, option_value.
+            cursor.execute(
+                '''
+                INSERT INTO optimization_samples (optimization_id, variant_id, option_value)
+                VALUES (?, ?, ?)
+                ''',
+                (optimization_id, variant_id, option_value)
+            )
+            sample_id = cursor.lastrowid
+            # Fold the value as SQLite stored it, with the same typeof rule
+            # as the rebuild and the window expiry: '1_000' or 'infinity'
+            # parse as floats in Python but are kept as text.
+            cursor.execute(
+                '''
+                SELECT option_value FROM optimization_samples
+                WHERE id = ? AND typeof(option_value) IN ('integer', 'real')
+                ''',
+                (sample_id,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                # not a number, so it can't contribute to the posterior
+                logging.warning("Sample %s has non-numeric value %r", sample_id, option_value)
+                return
+            if not math.isfinite(row[0]):
+                raise ValueError(f"Value {option_value!r} is not a finite number.")
+            self._update_posterior(cursor, optimization_id, variant_id, row[0], sample_id)
+
+    @staticmethod
+    def _update_posterior(cursor, optimization_id, variant_id, value, sample_id):
         """
-        # Retrieve the optimization id
-        optimization_id = self.retrieve_optimization_id(optimization_name, user_id)
-        
-        # Retrieve the variant_id from optimization_variant
-        self.cursor.execute(
+        Fold one observation into the variant's posterior, with the same
+        update as mvsampling.HandsTable.update_hands. All right-hand sides
+        of an UPDATE see the old row, so mu/beta use the previous Te and mu.
+        """
+        cursor.execute(
             '''
-            SELECT id 
-            FROM optimization_variant
-            WHERE optimization_id = ? AND variant_name = ?
+            INSERT INTO variant_posterior
+                (variant_id, optimization_id, Te, mu, alpha, beta, last_sample_id)
+            VALUES (?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT(variant_id) DO UPDATE SET
+                beta = beta + Te * (excluded.mu - mu) * (excluded.mu - mu) / (2.0 * (Te + 1)),
+                mu = mu + (excluded.mu - mu) / (Te + 1),
+                Te = Te + 1,
+                alpha = alpha + 0.5,
+                last_sample_id = excluded.last_sample_id
             ''',
+            (variant_id, optimization_id, value, PRIOR_ALPHA + 0.5, PRIOR_BETA, sample_id)
+        )
+
+    def add_options(self, optimization_name, user_id, rows):
+        """
+        Bulk insert samples for one optimization with a single executemany,
+        e.g. to import a backfill of observations.
+        rows: iterable of (variant_name, option_value) or
+        (variant_name, option_value, change_datetime) tuples, change_datetime
+        as accepted by to_epoch.
+        Unknown variant names raise ValueError and nothing is inserted. The
+        optimization's posteriors are recomputed afterwards, since
+        backfilled samples can be older than the ones already stored.
+        Returns the number of inserted samples.
+        """
+        with self._writing() as cursor:
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+            cursor.execute(
+                '''
+                SELECT variant_name, id
+                FROM optimization_variant
+                WHERE optimization_id = ?
+                ''',
+                (optimization_id,)
+            )
+            variant_ids = dict(cursor.fetchall())
+            params = []
+            for variant_name, option_value, *change_datetime in rows:
+                if variant_name not in variant_ids:
+                    raise ValueError(f"No variant '{variant_name}' found for optimization '{optimization_name}'.")
+                change_datetime = to_epoch(change_datetime[0]) if change_datetime else None
+                params.append((optimization_id, variant_ids[variant_name], option_value, change_datetime))
+            cursor.executemany(
+                f'''
+                INSERT INTO optimization_samples (optimization_id, variant_id, option_value, change_datetime)
+                VALUES (?, ?, ?, COALESCE(?, {NOW_EPOCH}))
+                ''',
+                params
+            )
+            self._rebuild_posteriors(cursor, optimization_id)
+        return len(params)
+
+    def import_samples(self, user_id, rows, chunk_size=10000):
+        """
+        Stream samples of one user into the database, e.g. years of logs.
+        rows: iterable of (optimization_name, variant_name, option_value,
+        change_datetime) tuples, change_datetime as accepted by to_epoch
+        (None for now). Missing optimizations and variants are created.
+        Rows are consumed chunk_size at a time and every chunk is one
+        executemany and one commit, so memory stays constant; if a chunk
+        fails, the chunks before it stay imported. Posteriors of every
+        touched optimization are rebuilt at the end.
+        Returns the number of imported samples.
+        """
+        rows = iter(rows)
+        ids = {}
+        touched = set()
+        imported = 0
+        try:
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+                with self._writing() as cursor:
+                    params = []
+                    for optimization_name, variant_name, option_value, change_datetime in chunk:
+                        key = (optimization_name, variant_name)
+                        if key not in ids:
+                            ids[key] = self._ensure_variant(cursor, user_id, optimization_name, variant_name)
+                        optimization_id, variant_id = ids[key]
+                        touched.add(optimization_id)
+                        params.append((optimization_id, variant_id, option_value, to_epoch(change_datetime)))
+                    cursor.executemany(
+                        f'''
+                        INSERT INTO optimization_samples (optimization_id, variant_id, option_value, change_datetime)
+                        VALUES (?, ?, ?, COALESCE(?, {NOW_EPOCH}))
+                        ''',
+                        params
+                    )
+                imported += len(params)
+                logging.debug("Imported %d samples", imported)
+        finally:
+            if touched:
+                with self._writing() as cursor:
+                    for optimization_id in sorted(touched):
+                        self._rebuild_posteriors(cursor, optimization_id)
+        return imported
+
+    def _ensure_variant(self, cursor, user_id, optimization_name, variant_name):
+        """(optimization_id, variant_id) of the named variant, created when missing."""
+        cursor.execute("INSERT OR IGNORE INTO users (telegram_user_id) VALUES (?)", (user_id,))
+        cursor.execute(
+            "INSERT OR IGNORE INTO user_optimization (optimization_name, telegram_user_id) VALUES (?, ?)",
+            (optimization_name, user_id)
+        )
+        optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+        cursor.execute(
+            "INSERT OR IGNORE INTO optimization_variant (optimization_id, variant_name) VALUES (?, ?)",
             (optimization_id, variant_name)
         )
-        row = self.cursor.fetchone()
-        if row is None:
-            raise ValueError(f"No variant '{variant_name}' found for optimization '{optimization_name}'.")
-        variant_id = int(row[0])
-        
-        # Insert into optimization_samples table with optimization_id, variant_id, option_value.
-        self.cursor.execute(
+        return optimization_id, self._variant_id(cursor, optimization_id, variant_name)
+
+    def export_samples(self, user_id, optimization_name=None, chunk_size=10000):
+        """
+        Generate a user's samples, or those of one optimization, oldest id
+        first as (optimization_name, variant_name, option_value,
+        change_datetime) tuples, the row format import_samples reads.
+        Rows are fetched chunk_size at a time by keyset pagination on the
+        sample id, so no connection or lock is held between chunks.
+        """
+        last_id = 0
+        while True:
+            with self._reading() as cursor:
+                cursor.execute(
+                    '''
+                    SELECT s.id, o.optimization_name, v.variant_name, s.option_value, s.change_datetime
+                    FROM optimization_samples AS s
+                    -- CROSS JOIN keeps samples as the outer loop: a rowid range
+                    -- scan per page instead of sorting all of the user's samples
+                    CROSS JOIN user_optimization AS o
+                    ON o.id = s.optimization_id
+                    JOIN optimization_variant AS v
+                    ON v.id = s.variant_id
+                    WHERE o.telegram_user_id = ?
+                    AND (? IS NULL OR o.optimization_name = ?)
+                    AND s.id > ?
+                    ORDER BY s.id
+                    LIMIT ?
+                    ''',
+                    (user_id, optimization_name, optimization_name, last_id, chunk_size)
+                )
+                chunk = cursor.fetchall()
+            if not chunk:
+                return
+            last_id = chunk[-1][0]
+            for row in chunk:
+                yield row[1:]
+
+    def get_samples_in_window(self, user_id, optimization_name, days=91):
+        """
+        Retrieve the numeric samples of an optimization taken at most `days`
+        days before its newest sample, oldest first. Filtering and typing
+        happen in SQL on the covering (optimization_id, change_datetime,
+        variant_id, option_value) index.
+        Returns a list of tuples:
+        variant_name, option_value (float), change_datetime (unix epoch seconds)
+        """
+        with self._reading() as cursor:
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+            cursor.execute(
+                '''
+                SELECT
+                v.variant_name,
+                CAST(s.option_value AS REAL),
+                s.change_datetime
+                FROM optimization_samples AS s
+                JOIN optimization_variant AS v
+                ON s.variant_id = v.id
+                WHERE s.optimization_id = ?
+                AND s.change_datetime >= (
+                    SELECT MAX(change_datetime) - ?
+                    FROM optimization_samples
+                    WHERE optimization_id = ?
+                )
+                AND typeof(s.option_value) IN ('integer', 'real')
+                ORDER BY s.change_datetime, s.id
+                ''',
+                (optimization_id, days * SECONDS_PER_DAY, optimization_id)
+            )
+            return cursor.fetchall()
+
+    def get_posterior(self, optimization_name, user_id, days=None):
+        """
+        Retrieve the posterior of every variant of an optimization in one query.
+        With days, only samples from the last `days` days before the newest
+        sample count (see _apply_window); without, all samples do.
+        Returns a list of tuples:
+        variant_name, Te, mu, alpha, beta, last_sample_id
+        """
+        if days is None:
+            with self._reading() as cursor:
+                optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+                cursor.execute(
+                    "SELECT 1 FROM variant_posterior WHERE optimization_id = ? AND window_days IS NOT NULL LIMIT 1",
+                    (optimization_id,)
+                )
+                if cursor.fetchone() is None:
+                    return self._select_posterior(cursor, optimization_id)
+        # read back on the writer so the result includes the expiry even
+        # before an enclosing transaction commits
+        with self._writing() as cursor:
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+            self._apply_window(cursor, optimization_id, days)
+            return self._select_posterior(cursor, optimization_id)
+
+    def _has_windows(self):
+        """Whether any stored posterior is limited to a window."""
+        with self._reading() as cursor:
+            cursor.execute("SELECT 1 FROM variant_posterior WHERE window_days IS NOT NULL LIMIT 1")
+            return cursor.fetchone() is not None
+
+    def get_posterior_version(self, optimization_name, user_id):
+        """
+        (optimization_id, newest sample id in the stored posterior, variant
+        count): a cheap key that changes whenever add_option, add_variant or
+        an import moves the posterior. The sample id is 0 before the first
+        sample.
+        """
+        with self._reading() as cursor:
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
+            cursor.execute(
+                '''
+                SELECT COALESCE(MAX(p.last_sample_id), 0), COUNT(*)
+                FROM optimization_variant AS v
+                LEFT JOIN variant_posterior AS p
+                ON p.variant_id = v.id
+                WHERE v.optimization_id = ?
+                ''',
+                (optimization_id,)
+            )
+            return (optimization_id,) + cursor.fetchone()
+
+    def get_all_posteriors(self, days=None, after_user_id=None, limit=None):
+        """
+        Posteriors of every variant of every optimization in one query, for
+        bulk jobs such as mvsampling.batch.BatchSampler. The posteriors of
+        the returned optimizations are limited to the last `days` days first,
+        or cover all samples when days is None, as in get_posterior. Returns a list of tuples ordered by user, optimization
+        and variant, so the variants of an optimization are adjacent:
+        telegram_user_id, optimization_id, optimization_name, variant_name,
+        Te, mu, alpha, beta
+
+        after_user_id and limit page through the users that have at least
+        one variant: a page holds all rows of up to `limit` users with ids
+        above after_user_id, and an empty page means there are no more.
+        """
+        users = '''
+            SELECT DISTINCT o.telegram_user_id
+            FROM user_optimization AS o
+            JOIN optimization_variant AS v
+            ON v.optimization_id = o.id
+            WHERE ?1 IS NULL OR o.telegram_user_id > ?1
+            ORDER BY o.telegram_user_id
+            LIMIT ?2
+        '''
+        query = f'''
+            SELECT
+            o.telegram_user_id,
+            o.id,
+            o.optimization_name,
+            v.variant_name,
+            COALESCE(p.Te, 0),
+            COALESCE(p.mu, 0.0),
+            COALESCE(p.alpha, ?3),
+            COALESCE(p.beta, ?4)
+            FROM user_optimization AS o
+            JOIN optimization_variant AS v
+            ON v.optimization_id = o.id
+            LEFT JOIN variant_posterior AS p
+            ON p.variant_id = v.id
+            WHERE o.telegram_user_id IN ({users})
+            ORDER BY o.telegram_user_id, o.id, v.id
+        '''
+        # a negative LIMIT is no limit
+        page = (after_user_id, -1 if limit is None else limit)
+        if days is not None or self._has_windows():
+            with self._writing() as cursor:
+                cursor.execute(f"SELECT id FROM user_optimization WHERE telegram_user_id IN ({users})", page)
+                for (optimization_id,) in cursor.fetchall():
+                    self._apply_window(cursor, optimization_id, days)
+                cursor.execute(query, page + (PRIOR_ALPHA, PRIOR_BETA))
+                return cursor.fetchall()
+        with self._reading() as cursor:
+            cursor.execute(query, page + (PRIOR_ALPHA, PRIOR_BETA))
+            return cursor.fetchall()
+
+    def mark_broadcast_sent(self, run_key, user_id):
+        with self._writing() as cursor:
+            cursor.execute(
+                f'''
+                INSERT OR IGNORE INTO broadcast_log (run_key, telegram_user_id, sent_at)
+                VALUES (?, ?, {NOW_EPOCH})
+                ''',
+                (run_key, user_id)
+            )
+
+    def get_broadcast_sent(self, run_key):
+        """Ids of the users the broadcast run_key has already reached."""
+        with self._reading() as cursor:
+            cursor.execute("SELECT telegram_user_id FROM broadcast_log WHERE run_key = ?", (run_key,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def prune_broadcast_log(self, keep_days):
+        """Forget broadcast progress older than keep_days."""
+        with self._writing() as cursor:
+            cursor.execute(
+                f"DELETE FROM broadcast_log WHERE sent_at < {NOW_EPOCH} - ?",
+                (keep_days * SECONDS_PER_DAY,)
+            )
+            return cursor.rowcount
+
+    @staticmethod
+    def _select_posterior(cursor, optimization_id):
+        cursor.execute(
+            '''
+            SELECT
+            v.variant_name,
+            COALESCE(p.Te, 0),
+            COALESCE(p.mu, 0.0),
+            COALESCE(p.alpha, ?),
+            COALESCE(p.beta, ?),
+            COALESCE(p.last_sample_id, 0)
+            FROM optimization_variant AS v
+            LEFT JOIN variant_posterior AS p
+            ON p.variant_id = v.id
+            WHERE v.optimization_id = ?
+            ORDER BY v.id
+            ''',
+            (PRIOR_ALPHA, PRIOR_BETA, optimization_id)
+        )
+        return cursor.fetchall()
+
+    def _apply_window(self, cursor, optimization_id, days):
+        """
+        Make the stored posterior of an optimization cover the last `days`
+        days before its newest sample, or all samples when days is None.
+        Each posterior row records the window_start and window_days it was
+        cut to: a horizon at or after window_start moves forward
+        incrementally. A longer window, none, or a horizon that moved back
+        (remove_variant can delete the newest samples) needs samples that
+        were taken out, so the posterior is rebuilt first.
+        """
+        cursor.execute(
+            '''
+            SELECT MIN(window_days), MAX(window_start)
+            FROM variant_posterior
+            WHERE optimization_id = ?
+            ''',
+            (optimization_id,)
+        )
+        current, start = cursor.fetchone()
+        horizon = None
+        if days is not None:
+            cursor.execute(
+                '''
+                SELECT MAX(change_datetime) - ?
+                FROM optimization_samples
+                WHERE optimization_id = ?
+                ''',
+                (days * SECONDS_PER_DAY, optimization_id)
+            )
+            horizon = cursor.fetchone()[0]
+        if current is not None and (
+            days is None or days > current
+            or (start is not None and (horizon is None or horizon < start))
+        ):
+            self._rebuild_posteriors(cursor, optimization_id)
+        if horizon is not None:
+            self._expire_posterior(cursor, optimization_id, days, horizon)
+
+    def _expire_posterior(self, cursor, optimization_id, days, horizon):
+        """
+        Move the posterior window of an optimization forward to horizon
+        (newest sample minus `days`). window_start marks where the stored
+        posterior begins; samples between it and the horizon are taken back
+        out one by one, so the cost is O(expired samples) rather than a
+        replay. Only valid when the posterior holds no sample older than its
+        window_start and the horizon isn't before it, see _apply_window.
+        """
+        cursor.execute(
+            '''
+            SELECT s.variant_id, s.option_value
+            FROM optimization_samples AS s
+            JOIN variant_posterior AS p
+            ON p.variant_id = s.variant_id
+            WHERE s.optimization_id = ?
+            AND s.change_datetime < ?
+            AND (p.window_start IS NULL OR s.change_datetime >= p.window_start)
+            AND typeof(s.option_value) IN ('integer', 'real')
+            ORDER BY s.id
+            ''',
+            (optimization_id, horizon)
+        )
+        expired = cursor.fetchall()
+        if expired:
+            self._remove_expired(cursor, optimization_id, expired)
+        cursor.execute(
+            '''
+            UPDATE variant_posterior SET window_start = ?1, window_days = ?2
+            WHERE optimization_id = ?3 AND (window_start IS NOT ?1 OR window_days IS NOT ?2)
+            ''',
+            (horizon, days, optimization_id)
+        )
+
+    def _remove_expired(self, cursor, optimization_id, expired):
+        cursor.execute(
+            '''
+            SELECT variant_id, Te, mu, alpha, beta
+            FROM variant_posterior
+            WHERE optimization_id = ?
+            ''',
+            (optimization_id,)
+        )
+        state = {row[0]: row[1:] for row in cursor.fetchall()}
+        for variant_id, value in expired:
+            state[variant_id] = self._remove_observation(*state[variant_id], float(value))
+        cursor.executemany(
             '''
-            INSERT INTO optimization_samples (optimization_id, variant_id, option_value)
-            VALUES (?, ?, ?)
+            UPDATE variant_posterior
+            SET Te = ?, mu = ?, alpha = ?, beta = ?
+            WHERE variant_id = ?
             ''',
-            (optimization_id, variant_id, option_value)
+            [(*params, variant_id) for variant_id, params in state.items()]
+        )
+
+    @staticmethod
+    def _remove_observation(te, mu, alpha, beta, value):
+        """Inverse of the update in _update_posterior."""
+        if te <= 1:
+            return 0, 0.0, PRIOR_ALPHA, PRIOR_BETA
+        rest = te - 1
+        mu_rest = (te * mu - value) / rest
+        beta_rest = beta - rest / te * (value - mu_rest) ** 2 / 2
+        # rounding must never push the rate below the prior
+        return rest, mu_rest, alpha - 0.5, max(beta_rest, PRIOR_BETA)
+
+    def rebuild_posteriors(self):
+        """
+        Recompute variant_posterior from optimization_samples for every variant.
+        Needed for databases that collected samples before the table existed.
+        The per-variant state is count, mean and half the sum of squared
+        deviations on top of the prior, which is what sequential updates give.
+        The result covers all samples; windowed reads expire old ones again.
+        """
+        with self._writing() as cursor:
+            self._rebuild_posteriors(cursor)
+
+    @staticmethod
+    def _rebuild_posteriors(cursor, optimization_id=None):
+        """Recompute variant_posterior for one optimization, or all when None."""
+        cursor.execute(
+            "DELETE FROM variant_posterior WHERE ? IS NULL OR optimization_id = ?",
+            (optimization_id, optimization_id)
+        )
+        cursor.execute(
+            '''
+            INSERT INTO variant_posterior
+                (variant_id, optimization_id, Te, mu, alpha, beta, last_sample_id)
+            SELECT
+            v.id,
+            v.optimization_id,
+            COUNT(s.id),
+            COALESCE(AVG(s.option_value), 0.0),
+            ? + COUNT(s.id) / 2.0,
+            ? + COALESCE(SUM((s.option_value - m.mean) * (s.option_value - m.mean)), 0.0) / 2.0,
+            COALESCE(MAX(s.id), 0)
+            FROM optimization_variant AS v
+            LEFT JOIN optimization_samples AS s
+            ON s.variant_id = v.id AND typeof(s.option_value) IN ('integer', 'real')
+            LEFT JOIN (
+                SELECT variant_id, AVG(option_value) AS mean
+                FROM optimization_samples
+                WHERE typeof(option_value) IN ('integer', 'real')
+                AND (? IS NULL OR optimization_id = ?)
+                GROUP BY variant_id
+            ) AS m
+            ON m.variant_id = v.id
+            WHERE ? IS NULL OR v.optimization_id = ?
+            GROUP BY v.id
+            ''',
+            (PRIOR_ALPHA, PRIOR_BETA) + (optimization_id,) * 4
         )
-        self.conn.commit()
     
     def get_all_samples_for_optimization(self, user_id, optimization_name):
         """
@@ -259,35 +1329,150 @@ class DatabaseDriver:
         Each tuple contains:
         optimization_name, variant_name, option_value, change_datetime
         """
-        # get optimization_id from optimization_name and user_id
-        optimization_id = self.retrieve_optimization_id(optimization_name, user_id)
-        
+        with self._reading() as cursor:
+            # get optimization_id from optimization_name and user_id
+            optimization_id = self._optimization_id(cursor, optimization_name, user_id)
 
-        self.cursor.execute(
-            '''
-            SELECT 
-            u.optimization_name, 
-            v.variant_name, 
-            s.option_value, 
-            s.change_datetime
-            FROM 
-            optimization_samples as s
-            JOIN optimization_variant as v
-            on s.variant_id=v.id
-            join user_optimization u
-            on s.optimization_id=u.id
-            WHERE 
-            s.optimization_id = ?
-            ''',
-            (optimization_id, )
-        )
-        return self.cursor.fetchall() # optimization_name, variant_name, option_value, change_datetime
+            cursor.execute(
+                '''
+                SELECT 
+                u.optimization_name, 
+                v.variant_name, 
+                s.option_value, 
+                s.change_datetime
+                FROM 
+                optimization_samples as s
+                JOIN optimization_variant as v
+                on s.variant_id=v.id
+                join user_optimization u
+                on s.optimization_id=u.id
+                WHERE 
+                s.optimization_id = ?
+                ORDER BY s.id
+                ''',
+                (optimization_id, )
+            )
+            return cursor.fetchall() # optimization_name, variant_name, option_value, change_datetime
     
     def close(self):
         self.conn.close()
+        if self._readers is not None:
+            while not self._readers.empty():
+                self._readers.get_nowait().close()
+
+class AsyncDatabaseDriver:
+    """
+    asyncio front end for DatabaseDriver, used by the aiogram handlers.
+
+    Writes are queued to one dedicated database thread, so awaiting a query
+    never blocks the event loop and writes run in the order they were made.
+    With pool_size > 0 the reads in DatabaseDriver.READ_METHODS run on
+    pool_size reader threads instead, next to the writer. Every public
+    DatabaseDriver method is available as a coroutine with the same name
+    and arguments.
+
+    With commit_delay > 0 writes are group committed: calls arriving within
+    commit_delay seconds of the first pending one are run together through
+    DatabaseDriver.execute_batch, one transaction and one fsync, and each
+    caller still gets its own result or exception.
+
+    With lazy=True the database is opened (and migrated) by the first call
+    instead of the constructor, which keeps module imports cheap.
+    """
+
+    def __init__(self, db_name='main_db.db', pool_size=0, commit_delay=0.0, lazy=False):
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self.commit_delay = commit_delay
+        self._pending = []
+        self._flush_task = None
+        self._driver = None
+        self._open_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self._read_executor = self._executor
+        if pool_size:
+            self._read_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="database-read")
+        if not lazy:
+            self._executor.submit(self._open).result()
+
+    def _open(self):
+        """The DatabaseDriver, created on first use from whichever database thread gets there first."""
+        if self._driver is None:
+            with self._open_lock:
+                if self._driver is None:
+                    self._driver = DatabaseDriver(self.db_name, self.pool_size)
+        return self._driver
+
+    def _call(self, name, args, kwargs):
+        return getattr(self._open(), name)(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not callable(getattr(DatabaseDriver, name, None)):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        is_read = name in DatabaseDriver.READ_METHODS
+        executor = self._read_executor if is_read else self._executor
+
+        @functools.wraps(getattr(DatabaseDriver, name))
+        async def method(*args, **kwargs):
+            if self.commit_delay and not is_read:
+                return await self._enqueue_write(name, args, kwargs)
+            call = functools.partial(self._call, name, args, kwargs)
+            return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+        # cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, method)
+        return method
+
+    async def _enqueue_write(self, name, args, kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((name, args, kwargs, future))
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush_after_delay())
+        return await future
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(self.commit_delay)
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+        calls = [(name, args, kwargs) for name, args, kwargs, _ in batch]
+        try:
+            outcomes = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._call, 'execute_batch', (calls,), {}
+            )
+        except Exception as error:
+            # the commit itself failed, so none of the writes happened
+            outcomes = [(None, error)] * len(batch)
+        logging.debug("Group commit of %d writes", len(batch))
+        for (_, _, _, future), (result, error) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._read_executor is not self._executor:
+            self._read_executor.shutdown(wait=True)
+        if self._driver is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._driver.close)
+        self._executor.shutdown(wait=True)
+
 
 if __name__ == "__main__":
-    db = DatabaseDriver()
+    parser = argparse.ArgumentParser(description="Inspect or maintain the optimizations database.")
+    parser.add_argument("--db", default="main_db.db", help="path to the SQLite database")
+    parser.add_argument("--rebuild-posteriors", action="store_true",
+                        help="recompute variant_posterior from all stored samples")
+    args = parser.parse_args()
+    db = DatabaseDriver(args.db)
+    if args.rebuild_posteriors:
+        db.rebuild_posteriors()
+        print("Rebuilt variant posteriors.")
     print("Optimizations:", db.get_all_optimizations())
     db.close()
 
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+# Abandoned flows are dropped after this many seconds without a write.
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    aiogram FSM storage kept in a SQLite table, so user flows survive
+    restarts and can be shared by several bot processes on one host.
+
+    Writes are batched: set_state/set_data land in an in-process buffer
+    that is written in one transaction flush_interval seconds after the
+    first pending write. Reads see the buffer first, then the table; other
+    processes see a write once it is flushed. Every write renews the key's
+    expiry to now + ttl; expired rows read as empty and are deleted on
+    flush, so abandoned sessions don't pile up. A key whose state and data
+    are both cleared is deleted at once. The database is opened by the
+    first read or flush, not at construction.
+    """
+
+    def __init__(self, db_name='fsm_state.db', ttl=DEFAULT_TTL, flush_interval=0.05, clock=time.time):
+        self.db_name = db_name
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.clock = clock
+        # key -> {'state': ..., 'data': ...} with only the fields written since the last flush
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-storage")
+        self._conn = None
+
+    def _connection(self):
+        # only ever called on the storage thread
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, timeout=30)
+        if self.db_name != ':memory:':
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                expires_at INTEGER NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_expires ON fsm_state(expires_at)")
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _write(self, key: StorageKey, field: str, value):
+        self._pending.setdefault(self._key(key), {})[field] = value
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after_delay())
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Write all buffered changes in one transaction."""
+        batch, self._pending = self._pending, {}
+        self._flush_task = None
+        if batch:
+            await self._run(self._store, batch, int(self.clock()))
+
+    def _store(self, batch, now):
+        params = [
+            (key, fields.get('state'), json.dumps(fields['data']) if 'data' in fields else None,
+             now + self.ttl, 'state' in fields, 'data' in fields)
+            for key, fields in batch.items()
+        ]
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                '''
+                INSERT INTO fsm_state (key, state, data, expires_at)
+                VALUES (?1, ?2, COALESCE(?3, '{}'), ?4)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = CASE WHEN ?5 THEN excluded.state ELSE state END,
+                    data = CASE WHEN ?6 THEN excluded.data ELSE data END,
+                    expires_at = excluded.expires_at
+                ''',
+                params
+            )
+            conn.executemany(
+                "DELETE FROM fsm_state WHERE key = ? AND state IS NULL AND data = '{}'",
+                [(key,) for key in batch]
+            )
+            expired = conn.execute("DELETE FROM fsm_state WHERE expires_at <= ?", (now,)).rowcount
+        logging.debug("Flushed %d FSM keys, expired %d", len(batch), expired)
+
+    def _load(self, key, now):
+        row = self._connection().execute(
+            "SELECT state, data FROM fsm_state WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row if row is not None else (None, '{}')
+
+    async def _read(self, key: StorageKey, field: str):
+        storage_key = self._key(key)
+        pending = self._pending.get(storage_key, {})
+        if field in pending:
+            return pending[field]
+        state, data = await self._run(self._load, storage_key, int(self.clock()))
+        return state if field == 'state' else json.loads(data)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._write(key, 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._read(key, 'state')
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        # serialise now so unsupported values fail in the handler, not on flush
+        self._write(key, 'data', json.loads(json.dumps(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(await self._read(key, 'data'))
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
@@ -1,5 +1,6 @@
+import asyncio
+import importlib
 import logging
-from datetime import datetime
 
 from aiogram import types
 from aiogram.filters import Command
@@ -8,11 +9,27 @@ from aiogram.types import CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from tabulate import tabulate
 
-import mvsampling.mvsampling as mv
 from config import bot, dp, optimizations_db
 from states import NewOptimization, NewOptionValue, NewVariant
+from handlers.render_cache import RenderCache
 from handlers.text_formatting import StringProcessor
 
+# Posterior draws per variant used to rank variants by probability of being best.
+RANKING_DRAWS = 10000
+# Only samples this many days before the newest one count towards a recommendation.
+WINDOW_DAYS = 91
+# Imported on first use: it pulls in numpy and pandas, which would slow down startup.
+SAMPLER_MODULE = "mvsampling.mvsampling"
+# Rendered recommendations, reused until a sample is added or a variant removed.
+render_cache = RenderCache()
+string_processor = StringProcessor()
+
+@dp.startup()
+async def warm_up_sampler():
+    # load the sampler in the background once polling starts, so the first
+    # recommendation doesn't pay for the import either
+    asyncio.get_running_loop().run_in_executor(None, importlib.import_module, SAMPLER_MODULE)
+
 @dp.message(Command("start"))
 async def start_command(message: types.Message):
     await message.answer(
@@ -56,7 +73,7 @@ async def process_optimization_type(callback_query: CallbackQuery, state: FSMCon
         optimization_name = data.get("optimization_name")
 
         # Check if the optimization name is already in use
-        existing_optimizations = optimizations_db.get_optimizations(callback_query.from_user.id)  # type: ignore
+        existing_optimizations = await optimizations_db.get_optimizations(callback_query.from_user.id)  # type: ignore
         if any(opt[0] == optimization_name for opt in existing_optimizations):
             if callback_query.message:
                 await callback_query.message.edit_text(
@@ -70,8 +87,11 @@ async def process_optimization_type(callback_query: CallbackQuery, state: FSMCon
             return
 
         # Add the new optimization to the database
-        optimizations_db.add_optimization(optimization_name, callback_query.from_user.id)  # type: ignore
-        all_optimizations_for_this_user = optimizations_db.get_optimizations(callback_query.from_user.id)  # type: ignore
+        await optimizations_db.add_optimization(optimization_name, callback_query.from_user.id)  # type: ignore
+        all_optimizations_for_this_user = [
+            (name, string_processor.format_epoch(changed), optimization_id)
+            for name, changed, optimization_id in await optimizations_db.get_optimizations(callback_query.from_user.id)  # type: ignore
+        ]
         if callback_query.message:
             await callback_query.message.edit_text(
                 f"Your new optimization '{optimization_name}' has been saved in the database.\n"
@@ -104,17 +124,14 @@ async def process_optimization_type(callback_query: CallbackQuery, state: FSMCon
 
 @dp.message(Command("add_variant"))
 async def add_variant_command(message: types.Message, state: FSMContext):
-    # When retrieving optimizations from the database, ensure you get the id.
-    optimizations = optimizations_db.get_optimizations(message.from_user.id)  # type: ignore # Each record: (optimization_name, change_datetime, optimization_id)
+    # Each record: (optimization_name, change_datetime, optimization_id, variant_count, sample_count, last_activity)
+    optimizations = await optimizations_db.get_optimization_summaries(message.from_user.id)  # type: ignore
 
     if optimizations:
         keyboard = InlineKeyboardBuilder()
-        for optimization in optimizations:
-            # Assume your get_optimizations now returns (optimization_name, change_datetime, optimization_id)
-            optimization_name = optimization[0]
-            optimization_id = optimization[2]  # Get the id
+        for optimization_name, _, optimization_id, variant_count, _, _ in optimizations:
             keyboard.button(
-                text=optimization_name,
+                text=f"{optimization_name} ({variant_count} variants)",
                 callback_data=f"select_optimization:{optimization_id}"
             )
         keyboard.adjust(1) # one button per row
@@ -130,7 +147,7 @@ async def process_select_optimization(callback_query: CallbackQuery, state: FSMC
     # Extract the optimization id from the callback data
     optimization_id = callback_query.data.split(":", 1)[1] # type: ignore
     # Look up the full optimization name
-    optimization_name = optimizations_db.get_optimization_name(optimization_id)  
+    optimization_name = await optimizations_db.get_optimization_name(optimization_id)  
     await state.update_data(optimization_id=optimization_id, optimization_name=optimization_name)
     
     if callback_query.message:
@@ -154,23 +171,28 @@ async def process_new_variant(message: types.Message, state: FSMContext):
     variant_name = message.text.strip()  # type: ignore
     data = await state.get_data()
     optimization_name = data.get("optimization_name")
-    optimizations_db.add_variant(optimization_name, variant_name, message.from_user.id)  # type: ignore
-    variants = optimizations_db.get_variants(optimization_name, message.from_user.id)  # type: ignore
+    try:
+        await optimizations_db.add_variant(optimization_name, variant_name, message.from_user.id)  # type: ignore
+    except ValueError:
+        await message.answer(f"Variant '{variant_name}' already exists in '{optimization_name}'. Please provide a different name:")
+        return
+    variants = [
+        (name, string_processor.format_epoch(changed))
+        for name, changed in await optimizations_db.get_variants(optimization_name, message.from_user.id)  # type: ignore
+    ]
     await message.answer(f"Variant '{variant_name}' added to optimization '{optimization_name}'.\nAll variants for this optimization: {variants}")
     await state.clear()
 
 # remove optimization variants in the same way as optimizations
 @dp.message(Command("delete_variant"))
 async def delete_variant_command(message: types.Message, state: FSMContext):
-    # Fetch all optimizations for the user
-    optimizations = optimizations_db.get_optimizations(message.from_user.id)  # type: ignore
+    # Fetch all optimizations for the user together with their variant counts
+    optimizations = await optimizations_db.get_optimization_summaries(message.from_user.id)  # type: ignore
     keyboard = InlineKeyboardBuilder()
     found_any = False
-    for optimization in optimizations:
-        optimization_name = optimization[0]
-        # Check if the optimization has any variants
-        variants = optimizations_db.get_variants(optimization_name, message.from_user.id)  # type: ignore
-        if variants:
+    for optimization_name, _, _, variant_count, _, _ in optimizations:
+        # Only offer optimizations that have variants
+        if variant_count:
             found_any = True
             keyboard.button(
                 text=optimization_name,
@@ -190,7 +212,7 @@ async def process_delete_variant_selection(callback_query: CallbackQuery, state:
     # Extract the selected optimization name.
     optimization_name = callback_query.data.split(":", 1)[1] # type: ignore
     # Build a keyboard with the list of variants for this optimization.
-    variants = optimizations_db.get_variants(optimization_name, callback_query.from_user.id)  # type: ignore
+    variants = await optimizations_db.get_variants(optimization_name, callback_query.from_user.id)  # type: ignore
     if not variants:
         await callback_query.answer("No variants found for the selected optimization.", show_alert=True)
         return
@@ -217,8 +239,10 @@ async def process_delete_variant(callback_query: CallbackQuery):
         return
     optimization_name = parts[1]
     variant_name = parts[2]
+    optimization_id = await optimizations_db.retrieve_optimization_id(optimization_name, callback_query.from_user.id)
     # Remove the selected variant from the database. Ensure that your DatabaseDriver has a remove_variant method.
-    optimizations_db.remove_variant(optimization_name, variant_name, callback_query.from_user.id)  # type: ignore
+    await optimizations_db.remove_variant(optimization_name, variant_name, callback_query.from_user.id)  # type: ignore
+    render_cache.invalidate_optimization(optimization_id)
     await callback_query.message.edit_text( # type: ignore
         f"Variant '{variant_name}' has been deleted from optimization '{optimization_name}'."
     )
@@ -226,7 +250,7 @@ async def process_delete_variant(callback_query: CallbackQuery):
 
 @dp.message(Command("delete_optimization"))
 async def delete_optimization_command(message: types.Message):
-    optimizations = optimizations_db.get_optimizations(message.from_user.id)  # type: ignore
+    optimizations = await optimizations_db.get_optimizations(message.from_user.id)  # type: ignore
     if optimizations:
         keyboard = InlineKeyboardBuilder()
         for optimization in optimizations:
@@ -250,7 +274,7 @@ async def process_delete_optimization(callback_query: CallbackQuery):
     # Extract the optimization name from the callback data
     optimization_name = callback_query.data.split(":", 1)[1]  # type: ignore
     # Remove the selected optimization
-    optimizations_db.remove_optimization(optimization_name, callback_query.from_user.id)  # type: ignore
+    await optimizations_db.remove_optimization(optimization_name, callback_query.from_user.id)  # type: ignore
     if callback_query.message:
         await callback_query.message.edit_text(
             f"The optimization '{optimization_name}' has been deleted."
@@ -264,13 +288,15 @@ async def process_delete_optimization(callback_query: CallbackQuery):
 
 @dp.message(Command("add_observation"))
 async def add_observation_command(message: types.Message, state: FSMContext):
-    # Get all optimizations for the user
-    optimizations = optimizations_db.get_optimizations(message.from_user.id)  # type: ignore
+    # Get all optimizations for the user together with their counts
+    optimizations = await optimizations_db.get_optimization_summaries(message.from_user.id)  # type: ignore
+    if not optimizations:
+        await message.answer("You don't have any optimizations yet. Please create one with /new.")
+        return
     keyboard = InlineKeyboardBuilder()
-    for optimization in optimizations:
-        optimization_name = optimization[0]
+    for optimization_name, _, _, variant_count, sample_count, _ in optimizations:
         keyboard.button(
-            text=optimization_name,
+            text=f"{optimization_name} ({variant_count} variants, {sample_count} samples)",
             callback_data=f"add_observation:{optimization_name}"
         )
     keyboard.adjust(1)  # one button per row
@@ -278,47 +304,45 @@ async def add_observation_command(message: types.Message, state: FSMContext):
     await message.answer("Select the optimization for which to process observations:", reply_markup=keyboard.as_markup())
 
 
+def render_recommendation(optimization_name, posterior):
+    """Message text and the names of the top 5 variants, from a stored posterior."""
+    options_list, te, mu, alpha, beta, _ = zip(*posterior)
+    mv = importlib.import_module(SAMPLER_MODULE)
+    # Currently hardcoded to maximize - here minimize=False
+    a = mv.HandsTable.from_posterior(options_list, te, mu, alpha, beta, minimize=False)
+    full_result = a.grade(n_draws=RANKING_DRAWS)
+    logging.debug("graded: %s", full_result)
+    result = full_result[['name', 'mu', 'var95', 'prob_best']]
+    
+    result_str = tabulate(result, headers='keys', showindex=False, tablefmt='pretty')  # type: ignore
+    text = f"Processed observation result for '{optimization_name}':\n<pre>{result_str}</pre>\nBest option: {result.iloc[0]['name']}"
+    return text, list(result.head(5)['name'])
+
 @dp.callback_query(lambda callback: callback.data and callback.data.startswith("add_observation:"))
 async def process_add_observation(callback_query: CallbackQuery, state: FSMContext):
     # Extract the selected optimization name
     optimization_name = callback_query.data.split(":", 1)[1]  # type: ignore
     user_id = callback_query.from_user.id
-    # Retrieve all samples (observations) for this optimization
-    samples = optimizations_db.get_all_samples_for_optimization(user_id, optimization_name)
-    logging.debug("samples: %s", samples)
-    # Build the events dictionary with datetime keys and tuple (optimization_name, option_value)
-    events = {}
-    for sample in samples:
-        # sample is expected to be (optimization_name, option_value, change_datetime)
-        _ , opt_name, option_value, change_dt = sample
-        # Convert the change_dt to a datetime object if necessary
-        if isinstance(change_dt, str):
-            try:
-                dt_obj = datetime.fromisoformat(change_dt)
-            except Exception:
-                continue
-        else:
-            dt_obj = change_dt
-        events[dt_obj] = (opt_name, float(option_value))
-    
-    # get the options list from the database for variant initialization
-    options_list = [variant[0] for variant in optimizations_db.get_variants(optimization_name, user_id)]
-    # Create an instance of HandsTable; adjust the options list and minimize flag as required.
-    # Currently hardcoded to maximize - here minimize=False
-    logging.debug("options_list: %s", options_list)
-    a = mv.HandsTable(options_list=options_list, minimize=False)
-    logging.debug("events: %s", events)
-    print(events)
-    full_result = a.process_events(events)
-    print(full_result)
-    result = full_result[['name', 'mu', 'var95']]
-    
-    result_str = tabulate(result, headers='keys', showindex=False, tablefmt='pretty')  # type: ignore
+    # The window only moves when a sample arrives, so the newest sample id and
+    # the variant count identify the posterior and the table rendered from it.
+    version = await optimizations_db.get_posterior_version(optimization_name, user_id)
+    cache_key = version + (WINDOW_DAYS,)
+    rendered = render_cache.get(cache_key)
+    if rendered is None:
+        # Stored posterior of every variant, maintained on each add_option and
+        # moved forward to the last WINDOW_DAYS days of samples.
+        posterior = await optimizations_db.get_posterior(optimization_name, user_id, days=WINDOW_DAYS)
+        logging.debug("posterior: %s", posterior)
+        if not posterior:
+            await callback_query.answer("No variants yet. Add one with /add_variant.", show_alert=True)
+            return
+        rendered = render_recommendation(optimization_name, posterior)
+        render_cache.put(cache_key, rendered)
+    text, options = rendered
     
     # Build an inline keyboard with up to 5 buttons, in the same order as in the result dataframe.
     keyboard = InlineKeyboardBuilder()
-    for idx, row in result.head(5).iterrows():
-        option = row['name']
+    for option in options:
         keyboard.button(
             text=str(option),
             callback_data=f"select_option:{optimization_name}:{option}"
@@ -327,16 +351,9 @@ async def process_add_observation(callback_query: CallbackQuery, state: FSMConte
     
     # Edit the message with the processed result and the inline keyboard
     if callback_query.message:
-        await callback_query.message.edit_text(
-            f"Processed observation result for '{optimization_name}':\n<pre>{result_str}</pre>\nBest option: {result.iloc[0]['name']}",
-            reply_markup=keyboard.as_markup()
-        )
+        await callback_query.message.edit_text(text, reply_markup=keyboard.as_markup())
     else:
-        await bot.send_message(
-            user_id,
-            f"Processed observation result for '{optimization_name}':\n<pre>{result_str}</pre>\nBest option: {result.iloc[0]['name']}",
-            reply_markup=keyboard.as_markup()
-        )
+        await bot.send_message(user_id, text, reply_markup=keyboard.as_markup())
     
     await callback_query.answer()
 
@@ -373,6 +390,11 @@ async def process_option_value(message: Message, state: FSMContext):
     option = data.get("selected_option")
     option_value = message.text.strip() # type: ignore
     # Write the option value to the database.
-    optimizations_db.add_option(optimization_name=optimization_name, variant_name=option, option_value=option_value, user_id=message.from_user.id) # type: ignore
+    try:
+        await optimizations_db.add_option(optimization_name=optimization_name, variant_name=option, option_value=option_value, user_id=message.from_user.id) # type: ignore
+    except ValueError as error:
+        await message.answer(f"{error} Please send another value:")
+        return
+    render_cache.invalidate_optimization(await optimizations_db.retrieve_optimization_id(optimization_name, message.from_user.id))  # type: ignore
     await message.answer(f"Option '{option}' for optimization '{optimization_name}' saved with value '{option_value}'.")
     await state.clear()
@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class RenderCache:
+    """
+    LRU of rendered recommendation messages keyed by
+    DatabaseDriver.get_posterior_version plus the window in days, i.e.
+    (optimization_id, last_sample_id, variant_count, window_days). A stored
+    posterior only changes when a sample or variant is added or removed, so
+    an entry stays valid until the key moves on or invalidate_optimization
+    is called.
+    Entries older than ttl seconds are dropped as well, so a popular table
+    doesn't show the same random draw for ever. Only used from the event
+    loop, so there is no locking.
+    """
+
+    def __init__(self, maxsize=256, ttl=600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # key -> (stored_at, value), least recently used first
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and self.clock() - entry[0] > self.ttl:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (self.clock(), value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate_optimization(self, optimization_id):
+        for key in [key for key in self._entries if key[0] == optimization_id]:
+            del self._entries[key]
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
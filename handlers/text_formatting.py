@@ -1,3 +1,6 @@
+from datetime import datetime, timezone
+
+
 class StringProcessor:
     def trunc64(self, s: str) -> str:
         # Build a new string that when encoded is less than 64 bytes.
@@ -8,4 +11,11 @@ class StringProcessor:
                 result_bytes.extend(char_bytes)
             else:
                 break
-        return result_bytes.decode("utf-8", errors="ignore")
\ No newline at end of file
+        return result_bytes.decode("utf-8", errors="ignore")
+
+    def format_epoch(self, epoch) -> str:
+        # change_datetime is stored as unix epoch seconds; show it as the
+        # 'YYYY-MM-DD HH:MM:SS' UTC text the bot used to store.
+        if epoch is None:
+            return ""
+        return datetime.fromtimestamp(int(epoch), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
@@ -1,7 +1,25 @@
-from config import bot, dp
+import asyncio
+from datetime import time
+
+from broadcaster import Broadcaster, run_daily
+from config import BROADCAST_AT, bot, dp, optimizations_db
 
 import handlers.optimizations
 import handlers.info_handler  
 
+broadcast_tasks = set()
+
+@dp.startup()
+async def start_broadcaster():
+    if BROADCAST_AT:
+        # created here so its asyncio primitives belong to the polling loop
+        broadcaster = Broadcaster(bot, optimizations_db)
+        broadcast_tasks.add(asyncio.create_task(run_daily(broadcaster, time.fromisoformat(BROADCAST_AT))))
+
+@dp.shutdown()
+async def stop_broadcaster():
+    for task in broadcast_tasks:
+        task.cancel()
+
 if __name__ == "__main__":
     dp.run_polling(bot)
\ No newline at end of file
@@ -0,0 +1,171 @@
+import numpy as np
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import Union
+
+# draws held in memory at once by prob_best, as (draws x arms) elements
+DRAW_BLOCK = 1_000_000
+
+
+@dataclass
+class BatchSampler:
+    '''
+    normal-gamma posteriors of many optimizations in flat ragged arrays:
+    the arms of optimization g are positions offsets[g]:offsets[g + 1] of
+    mu, Te, alpha and beta. One Thompson draw for every arm of every
+    optimization is a single gamma and a single normal call, and the
+    per-optimization orderings follow HandsTable.grade.
+    '''
+    offsets: np.ndarray
+    mu: np.ndarray
+    Te: np.ndarray
+    alpha: np.ndarray
+    beta: np.ndarray
+    # one flag for all optimizations or one per optimization
+    minimize: Union[bool, np.ndarray] = True
+    rho: float = 3.37
+    # numpy Generator or seed used for all draws, None seeds from the OS
+    rng: Union[np.random.Generator, int, None] = None
+    keys: list = None
+    group: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.offsets = np.asarray(self.offsets, dtype=np.int64)
+        self.mu = np.asarray(self.mu, dtype=np.float64)
+        self.Te = np.asarray(self.Te, dtype=np.int64)
+        self.alpha = np.asarray(self.alpha, dtype=np.float64)
+        self.beta = np.asarray(self.beta, dtype=np.float64)
+        n = self.offsets[-1]
+        if self.offsets[0] != 0 or (np.diff(self.offsets) < 0).any():
+            raise ValueError('offsets must start at 0 and be non-decreasing')
+        if not len(self.mu) == len(self.Te) == len(self.alpha) == len(self.beta) == n:
+            raise ValueError('posterior arrays must have offsets[-1] entries')
+        # optimization of every arm
+        self.group = np.repeat(np.arange(self.n_groups), self.sizes)
+        self.rng = np.random.default_rng(self.rng)
+
+    @classmethod
+    def from_groups(cls, groups, Te, mu, alpha, beta, **kwargs):
+        '''
+        build from one row per arm, with the arms of an optimization next to
+        each other; groups holds the optimization key of every arm and the
+        distinct keys end up in .keys in order
+        '''
+        groups = list(groups)
+        starts = [i for i in range(len(groups)) if i == 0 or groups[i] != groups[i - 1]]
+        keys = [groups[i] for i in starts]
+        if len(set(keys)) != len(keys):
+            raise ValueError('the arms of an optimization must be contiguous')
+        return cls(starts + [len(groups)], mu, Te, alpha, beta, keys=keys, **kwargs)
+
+    @property
+    def n_groups(self):
+        return len(self.offsets) - 1
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def _per_arm(self, flags):
+        return np.repeat(np.broadcast_to(np.asarray(flags, dtype=bool), self.n_groups), self.sizes)
+
+    def cold(self):
+        '''
+        per optimization: True while its smallest mu is 0, in which case
+        grade orders the arms by Te instead of the draw
+        '''
+        smallest = np.full(self.n_groups, np.inf)
+        nonempty = self.sizes > 0
+        if nonempty.any():
+            # segments between the starts of non-empty groups are exactly those groups
+            smallest[nonempty] = np.minimum.reduceat(self.mu, self.offsets[:-1][nonempty])
+        return smallest == 0
+
+    def draw(self):
+        '''one Thompson draw (tau, theta) for every arm, in two vectorised calls'''
+        tau = self.rng.gamma(self.alpha, 1/self.beta)
+        with np.errstate(divide='ignore'):
+            theta = self.rng.normal(self.mu, 1/self.Te)
+        return tau, theta
+
+    def rank(self, tau=None, theta=None):
+        '''
+        order every optimization's arms best first, from the given draws or
+        a new one. Returns (order, tau, theta): order holds flat arm
+        positions grouped like the arms, so order[offsets[g]:offsets[g+1]]
+        is the ranking of optimization g.
+        '''
+        if tau is None or theta is None:
+            tau, theta = self.draw()
+        minimize = self._per_arm(self.minimize)
+        with np.errstate(divide='ignore'):
+            score = np.where(minimize, self.rho * theta + 1/tau, -(self.rho * theta - 1/tau))
+        key = np.where(self._per_arm(self.cold()), self.Te, score)
+        order = np.lexsort((key, self.group))
+        return order, tau, theta
+
+    def prob_best(self, n_draws=10000):
+        '''
+        per arm, the share of n_draws Thompson draws in which it wins its
+        optimization on the criterion rank uses, like HandsTable.prob_best.
+        The draws are (draws x arms) matrices of at most DRAW_BLOCK
+        elements, so a large batch takes a few vectorised blocks.
+        '''
+        if n_draws < 1:
+            raise ValueError('n_draws must be a positive integer')
+        n_arms = len(self.mu)
+        wins = np.zeros(n_arms, dtype=np.int64)
+        if n_arms == 0:
+            return wins / n_draws
+        nonempty = self.sizes > 0
+        starts = self.offsets[:-1][nonempty]
+        # column of every arm's optimization among the non-empty ones
+        column = np.cumsum(nonempty)[self.group] - 1
+        minimize = self._per_arm(self.minimize)
+        block = max(1, DRAW_BLOCK // n_arms)
+        for done in range(0, n_draws, block):
+            size = (min(block, n_draws - done), n_arms)
+            tau = self.rng.gamma(self.alpha, 1/self.beta, size=size)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                theta = self.rng.normal(self.mu, 1/self.Te, size=size)
+                score = np.where(minimize, self.rho * theta + 1/tau, -(self.rho * theta - 1/tau))
+            smallest = np.minimum.reduceat(score, starts, axis=1)
+            best = score == smallest[:, column]
+            # on a tie the first arm wins, like np.argmin in HandsTable.prob_best
+            seen = np.cumsum(best, axis=1)
+            before = np.hstack([np.zeros((size[0], 1), dtype=seen.dtype), seen])[:, starts]
+            wins += (best & (seen - before[:, column] == 1)).sum(axis=0)
+        return wins / n_draws
+
+    def rank_by_prob(self, n_draws=10000):
+        '''
+        order every optimization's arms by prob_best from n_draws draws,
+        the ranking of HandsTable.prob_best; cold optimizations follow Te
+        as in rank. Returns (order, prob_best), order laid out like rank's.
+        '''
+        prob_best = self.prob_best(n_draws)
+        key = np.where(self._per_arm(self.cold()), self.Te, -prob_best)
+        return np.lexsort((key, self.group)), prob_best
+
+    def var95(self, tau, theta):
+        '''the var95 column of HandsTable.grade for every arm'''
+        z = np.where(self._per_arm(self.minimize),
+                     NormalDist().inv_cdf(1-0.05/2), NormalDist().inv_cdf(0.05/2))
+        return theta + z * np.sqrt(1/tau)
+
+    def rankings(self, order=None):
+        '''per optimization, its arms' local indices best first'''
+        if order is None:
+            order, _, _ = self.rank()
+        local = order - self.offsets[self.group[order]]
+        return np.split(local, self.offsets[1:-1])
+
+    def best(self, order=None):
+        '''local index of every optimization's best arm, -1 when it has no arms'''
+        if order is None:
+            order, _, _ = self.rank()
+        best = np.full(self.n_groups, -1, dtype=np.int64)
+        nonempty = self.sizes > 0
+        starts = self.offsets[:-1][nonempty]
+        best[nonempty] = order[starts] - starts
+        return best
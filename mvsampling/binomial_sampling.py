@@ -1,25 +1,60 @@
 import pandas as pd
-from scipy.stats import beta
-from datetime import timedelta, datetime
+import numpy as np
+from datetime import datetime
 from dataclasses import dataclass, field
+from typing import Optional, Union
 import logging
 
+from mvsampling.events import event_columns, window_mask
+from mvsampling.history import HistoryLog
+
 @dataclass
 class BinomialBandit:
     options_list: list
     minimize: bool = True
-    bandit: pd.DataFrame = field(init=False)
-    history: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=['option', 'reward']))
+    # None keeps every event, 0 disables the history log
+    history_limit: Optional[int] = None
+    # numpy Generator or seed used for all draws, None seeds from the OS
+    rng: Union[np.random.Generator, int, None] = None
+    # Beta parameters and run counts, one slot per option.
+    alpha: np.ndarray = field(init=False, repr=False)
+    beta: np.ndarray = field(init=False, repr=False)
+    runs: np.ndarray = field(init=False, repr=False)
+    index: dict = field(init=False, repr=False)
+    history_log: HistoryLog = field(init=False, repr=False)
 
     def __post_init__(self):
         # Initialize each arm with a Beta(1,1) prior and 0 runs.
-        self.bandit = pd.DataFrame({
+        n = len(self.options_list)
+        self.alpha = np.ones(n)  # successes count + 1
+        self.beta = np.ones(n)   # failures count + 1
+        self.runs = np.zeros(n, dtype=np.int64)  # number of trials
+        self.index = {name: i for i, name in enumerate(self.options_list)}
+        self.history_log = HistoryLog(self.options_list, 'reward', dtype=np.int64,
+                                      maxlen=self.history_limit)
+        self.rng = np.random.default_rng(self.rng)
+
+    @property
+    def bandit(self) -> pd.DataFrame:
+        """DataFrame view of the arms, built on demand."""
+        return pd.DataFrame({
             'name': self.options_list,
-            'alpha': 1.0,  # successes count + 1
-            'beta': 1.0,   # failures count + 1
-            'runs': 0      # number of trials
+            'alpha': self.alpha,
+            'beta': self.beta,
+            'runs': self.runs
         })
 
+    @property
+    def history(self) -> pd.DataFrame:
+        """DataFrame view of the recorded events, built on demand."""
+        return self.history_log.to_frame()
+
+    def arm_index(self, name):
+        try:
+            return self.index[name]
+        except KeyError:
+            raise ValueError(f"Option '{name}' not found.") from None
+
     def update_arm(self, name, reward):
         """
         Update the Beta distribution for the arm specified by name.
@@ -27,63 +62,116 @@ class BinomialBandit:
         """
         if reward not in [0, 1]:
             raise ValueError('Reward must be 0 or 1 for binomial bandit.')
-        # Look up the current parameters.
-        row = self.bandit[self.bandit.name == name]
-        if row.empty:
-            raise ValueError(f"Option '{name}' not found.")
-        current_alpha = float(row['alpha'].iloc[0])
-        current_beta = float(row['beta'].iloc[0])
-        current_runs = int(row['runs'].iloc[0])
+        i = self.arm_index(name)
         # Update: add reward to alpha and (1-reward) to beta.
-        new_alpha = current_alpha + reward
-        new_beta = current_beta + (1 - reward)
-        new_runs = current_runs + 1
+        self.alpha[i] += reward
+        self.beta[i] += 1 - reward
+        self.runs[i] += 1
         # Record this event in history.
-        self.history.loc[len(self.history.index)] = [name, reward]
-        # Update the bandit's DataFrame.
-        self.bandit.loc[self.bandit.name == name, 'alpha'] = new_alpha
-        self.bandit.loc[self.bandit.name == name, 'beta'] = new_beta
-        self.bandit.loc[self.bandit.name == name, 'runs'] = new_runs
+        self.history_log.append(i, reward)
 
-    def grade(self):
+    def update_many(self, names, rewards):
+        """
+        Update several arms at once.
+        Successes and trials are counted per arm with np.bincount and added
+        to alpha/beta/runs in one step; the result is the same as calling
+        update_arm for every (name, reward) pair.
+        """
+        names = list(names)
+        rewards = np.asarray(rewards)
+        if len(names) != len(rewards):
+            raise ValueError('names and rewards must have the same length.')
+        idx = np.fromiter((self.arm_index(name) for name in names), dtype=np.intp, count=len(names))
+        self._update_arms(idx, rewards)
+
+    def _update_arms(self, idx, rewards):
+        """update_many for events given by arm position."""
+        if len(idx) == 0:
+            return
+        if not np.isin(rewards, [0, 1]).all():
+            raise ValueError('Reward must be 0 or 1 for binomial bandit.')
+        rewards = rewards.astype(np.int64)
+        k = len(self.options_list)
+        trials = np.bincount(idx, minlength=k)
+        successes = np.bincount(idx, weights=rewards, minlength=k)
+        self.alpha += successes
+        self.beta += trials - successes
+        self.runs += trials
+        self.history_log.extend(idx, rewards)
+
+    def remove_many(self, names, rewards):
         """
-        Sample from the Beta distributions for each arm and sort them.
+        Take previously added events back out of the arms; the exact
+        inverse of update_many. The history log is not touched.
+        """
+        names = list(names)
+        rewards = np.asarray(rewards)
+        if len(names) != len(rewards):
+            raise ValueError('names and rewards must have the same length.')
+        if len(names) == 0:
+            return
+        if not np.isin(rewards, [0, 1]).all():
+            raise ValueError('Reward must be 0 or 1 for binomial bandit.')
+        idx = np.fromiter((self.arm_index(name) for name in names), dtype=np.intp, count=len(names))
+        k = len(self.options_list)
+        trials = np.bincount(idx, minlength=k)
+        successes = np.bincount(idx, weights=rewards.astype(np.int64), minlength=k)
+        if (successes > self.alpha - 1).any() or (trials - successes > self.beta - 1).any():
+            raise ValueError('Cannot remove more events than were added.')
+        self.alpha -= successes
+        self.beta -= trials - successes
+        self.runs -= trials
+
+    def rank(self):
+        """
+        Draw one sample from every arm's Beta distribution in a single call
+        and order the arms without building a DataFrame.
         - If minimizing (e.g. cost or loss), lower sampled values are preferred,
           so the arms are sorted in ascending order.
         - If maximizing (e.g. rewards), higher sampled values are preferred,
           so the arms are sorted in descending order.
+        Returns (order, theta_sample): arm positions best first, and the
+        sampled value of every arm in options_list order.
         """
-        df = self.bandit.copy()
-        df['theta_sample'] = df.apply(lambda row: beta.rvs(a=row['alpha'], b=row['beta']), axis=1)
+        theta_sample = self.rng.beta(self.alpha, self.beta)
         if self.minimize:
-            # For minimization problems, sort in ascending order.
-            sorted_df = df.sort_values(by='theta_sample', ascending=True)
+            order = np.argsort(theta_sample, kind='stable')
         else:
-            # For maximization problems, sort in descending order.
-            sorted_df = df.sort_values(by='theta_sample', ascending=False)
-        return sorted_df
+            order = np.argsort(-theta_sample, kind='stable')
+        return order, theta_sample
+
+    def grade(self):
+        """
+        Sample from the Beta distributions for each arm and return the arms
+        as a DataFrame sorted by theta_sample, best first (see rank).
+        """
+        order, theta_sample = self.rank()
+        df = self.bandit
+        df['theta_sample'] = theta_sample
+        return df.iloc[order]
 
-    def process_events(self, events, days=91):
+    def process_events(self, events, days=91, now=None):
         """
         Process events to update the bandit.
-        
-        events: dict mapping datetime -> tuple(option, reward)
-                where reward is 0 or 1.
-        days: only events within the last 'days' days are considered.
-        
+
+        events: columns of (time, option, reward) with reward 0 or 1, as a
+                (times, options, rewards) tuple of option names or a
+                structured array with fields time, arm and value holding
+                option positions (see mvsampling.events.event_columns).
+                Events sharing a timestamp are all kept.
+        days: only events within the last 'days' days before now are considered.
+        now: end of the window, datetime.now() by default.
+
         If no valid events are provided, simply return the graded state.
         """
-        if not events:
+        if events is None:
             return self.grade()
-        # Set threshold relative to now.
-        threshold = datetime.now() - timedelta(days=days)
-        filtered_events = {dt: data for dt, data in events.items() if dt >= threshold}
-        logging.debug("Filtered events: %s", filtered_events)
-        if filtered_events:
-            for dt, (option, reward) in filtered_events.items():
-                self.update_arm(option, reward)
+        times, arms, rewards = event_columns(events, self.arm_index, len(self.options_list))
+        keep = window_mask(times, days, datetime.now() if now is None else now)
+        logging.debug("%d of %d events inside the window", keep.sum(), len(keep))
+        self._update_arms(arms[keep], rewards[keep])
         # Return the current graded state after processing.
         return self.grade()
 
     def __str__(self):
-        return repr(self.bandit)
\ No newline at end of file
+        return repr(self.bandit)
@@ -0,0 +1,63 @@
+from datetime import timedelta
+
+import numpy as np
+
+# structured array layout accepted by the samplers' process_events
+EVENT_DTYPE = np.dtype([('time', 'datetime64[us]'), ('arm', np.intp), ('value', np.float64)])
+
+
+def as_datetime64(times):
+    '''
+    timestamps as a datetime64[us] array; datetimes, numpy/pandas datetimes
+    and integer unix epoch seconds are accepted
+    '''
+    times = np.asarray(times)
+    if times.dtype.kind in 'iu':
+        times = times.astype('datetime64[s]')
+    return times.astype('datetime64[us]')
+
+
+def event_columns(events, arm_index, n_arms):
+    '''
+    normalise events to parallel arrays (times, arms, values): times as
+    datetime64[us], arms as positions into the options list and values as
+    given. events is one of
+      - a structured array with fields time, arm and value (see EVENT_DTYPE),
+        where arm is the option's position in the options list
+      - a (times, options, values) tuple of equal-length sequences
+      - a dict mapping datetime -> (option, value), kept for old callers;
+        it can't hold two events with the same timestamp
+    options in the tuple and the dict are always names, resolved with
+    arm_index, even when the names are integers.
+    '''
+    if isinstance(events, np.ndarray) and events.dtype.names:
+        times, arms, values = events['time'], events['arm'], events['value']
+        arms = np.asarray(arms)
+        if arms.dtype.kind not in 'iu':
+            raise ValueError('the arm field holds option positions')
+        if len(arms) and (arms.min() < 0 or arms.max() >= n_arms):
+            raise ValueError('arm index out of range')
+        arms = arms.astype(np.intp)
+    else:
+        if isinstance(events, dict):
+            times = list(events)
+            names, values = zip(*events.values()) if events else ((), ())
+        else:
+            times, names, values = events
+        names = list(names)
+        arms = np.fromiter((arm_index(name) for name in names), dtype=np.intp, count=len(names))
+    times = as_datetime64(times)
+    if not isinstance(values, np.ndarray):
+        values = list(values)
+        numeric = np.asarray(values)
+        # mixed numbers and time strings must stay objects: a unicode array
+        # would turn 30 into '30', which reads as a duration of 30 ns
+        values = numeric if numeric.dtype.kind in 'iufb' else np.asarray(values, dtype=object)
+    if not len(times) == len(arms) == len(values):
+        raise ValueError('times, arms and values must have the same length')
+    return times, arms, values
+
+
+def window_mask(times, days, end):
+    '''True for the events no older than `days` days before `end`'''
+    return times >= as_datetime64([end])[0] - np.timedelta64(timedelta(days=days))
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+
+class HistoryLog:
+    """
+    Append-only columnar log of (option, value) events.
+
+    Options are stored as integer codes into `labels` and values in a typed
+    NumPy array. Both arrays double in capacity when they fill up, so appends
+    are amortised O(1) and a DataFrame is only built when `to_frame` is called.
+
+    maxlen caps the log to the most recent entries (older ones are dropped);
+    maxlen=0 disables retention entirely, which is what serving paths that
+    never read the history should use.
+    """
+
+    def __init__(self, labels, value_column='value', dtype=np.float64, maxlen=None, capacity=16):
+        if maxlen is not None and maxlen < 0:
+            raise ValueError('maxlen must be None or a non-negative integer')
+        self.labels = np.asarray(labels, dtype=object)
+        self.value_column = value_column
+        self.maxlen = maxlen
+        if maxlen is not None:
+            capacity = min(capacity, 2 * maxlen)
+        self._codes = np.empty(capacity, dtype=np.intp)
+        self._values = np.empty(capacity, dtype=dtype)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def codes(self):
+        return self._codes[self._start:self._end]
+
+    @property
+    def values(self):
+        return self._values[self._start:self._end]
+
+    def _reserve(self, extra):
+        """Make room for `extra` more entries after the current end."""
+        capacity = len(self._codes)
+        if self._end + extra <= capacity:
+            return
+        size = len(self)
+        if size + extra <= capacity // 2:
+            # at least half the buffer is free once the dropped head is reclaimed
+            self._codes[:size] = self._codes[self._start:self._end]
+            self._values[:size] = self._values[self._start:self._end]
+        else:
+            new_capacity = max(2 * capacity, size + extra, 1)
+            codes = np.empty(new_capacity, dtype=self._codes.dtype)
+            values = np.empty(new_capacity, dtype=self._values.dtype)
+            codes[:size] = self._codes[self._start:self._end]
+            values[:size] = self._values[self._start:self._end]
+            self._codes, self._values = codes, values
+        self._start, self._end = 0, size
+
+    def _trim(self):
+        if self.maxlen is not None and len(self) > self.maxlen:
+            self._start = self._end - self.maxlen
+
+    def append(self, code, value):
+        if self.maxlen == 0:
+            return
+        self._reserve(1)
+        self._codes[self._end] = code
+        self._values[self._end] = value
+        self._end += 1
+        self._trim()
+
+    def extend(self, codes, values):
+        if self.maxlen == 0:
+            return
+        codes = np.asarray(codes)
+        values = np.asarray(values)
+        if self.maxlen is not None:
+            codes = codes[-self.maxlen:]
+            values = values[-self.maxlen:]
+        n = len(codes)
+        self._reserve(n)
+        self._codes[self._end:self._end + n] = codes
+        self._values[self._end:self._end + n] = values
+        self._end += n
+        self._trim()
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({'option': self.labels[self.codes],
+                             self.value_column: self.values})
@@ -1,28 +1,77 @@
 import pandas as pd
 import numpy as np
-from scipy.stats import gamma, norm
-from datetime import timedelta
 from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import Optional, Union
 import logging
 
+from mvsampling.events import event_columns, window_mask
+from mvsampling.history import HistoryLog
+
+# normal-gamma prior every option starts from
+PRIOR_ALPHA = 0.5
+PRIOR_BETA = 0.5
+
 @dataclass
 class HandsTable:
     options_list: list
     minimize: bool = True
     rho: float = 3.37
-    hands: pd.DataFrame = field(init=False)
-    history: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=['option', 'value']))
+    # None keeps every observation, 0 disables the history log
+    history_limit: Optional[int] = None
+    # numpy Generator or seed used for all draws, None seeds from the OS
+    rng: Union[np.random.Generator, int, None] = None
+    # posterior parameters are kept in contiguous arrays, one slot per option
+    mu: np.ndarray = field(init=False, repr=False)
+    Te: np.ndarray = field(init=False, repr=False)
+    alpha: np.ndarray = field(init=False, repr=False)
+    beta: np.ndarray = field(init=False, repr=False)
+    index: dict = field(init=False, repr=False)
+    history_log: HistoryLog = field(init=False, repr=False)
 
     def __post_init__(self):
-        self.hands = pd.DataFrame({'name': self.options_list,
-                                   'mu': 0.0,
-                                   'Te': 0,
-                                   'alpha': 0.5,
-                                   'beta': 0.5
-                                   })
+        n = len(self.options_list)
+        self.mu = np.zeros(n, dtype=np.float64)
+        self.Te = np.zeros(n, dtype=np.int64)
+        self.alpha = np.full(n, PRIOR_ALPHA)
+        self.beta = np.full(n, PRIOR_BETA)
+        self.index = {name: i for i, name in enumerate(self.options_list)}
+        self.history_log = HistoryLog(self.options_list, 'value', maxlen=self.history_limit)
+        self.rng = np.random.default_rng(self.rng)
         if self.rho is not None:
             self.rho = self.rho
 
+    @classmethod
+    def from_posterior(cls, options_list, Te, mu, alpha, beta, **kwargs):
+        '''
+        build a table from stored posterior parameters, one value per option
+        '''
+        table = cls(list(options_list), **kwargs)
+        table.Te[:] = Te
+        table.mu[:] = mu
+        table.alpha[:] = alpha
+        table.beta[:] = beta
+        return table
+
+    @property
+    def hands(self) -> pd.DataFrame:
+        '''
+        DataFrame view of the posterior, built on demand
+        '''
+        return pd.DataFrame({'name': self.options_list,
+                             'mu': self.mu,
+                             'Te': self.Te,
+                             'alpha': self.alpha,
+                             'beta': self.beta
+                             })
+
+    @property
+    def history(self) -> pd.DataFrame:
+        '''
+        DataFrame view of the recorded observations, built on demand
+        '''
+        return self.history_log.to_frame()
+
     @classmethod
     def to_minutes(cls, timestr: str):
         '''
@@ -49,76 +98,218 @@ class HandsTable:
             (np.square(X - mu_last)) / 2
         return beta_new
 
-    def update_hands(self, name, value):
+    def arm_index(self, name):
+        try:
+            return self.index[name]
+        except KeyError:
+            raise ValueError(f"Option '{name}' not found.") from None
+
+    @classmethod
+    def to_value(cls, value):
+        '''
+        convert an observation to float, time strings are read as minutes
+        '''
         if isinstance(value, str):
             try:
-                value = HandsTable.to_minutes(value)
+                # str() turns numpy.str_ from string arrays into a plain str
+                return HandsTable.to_minutes(str(value))
             except ValueError:
                 raise ValueError('input time string in hh:mm:ss format')
-        elif isinstance(value, float) or isinstance(value, int):
-            pass
+        elif isinstance(value, (float, int, np.number)):
+            return value
         else:
             raise ValueError('input time string or int/float value')
 
-        _, mu, t, alpha, beta = self.hands[self.hands.name == name].values[0]
-        beta = HandsTable.update_rate(value, mu, beta, t)
-        mu = HandsTable.update_mean(value, t, mu)
-        t = HandsTable.update_samples(t)
-        alpha = HandsTable.update_shape(alpha)
+    def update_hands(self, name, value):
+        value = HandsTable.to_value(value)
+
+        i = self.arm_index(name)
+        mu, t, alpha, beta = self.mu[i], self.Te[i], self.alpha[i], self.beta[i]
+        self.beta[i] = HandsTable.update_rate(value, mu, beta, t)
+        self.mu[i] = HandsTable.update_mean(value, t, mu)
+        self.Te[i] = HandsTable.update_samples(t)
+        self.alpha[i] = HandsTable.update_shape(alpha)
 
         # added code to write history
-        self.history.loc[len(self.history.index)] = [name, value]
+        self.history_log.append(i, value)
+
+    def _batch_stats(self, names, values):
+        '''
+        reduce a batch of observations to per-option count, mean and sum of
+        squared deviations; also returns the option index and float value
+        of every observation
+        '''
+        names = list(names)
+        raw = values if isinstance(values, np.ndarray) else list(values)
+        if len(names) != len(raw):
+            raise ValueError('names and values must have the same length')
+        idx = np.fromiter((self.arm_index(name) for name in names), dtype=np.intp, count=len(names))
+        return self._index_stats(idx, raw)
 
-        self.hands.loc[self.hands.name == name, 'mu'] = mu
-        self.hands.loc[self.hands.name == name, 'Te'] = t
-        self.hands.loc[self.hands.name == name, 'alpha'] = alpha
-        self.hands.loc[self.hands.name == name, 'beta'] = beta
+    def _index_stats(self, idx, raw):
+        '''_batch_stats for observations given by option position'''
+        values = np.asarray(raw)
+        if values.dtype.kind in 'iuf':
+            values = values.astype(np.float64)
+        else:
+            # time strings or mixed input: convert one by one like update_hands
+            values = np.array([HandsTable.to_value(v) for v in raw], dtype=np.float64)
 
-    def grade(self):
-        hands_output = self.hands.copy()
-        tau = gamma.rvs(a=hands_output.alpha, scale=1/hands_output.beta)
-        theta_drops = norm.rvs(hands_output.mu, 1/hands_output.Te)
+        k = len(self.options_list)
+        n = np.bincount(idx, minlength=k)
+        seen = n > 0
+        batch_mean = np.zeros(k)
+        batch_mean[seen] = np.bincount(idx, weights=values, minlength=k)[seen] / n[seen]
+        batch_m2 = np.bincount(idx, weights=np.square(values - batch_mean[idx]), minlength=k)
+        return idx, values, n, batch_mean, batch_m2
+
+    def update_many(self, names, values):
+        '''
+        fold a batch of observations into the posterior in one pass.
+        Per option the batch is reduced to count, mean and sum of squared
+        deviations, which are merged with the current state using the
+        pairwise (Chan et al.) combination, so the result equals calling
+        update_hands for every observation in turn.
+        '''
+        self._merge(*self._batch_stats(names, values))
+
+    def _merge(self, idx, values, n, batch_mean, batch_m2):
+        if len(idx) == 0:
+            return
+        seen = n > 0
+
+        t = self.Te.astype(np.float64)
+        total = t + n
+        delta = batch_mean - self.mu
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.beta[seen] += (batch_m2 + np.square(delta) * t * n / total)[seen] / 2
+            self.mu[seen] += (delta * n / total)[seen]
+        self.Te += n
+        self.alpha += n / 2
+
+        self.history_log.extend(idx, values)
+
+    def remove_many(self, names, values):
+        '''
+        take a batch of previously added observations back out of the
+        posterior, the exact inverse of update_many (up to rounding).
+        Options left without observations return to the prior.
+        The history log is not touched.
+        '''
+        idx, values, n, batch_mean, batch_m2 = self._batch_stats(names, values)
+        if len(idx) == 0:
+            return
+        if (n > self.Te).any():
+            raise ValueError('cannot remove more observations than were added')
+        seen = n > 0
+
+        t = self.Te.astype(np.float64)
+        rest = t - n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mu_rest = (t * self.mu - n * batch_mean) / rest
+            delta = batch_mean - mu_rest
+            beta_rest = self.beta - (batch_m2 + np.square(delta) * rest * n / t) / 2
+        kept = seen & (rest > 0)
+        self.mu[kept] = mu_rest[kept]
+        # rounding must never push the rate below the prior
+        self.beta[kept] = np.maximum(beta_rest[kept], PRIOR_BETA)
+        self.Te -= n
+        self.alpha -= n / 2
+        emptied = seen & (rest == 0)
+        self.mu[emptied] = 0.0
+        self.alpha[emptied] = PRIOR_ALPHA
+        self.beta[emptied] = PRIOR_BETA
+
+    def grade(self, n_draws=None):
+        '''
+        rank the options from one Thompson draw, or from n_draws draws
+        per option when n_draws is given (see prob_best)
+        '''
+        if n_draws is not None:
+            return self.prob_best(n_draws)
+        hands_output = self.hands
+        tau = self.rng.gamma(self.alpha, 1/self.beta)
+        with np.errstate(divide='ignore'):
+            theta_drops = self.rng.normal(self.mu, 1/self.Te)
         hands_output['tau'] = tau
         hands_output['theta'] = theta_drops
         hands_output['SD'] = np.sqrt(1/tau)
 
         if self.minimize == True:
             hands_output['var95'] = theta_drops + \
-                norm.ppf(1-0.05/2) * hands_output.SD
-            if hands_output.mu.min() == 0:
+                NormalDist().inv_cdf(1-0.05/2) * hands_output.SD
+            if self.mu.min() == 0:
 
-                output_df = hands_output.reindex(np.argsort(hands_output.Te))
+                output_df = hands_output.reindex(np.argsort(self.Te))
             else:
                 output_df = hands_output.reindex(
                     np.argsort(self.rho * theta_drops + 1/tau))
         else:
             hands_output['var95'] = theta_drops + \
-                norm.ppf(0.05/2) * hands_output.SD
-            if hands_output.mu.min() == 0:
-                output_df = hands_output.reindex(np.argsort(hands_output.Te))
+                NormalDist().inv_cdf(0.05/2) * hands_output.SD
+            if self.mu.min() == 0:
+                output_df = hands_output.reindex(np.argsort(self.Te))
             else:
                 output_df = hands_output.reindex(
                     np.argsort(self.rho * theta_drops - 1/tau)[::-1])
 
         return output_df
 
-    def process_events(self, events, days=91):
-        """Filter events and update hands. If no events are provided or none pass the filter, simply grade the current state."""
-        if not events:
-            # No events provided: simply return the current grade.
-            return self.grade()
-        try:
-            oldest_ok = max(events) - timedelta(days=days)
-        except ValueError:
-            # In case events is empty or max() fails, just grade.
-            return self.grade()
-        filtered_events = {k: v for k, v in events.items() if k >= oldest_ok}
-        logging.debug("Filtered events: %s", filtered_events)
-        if filtered_events:
-            for category, value in filtered_events.values():
-                self.update_hands(category, value)
-        # If no events pass the filter, we still proceed to grade the current state.
-        return self.grade()
+    def prob_best(self, n_draws=10000):
+        '''
+        Monte Carlo ranking from n_draws posterior draws per option.
+        tau and theta are drawn as (n_draws x options) matrices in one call
+        each. prob_best is the share of draws in which an option wins the
+        rho * theta +/- 1/tau criterion that grade uses, and var95 is the
+        Monte Carlo 97.5% (minimize) or 2.5% (maximize) quantile of
+        theta + SD * z. While some option still has mu == 0 the ordering
+        follows Te like grade; prob_best stays the Monte Carlo share, in
+        which an option without samples wins whenever its draw of theta
+        (with infinite variance) comes out infinitely good.
+        '''
+        if n_draws < 1:
+            raise ValueError('n_draws must be a positive integer')
+        size = (n_draws, len(self.options_list))
+        tau = self.rng.gamma(self.alpha, 1/self.beta, size=size)
+        with np.errstate(divide='ignore'):
+            theta = self.rng.normal(self.mu, 1/self.Te, size=size)
+        sd = np.sqrt(1/tau)
+
+        hands_output = self.hands
+        with np.errstate(invalid='ignore'):
+            if self.minimize == True:
+                wins = np.argmin(self.rho * theta + 1/tau, axis=1)
+                var95 = np.quantile(theta + sd * self.rng.standard_normal(size), 1-0.05/2, axis=0)
+            else:
+                wins = np.argmax(self.rho * theta - 1/tau, axis=1)
+                var95 = np.quantile(theta + sd * self.rng.standard_normal(size), 0.05/2, axis=0)
+        hands_output['var95'] = var95
+
+        hands_output['prob_best'] = np.bincount(wins, minlength=size[1]) / n_draws
+        if self.mu.min() == 0:
+            order = np.argsort(self.Te, kind='stable')
+        else:
+            order = np.argsort(-hands_output['prob_best'].to_numpy(), kind='stable')
+        return hands_output.reindex(order)
+
+    def process_events(self, events, days=91, n_draws=None):
+        '''
+        fold in the events from the last `days` days before the newest one
+        and grade. events are columns: a (times, options, values) tuple of
+        option names or a structured array with fields time, arm and value
+        holding option positions (see mvsampling.events.event_columns).
+        Events sharing a timestamp are all kept. With no events, or none
+        inside the window, the current state is graded.
+        '''
+        if events is None:
+            return self.grade(n_draws)
+        times, arms, values = event_columns(events, self.arm_index, len(self.options_list))
+        if len(times) == 0:
+            return self.grade(n_draws)
+        keep = window_mask(times, days, times.max())
+        logging.debug("%d of %d events inside the window", keep.sum(), len(keep))
+        self._merge(*self._index_stats(arms[keep], values[keep]))
+        return self.grade(n_draws)
 
     def __str__(self):
-        return repr(self.hands)
\ No newline at end of file
+        return repr(self.hands)
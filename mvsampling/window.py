@@ -0,0 +1,84 @@
+from collections import deque
+from datetime import timedelta
+import logging
+
+
+class SlidingWindow:
+    """
+    Keep a sampler (HandsTable or BinomialBandit) equal to the posterior of
+    the events from the last `days` days without rebuilding it.
+
+    New events are folded in with the sampler's update_many and events that
+    fall out of the window are subtracted with remove_many, so a refresh costs
+    O(new + expired) instead of O(window).
+
+    By default the window ends at the newest event seen, like
+    HandsTable.process_events; pass clock=datetime.now to anchor it to the
+    current time, like BinomialBandit.process_events.
+    Events have to arrive in time order across calls.
+    """
+
+    def __init__(self, sampler, days=91, clock=None):
+        self.sampler = sampler
+        self.window = timedelta(days=days)
+        self.clock = clock
+        self.events = deque()
+        self.newest = None
+
+    def __len__(self):
+        return len(self.events)
+
+    def horizon(self):
+        """Oldest timestamp still inside the window, None before any event."""
+        if self.clock is not None:
+            return self.clock() - self.window
+        if self.newest is None:
+            return None
+        return self.newest - self.window
+
+    def expire(self):
+        """Subtract events that fell out of the window, returns how many."""
+        horizon = self.horizon()
+        if horizon is None:
+            return 0
+        expired = []
+        while self.events and self.events[0][0] < horizon:
+            expired.append(self.events.popleft())
+        if expired:
+            _, names, values = zip(*expired)
+            self.sampler.remove_many(names, values)
+        return len(expired)
+
+    def add(self, events):
+        """
+        events: dict mapping datetime -> (option, value), or an iterable of
+        (datetime, option, value) tuples. Events already outside the window
+        are ignored.
+        """
+        if isinstance(events, dict):
+            batch = [(dt, option, value) for dt, (option, value) in events.items()]
+        else:
+            batch = list(events)
+        batch.sort(key=lambda event: event[0])
+        if batch:
+            if self.newest is not None and batch[0][0] < self.newest:
+                raise ValueError('events must arrive in time order')
+            self.newest = batch[-1][0]
+        expired = self.expire()
+        horizon = self.horizon()
+        new = [event for event in batch if horizon is None or event[0] >= horizon]
+        logging.debug("Window: %d new, %d expired events", len(new), expired)
+        if new:
+            _, names, values = zip(*new)
+            self.sampler.update_many(names, values)
+            self.events.extend(new)
+
+    def grade(self, *args, **kwargs):
+        self.expire()
+        return self.sampler.grade(*args, **kwargs)
+
+    def process_events(self, events, *args, **kwargs):
+        """Add new events and grade, mirroring the samplers' process_events."""
+        if events:
+            self.add(events)
+        return self.grade(*args, **kwargs)
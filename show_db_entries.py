@@ -1,33 +1,186 @@
-import sqlite3
+"""
+Inspect the rows of a SQLite database, e.g. a live main_db.db.
+
+The database is opened read-only and rows are streamed page by page with
+keyset pagination on rowid (on the primary key for WITHOUT ROWID tables),
+so memory stays flat and no read transaction
+stays open between pages (a WAL writer and its checkpoints are never held
+up). Row counts come from the catalog (sqlite_stat1, else sqlite_sequence)
+unless exact counts are asked for.
+
+    python show_db_entries.py main_db.db --table optimization_samples --limit 20
+    python show_db_entries.py main_db.db --user 12345 --optimization "commute time" --json
+"""
+import argparse
+import json
 import os
+import sqlite3
+import sys
+
+PAGE_SIZE = 1000
+
+# How to restrict each table of the optimizations schema to one user and,
+# optionally, one optimization. Tables missing here are skipped when filtering.
+_OPTIMIZATION_IDS = "SELECT id FROM user_optimization WHERE telegram_user_id = ? AND (? IS NULL OR optimization_name = ?)"
+FILTERS = {
+    'users': ("telegram_user_id = ?", lambda user, name: (user,)),
+    'user_optimization': ("telegram_user_id = ? AND (? IS NULL OR optimization_name = ?)",
+                          lambda user, name: (user, name, name)),
+    'optimization_variant': (f"optimization_id IN ({_OPTIMIZATION_IDS})", lambda user, name: (user, name, name)),
+    'optimization_samples': (f"optimization_id IN ({_OPTIMIZATION_IDS})", lambda user, name: (user, name, name)),
+    'variant_posterior': (f"optimization_id IN ({_OPTIMIZATION_IDS})", lambda user, name: (user, name, name)),
+}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def connect_read_only(db_file):
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
 
-def show_db_entries(db_file):
+
+def catalog_row_counts(conn):
+    """
+    Approximate row count per table without scanning: the sizes recorded by
+    ANALYZE in sqlite_stat1, otherwise the AUTOINCREMENT high-water mark
+    in sqlite_sequence (an upper bound once rows were deleted).
+    """
+    counts = {}
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'sqlite_sequence' in names:
+        counts.update(conn.execute("SELECT name, seq FROM sqlite_sequence"))
+    if 'sqlite_stat1' in names:
+        for table, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+            if stat:
+                counts[table] = int(stat.split()[0])
+    return counts
+
+
+def key_columns(conn, table):
+    """
+    Columns rows of a table are paged by: rowid, or the primary key of a
+    WITHOUT ROWID table.
+    """
+    try:
+        conn.execute(f"SELECT rowid FROM {_quote(table)} LIMIT 0")
+        return ["rowid"]
+    except sqlite3.OperationalError:
+        pk = sorted((row[5], row[1]) for row in conn.execute(f"PRAGMA table_info({_quote(table)})") if row[5])
+        return [name for _, name in pk]
+
+
+def iter_rows(conn, table, where=None, params=(), page_size=PAGE_SIZE, after=None, limit=None):
+    """
+    Yield (key, row) pairs of a table in key order, page_size rows per
+    query. The key is the rowid, or a tuple of the primary key values for
+    WITHOUT ROWID tables. where/params restrict the rows; after skips
+    rowids up to it and is ignored for WITHOUT ROWID tables.
+    """
+    keys = key_columns(conn, table)
+    key_list = ", ".join(name if name == "rowid" else _quote(name) for name in keys)
+    if keys == ["rowid"]:
+        last = (after if after is not None else -sys.maxsize - 1,)
+    else:
+        last = None
+    clauses = [f"({where})"] if where else []
+    select = f"SELECT {key_list}, * FROM {_quote(table)}"
+    order = f"ORDER BY {key_list} LIMIT ?"
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        page_clauses = clauses if last is None else [f"({key_list}) > ({', '.join('?' * len(keys))})"] + clauses
+        where_sql = f" WHERE {' AND '.join(page_clauses)}" if page_clauses else ""
+        page = conn.execute(f"{select}{where_sql} {order}",
+                            (*(last or ()), *params, size)).fetchall()
+        if not page:
+            return
+        for row in page:
+            key = row[:len(keys)]
+            yield key[0] if keys == ["rowid"] else key, row[len(keys):]
+        last = page[-1][:len(keys)]
+        if remaining is not None:
+            remaining -= len(page)
+
+
+def show_db_entries(db_file, tables=None, user_id=None, optimization_name=None, limit=None,
+                    after=None, page_size=PAGE_SIZE, json_lines=False, exact_counts=False, out=None):
+    """
+    Print the rows of every table (or of `tables`), optionally only those of
+    one user / optimization, at most `limit` per table, as Python tuples or,
+    with json_lines, as one JSON object per row.
+    """
+    out = out or sys.stdout
     if not os.path.exists(db_file):
-        print(f"Database file '{db_file}' does not exist.")
+        print(f"Database file '{db_file}' does not exist.", file=out)
         return
 
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    conn = connect_read_only(db_file)
+    try:
+        # Get all table names from the database.
+        names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+        if tables:
+            names = [name for name in names if name in tables]
+        if user_id is not None:
+            names = [name for name in names if name in FILTERS]
+        if not names:
+            print("No tables found in the database.", file=out)
+            return
 
-    # Get all table names from the database.
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
+        counts = catalog_row_counts(conn)
+        for table_name in names:
+            where, params = None, ()
+            if user_id is not None:
+                where, make_params = FILTERS[table_name]
+                params = make_params(user_id, optimization_name)
+            if exact_counts:
+                count = conn.execute(f"SELECT COUNT(*) FROM {_quote(table_name)}").fetchone()[0]
+            else:
+                count = counts.get(table_name)
+
+            try:
+                rows = iter_rows(conn, table_name, where, params, page_size, after, limit)
+                if json_lines:
+                    columns = [d[0] for d in conn.execute(f"SELECT * FROM {_quote(table_name)} LIMIT 0").description]
+                    for _, row in rows:
+                        print(json.dumps({"table": table_name, "row": dict(zip(columns, row))}, default=str), file=out)
+                    continue
+                print(f"Entries in table '{table_name}':", file=out)
+                shown = 0
+                for _, row in rows:
+                    print(row, file=out)
+                    shown += 1
+            except sqlite3.OperationalError as error:
+                # notices never go into the data stream
+                print(f"Skipping table '{table_name}': {error}", file=sys.stderr)
+                continue
+            total = "" if count is None else f" of {'' if exact_counts else '~'}{count}"
+            print(f"{shown} rows shown{total}", file=out)
+            print("-" * 40, file=out)
+    finally:
+        conn.close()
 
-    if not tables:
-        print("No tables found in the database.")
-        return
 
-    for table in tables:
-        table_name = table[0]
-        print(f"Entries in table '{table_name}':")
-        cursor.execute(f"SELECT * FROM {table_name};")
-        rows = cursor.fetchall()
-        for row in rows:
-            print(row)
-        print("-" * 40)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the rows of a SQLite database without loading whole tables.")
+    parser.add_argument("db", nargs="?", default="main_db.db", help="path to the SQLite database")
+    parser.add_argument("--table", action="append", dest="tables", help="only this table (repeatable)")
+    parser.add_argument("--user", type=int, help="only rows of this telegram user id")
+    parser.add_argument("--optimization", help="only rows of this optimization (needs --user)")
+    parser.add_argument("--limit", type=int, help="at most this many rows per table")
+    parser.add_argument("--after", type=int, help="start after this rowid")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="rows fetched per query")
+    parser.add_argument("--json", action="store_true", dest="json_lines", help="print JSON lines")
+    parser.add_argument("--exact-counts", action="store_true", help="COUNT(*) every table instead of using the catalog")
+    args = parser.parse_args(argv)
+    if args.optimization is not None and args.user is None:
+        parser.error("--optimization needs --user")
+    show_db_entries(args.db, tables=args.tables, user_id=args.user, optimization_name=args.optimization,
+                    limit=args.limit, after=args.after, page_size=args.page_size,
+                    json_lines=args.json_lines, exact_counts=args.exact_counts)
 
-    conn.close()
 
 if __name__ == "__main__":
-    db_path = "main_db.db"
-    show_db_entries(db_path)
\ No newline at end of file
+    main()
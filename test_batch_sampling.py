@@ -0,0 +1,119 @@
+import unittest
+from unittest import mock
+import numpy as np
+from mvsampling.batch import BatchSampler
+from mvsampling.mvsampling import HandsTable
+
+
+def make_table(samples, minimize, seed):
+    table = HandsTable(sorted(samples), minimize=minimize, rng=seed)
+    for name, values in samples.items():
+        table.update_many([name] * len(values), values)
+    return table
+
+
+GROUPS = [
+    {'A': [10, 12, 11], 'B': [20, 25], 'C': [15]},
+    {'X': [3.5, 4], 'Y': [4.2, 4.8, 5]},
+    {'P': [1], 'Q': []},  # cold start, Q has no samples yet
+]
+
+
+class TestBatchSampler(unittest.TestCase):
+
+    def _batch(self, tables, **kwargs):
+        groups, te, mu, alpha, beta = [], [], [], [], []
+        for g, table in enumerate(tables):
+            groups += [g] * len(table.options_list)
+            te += list(table.Te)
+            mu += list(table.mu)
+            alpha += list(table.alpha)
+            beta += list(table.beta)
+        return BatchSampler.from_groups(groups, te, mu, alpha, beta, **kwargs)
+
+    def test_layout(self):
+        tables = [make_table(samples, True, 0) for samples in GROUPS]
+        batch = self._batch(tables)
+        self.assertEqual(batch.keys, [0, 1, 2])
+        self.assertEqual(list(batch.offsets), [0, 3, 5, 7])
+        self.assertEqual(list(batch.group), [0, 0, 0, 1, 1, 2, 2])
+        self.assertEqual(list(batch.cold()), [False, False, True])
+
+    def test_single_optimization_matches_hands_table(self):
+        for minimize in (True, False):
+            for samples in GROUPS:
+                for seed in range(5):
+                    table = make_table(samples, minimize, seed)
+                    expected = table.grade()
+                    batch = self._batch([table], minimize=minimize, rng=seed)
+                    order, tau, theta = batch.rank()
+                    self.assertEqual(list(batch.rankings(order)[0]), list(expected.index))
+                    np.testing.assert_allclose(tau, expected.sort_index()['tau'])
+                    np.testing.assert_allclose(batch.var95(tau, theta), expected.sort_index()['var95'])
+
+    def test_many_optimizations_rank_independently(self):
+        tables = [make_table(samples, True, 0) for samples in GROUPS]
+        minimize = np.array([True, False, True])
+        batch = self._batch(tables, minimize=minimize, rng=1)
+        order, tau, theta = batch.rank()
+        rankings = batch.rankings(order)
+        for g, table in enumerate(tables):
+            start, end = batch.offsets[g], batch.offsets[g + 1]
+            alone = self._batch([table], minimize=minimize[g])
+            alone_order, _, _ = alone.rank(tau[start:end], theta[start:end])
+            self.assertEqual(list(rankings[g]), list(alone_order))
+        self.assertEqual(list(batch.best(order)), [r[0] for r in rankings])
+
+    def test_negative_means_rank_by_draw(self):
+        # only a smallest mean of exactly 0 means a cold start, like HandsTable.grade
+        for seed in range(5):
+            table = HandsTable.from_posterior(['a', 'b', 'c'], [5, 1, 9], [-3.0, 0.0, 2.0],
+                                              [3.0, 1.0, 5.0], [4.0, 1.0, 6.0], minimize=False, rng=seed)
+            expected = list(table.grade().index)
+            batch = BatchSampler([0, 3], [-3.0, 0.0, 2.0], [5, 1, 9], [3.0, 1.0, 5.0], [4.0, 1.0, 6.0],
+                                 minimize=False, rng=seed)
+            self.assertEqual(list(batch.cold()), [False])
+            self.assertEqual(list(batch.rankings()[0]), expected)
+
+    def test_prob_best_matches_hands_table(self):
+        for minimize in (True, False):
+            # two options without samples tie at an infinite draw
+            for samples in GROUPS + [{'P': [1], 'Q': [], 'R': []}]:
+                table = make_table(samples, minimize, 3)
+                expected = table.prob_best(2000)
+                batch = self._batch([table], minimize=minimize, rng=3)
+                order, prob_best = batch.rank_by_prob(2000)
+                self.assertEqual(list(order), list(expected.index))
+                np.testing.assert_allclose(prob_best, expected.sort_index()['prob_best'])
+
+    def test_prob_best_in_blocks(self):
+        tables = [make_table(samples, True, 0) for samples in GROUPS[:2]]
+        batch = self._batch(tables, minimize=np.array([True, False]), rng=0)
+        with mock.patch('mvsampling.batch.DRAW_BLOCK', 7):
+            prob_best = batch.prob_best(1000)
+        # every draw has one winner per optimization
+        self.assertAlmostEqual(prob_best[:3].sum(), 1)
+        self.assertAlmostEqual(prob_best[3:].sum(), 1)
+        self.assertEqual(batch.best(batch.rank_by_prob(1000)[0]).tolist(), [0, 1])
+
+    def test_empty_optimization(self):
+        batch = BatchSampler([0, 2, 2, 3], [1.0, 2.0, 3.0], [1, 1, 1], [1, 1, 1], [1, 1, 1], rng=0)
+        order, _, _ = batch.rank()
+        rankings = batch.rankings(order)
+        self.assertEqual([len(r) for r in rankings], [2, 0, 1])
+        self.assertEqual(batch.best(order)[1:].tolist(), [-1, 0])
+
+    def test_invalid_layout(self):
+        with self.assertRaises(ValueError):
+            BatchSampler([0, 2], [1.0], [1], [1], [1])
+        with self.assertRaises(ValueError):
+            BatchSampler.from_groups([0, 1, 0], [1] * 3, [1.0] * 3, [1] * 3, [1] * 3)
+
+    def test_seeded_draws_repeat(self):
+        tables = [make_table(samples, True, 0) for samples in GROUPS]
+        first = self._batch(tables, rng=7).rank()[0]
+        second = self._batch(tables, rng=7).rank()[0]
+        self.assertEqual(list(first), list(second))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import benchmarks
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_tiny_run_writes_results(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "results.json")
+            with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(benchmarks.main(["--scale", "tiny", "--repeat", "1", "--out", out]), 0)
+                self.assertEqual(benchmarks.main(["--scale", "tiny", "--repeat", "1", "--only", "db.",
+                                                  "--baseline", out, "--tolerance", "100"]), 0)
+            with open(out) as f:
+                report = json.load(f)
+        self.assertEqual(report["scale"], "tiny")
+        self.assertEqual({result["name"] for result in report["results"]}, set(benchmarks.BENCHMARKS))
+        add_option = next(r for r in report["results"] if r["name"] == "db.add_option")
+        self.assertEqual(add_option["params"], {"arms": 2, "samples": 50, "users": 2})
+        self.assertEqual(add_option["ops"], benchmarks.ADD_OPTION_CALLS)
+        self.assertGreater(add_option["min"], 0)
+        get_posterior = next(r for r in report["results"] if r["name"] == "db.get_posterior")
+        self.assertEqual(get_posterior["ops"], 2)
+
+    def test_every_copy_starts_from_the_template(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            setup, cleanup = benchmarks._copies(tmp, 2, 50, 1)
+            try:
+                for _ in range(2):
+                    db = setup()
+                    self.assertEqual(len(db.get_all_samples_for_optimization(1, "Commute")), 50)
+                    db.add_option("Commute", "option 0", 1.0, 1)
+            finally:
+                cleanup()
+            self.assertEqual(os.listdir(tmp), ["template_2_50_1.db"])
+
+    def test_compare_flags_slowdowns_beyond_tolerance(self):
+        def result(name, seconds, arms=3):
+            return {"name": name, "params": {"arms": arms}, "min": seconds}
+        baseline = {"results": [result("hands.grade", 1.0), result("db.add_option", 1.0),
+                                result("hands.grade", 1.0, arms=10)]}
+        current = [result("hands.grade", 1.2), result("db.add_option", 1.3),
+                   result("hands.grade", 5.0, arms=30)]
+        self.assertEqual(benchmarks.compare(current, baseline, tolerance=0.25),
+                         [("db.add_option[arms=3]", 1.0, 1.3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
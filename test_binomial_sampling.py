@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from mvsampling.binomial_sampling import BinomialBandit
@@ -54,12 +55,40 @@ class TestBinomialBandit(unittest.TestCase):
             bandit.update_arm('B', 1)
         self.assertIn("Option 'B' not found", str(context.exception))
 
+    def test_update_many_matches_update_arm(self):
+        names = ['A', 'B', 'A', 'C', 'A', 'B']
+        rewards = [1, 0, 0, 1, 1, 1]
+        sequential = BinomialBandit(['A', 'B', 'C'])
+        batched = BinomialBandit(['A', 'B', 'C'])
+        for name, reward in zip(names, rewards):
+            sequential.update_arm(name, reward)
+        batched.update_many(names, rewards)
+        pd.testing.assert_frame_equal(batched.bandit, sequential.bandit)
+        self.assertEqual(batched.history.values.tolist(), sequential.history.values.tolist())
+
+    def test_update_many_invalid_input(self):
+        bandit = BinomialBandit(['A', 'B'])
+        with self.assertRaises(ValueError) as context:
+            bandit.update_many(['A', 'B'], [1, 2])
+        self.assertIn("Reward must be 0 or 1", str(context.exception))
+        with self.assertRaises(ValueError):
+            bandit.update_many(['A', 'C'], [1, 0])
+        # Nothing is applied when the batch is rejected.
+        self.assertEqual(bandit.runs.tolist(), [0, 0])
+
+    def test_history_disabled(self):
+        bandit = BinomialBandit(['A', 'B'], history_limit=0)
+        bandit.update_arm('A', 1)
+        bandit.update_many(['B', 'B'], [0, 1])
+        self.assertTrue(bandit.history.empty)
+        self.assertEqual(bandit.runs.tolist(), [1, 2])
+
     def test_grade_minimize(self):
         options = ['A', 'B']
         bandit = BinomialBandit(options, minimize=True)
         # Override parameters for predictable sampling behavior.
-        bandit.bandit['alpha'] = [2.0, 1.0]
-        bandit.bandit['beta'] = [1.0, 1.0]
+        bandit.alpha[:] = [2.0, 1.0]
+        bandit.beta[:] = [1.0, 1.0]
         graded = bandit.grade()
         # Confirm that the graded DataFrame has theta_sample.
         self.assertIn('theta_sample', graded.columns)
@@ -68,12 +97,30 @@ class TestBinomialBandit(unittest.TestCase):
     def test_grade_maximize(self):
         options = ['A', 'B']
         bandit = BinomialBandit(options, minimize=False)
-        bandit.bandit['alpha'] = [2.0, 1.0]
-        bandit.bandit['beta'] = [1.0, 1.0]
+        bandit.alpha[:] = [2.0, 1.0]
+        bandit.beta[:] = [1.0, 1.0]
         graded = bandit.grade()
         self.assertIn('theta_sample', graded.columns)
         self.assertTrue(pd.api.types.is_numeric_dtype(graded['theta_sample']))
 
+    def test_rank_orders_arms(self):
+        bandit = BinomialBandit(['A', 'B', 'C'], minimize=False)
+        bandit.alpha[:] = [1.0, 50.0, 10.0]
+        bandit.beta[:] = [50.0, 1.0, 10.0]
+        order, theta_sample = bandit.rank()
+        self.assertEqual(sorted(order.tolist()), [0, 1, 2])
+        self.assertTrue((theta_sample[order][:-1] >= theta_sample[order][1:]).all())
+        graded = bandit.grade()
+        self.assertEqual(graded.iloc[0]['name'], 'B')
+        self.assertTrue(graded['theta_sample'].is_monotonic_decreasing)
+
+    def test_seeded_rank_is_reproducible(self):
+        rng = np.random.default_rng(3)
+        first = BinomialBandit(['A', 'B', 'C'], rng=rng)
+        self.assertIs(first.rng, rng)
+        draws = [BinomialBandit(['A', 'B', 'C'], rng=11).rank()[1] for _ in range(2)]
+        np.testing.assert_array_equal(draws[0], draws[1])
+
     def test_process_events_filters_old_events(self):
         options = ['A', 'B']
         bandit = BinomialBandit(options)
@@ -163,5 +210,19 @@ class TestBinomialBandit(unittest.TestCase):
         # A is a good option. it shouild be on top for a minimize False.
         self.assertEqual(bandit.grade().iloc[0]['name'], 'A')  
 
+    def test_process_events_columns(self):
+        now = datetime(2024, 6, 1, 12, 0, 0)
+        same_second = now - timedelta(days=1)
+        times = np.array([same_second, same_second, same_second, now - timedelta(days=100)],
+                         dtype='datetime64[us]')
+        bandit = BinomialBandit(['A', 'B'])
+        bandit.process_events((times, np.array(['A', 'A', 'B', 'B']), np.array([1, 0, 1, 1])), days=91, now=now)
+        self.assertEqual(bandit.runs.tolist(), [2, 1])
+        self.assertEqual(bandit.alpha.tolist(), [2.0, 2.0])
+        self.assertEqual(bandit.beta.tolist(), [2.0, 1.0])
+        with self.assertRaises(ValueError):
+            bandit.process_events(([now], ['A'], [2]), now=now)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, time as day_time, timezone
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from broadcaster import Broadcaster, TokenBucket, next_run, recommendations
+from database_driver import AsyncDatabaseDriver
+
+TOKEN = "123456:TEST"
+
+
+class FakeBotAPI:
+    """
+    Local stand-in for api.telegram.org that records sendMessage calls.
+    Chats in `flood` get that many 429 answers first, chats in `blocked`
+    get 403, chats in `broken` get 500, and once `hold_after` messages are
+    delivered further requests hang until the server stops.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+        self.flood = {}
+        self.blocked = set()
+        self.broken = set()
+        self.hold_after = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.app = web.Application()
+        self.app.router.add_post(f"/bot{TOKEN}/sendMessage", self.send_message)
+
+    async def start(self):
+        self.release = asyncio.Event()
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        self.release.set()
+        await self.runner.cleanup()
+
+    @staticmethod
+    def _error(status, description, **parameters):
+        body = {"ok": False, "error_code": status, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=status)
+
+    async def send_message(self, request):
+        form = await request.post()
+        chat_id = int(form["chat_id"])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.hold_after is not None and len(self.sent) >= self.hold_after:
+                await self.release.wait()
+            if self.flood.get(chat_id):
+                self.flood[chat_id] -= 1
+                return self._error(429, "Too Many Requests: retry after 1", retry_after=1)
+            if chat_id in self.blocked:
+                return self._error(403, "Forbidden: bot was blocked by the user")
+            if chat_id in self.broken:
+                return self._error(500, "Internal Server Error")
+            self.sent.append((chat_id, form["text"]))
+            return web.json_response({"ok": True, "result": {
+                "message_id": len(self.sent), "date": 0, "text": form["text"],
+                "chat": {"id": chat_id, "type": "private"},
+            }})
+        finally:
+            self.in_flight -= 1
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_rate(self):
+        bucket = TokenBucket(rate=100, capacity=5)
+        start = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.05)
+        await asyncio.gather(*(bucket.acquire() for _ in range(20)))
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+
+class TestRecommendations(unittest.TestCase):
+    def test_best_variant_per_optimization(self):
+        rows = [
+            (1, 10, "Coffee", "one cup", 50, 1.0, 25.5, 5.0),
+            (1, 10, "Coffee", "two cups", 50, 9.0, 25.5, 5.0),
+            (1, 11, "Commute", "bus", 1, 3.0, 1.0, 0.5),
+            (2, 12, "Lunch", "soup", 50, 7.0, 25.5, 5.0),
+            (2, 12, "Lunch", "salad", 50, 2.0, 25.5, 5.0),
+        ]
+        self.assertEqual(recommendations(rows, rng=0), {
+            1: [("Coffee", "two cups"), ("Commute", "bus")],
+            2: [("Lunch", "soup")],
+        })
+        self.assertEqual(recommendations([]), {})
+
+    def test_pick_is_most_often_best(self):
+        # close, uncertain posteriors: single draws disagree, the ranking doesn't
+        rows = [(1, 10, "Coffee", "one cup", 3, 10.0, 2.0, 20.0),
+                (1, 10, "Coffee", "two cups", 3, 9.0, 2.0, 20.0)]
+        picks = {recommendations(rows, rng=seed)[1][0][1] for seed in range(10)}
+        self.assertEqual(picks, {"one cup"})
+        single = {recommendations(rows, rng=seed, n_draws=1)[1][0][1] for seed in range(10)}
+        self.assertEqual(single, {"one cup", "two cups"})
+
+    def test_next_run(self):
+        at = day_time(9, 0)
+        morning = datetime(2026, 1, 1, 8, 0, tzinfo=timezone.utc)
+        self.assertEqual(next_run(at, morning), datetime(2026, 1, 1, 9, 0, tzinfo=timezone.utc))
+        self.assertEqual(next_run(at, morning.replace(hour=9)), datetime(2026, 1, 2, 9, 0, tzinfo=timezone.utc))
+
+
+class TestBroadcaster(unittest.IsolatedAsyncioTestCase):
+    USERS = list(range(101, 113))
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = AsyncDatabaseDriver(os.path.join(self.tmp.name, "main.db"))
+        for user_id in self.USERS:
+            await self.db.add_optimization("Coffee", user_id)
+            for variant, value in (("one cup", 1), ("two cups", 9)):
+                await self.db.add_variant("Coffee", variant, user_id)
+                for _ in range(20):
+                    await self.db.add_option("Coffee", variant, value, user_id)
+        self.server = FakeBotAPI()
+        base = await self.server.start()
+        self.bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base)), parse_mode="HTML")
+
+    async def asyncTearDown(self):
+        await self.bot.session.close()
+        await self.server.stop()
+        await self.db.close()
+        self.tmp.cleanup()
+
+    def _broadcaster(self, **kwargs):
+        kwargs.setdefault("rate", 1000)
+        return Broadcaster(self.bot, self.db, page_size=5, rng=0, **kwargs)
+
+    async def test_every_user_gets_one_message(self):
+        self.server.delay = 0.01
+        sent, skipped, failed = await self._broadcaster(max_concurrency=3).run("2026-01-01")
+        self.assertEqual((sent, skipped, failed), (len(self.USERS), 0, 0))
+        self.assertEqual(sorted(chat for chat, _ in self.server.sent), self.USERS)
+        self.assertIn("<b>Coffee</b>: two cups", self.server.sent[0][1])
+        self.assertLessEqual(self.server.max_in_flight, 3)
+        self.assertGreater(self.server.max_in_flight, 1)
+
+    async def test_rate_limit(self):
+        start = time.monotonic()
+        await self._broadcaster(rate=40).run("2026-01-01")
+        # the first message goes out at once, the other 11 at 40 per second
+        self.assertGreaterEqual(time.monotonic() - start, 11 / 40 - 0.01)
+
+    async def test_flood_wait_and_blocked_users(self):
+        self.server.flood[101] = 1
+        self.server.blocked.add(102)
+        self.server.broken.add(103)
+        sent, skipped, failed = await self._broadcaster().run("2026-01-01")
+        self.assertEqual((sent, failed), (len(self.USERS) - 2, 2))
+        self.assertIn(101, [chat for chat, _ in self.server.sent])
+        # the blocked user is not retried, the server error is
+        self.server.broken.clear()
+        self.server.sent.clear()
+        self.assertEqual(await self._broadcaster().run("2026-01-01"), (1, len(self.USERS) - 1, 0))
+        self.assertEqual(self.server.sent[0][0], 103)
+
+    async def test_resumes_after_interruption(self):
+        self.server.hold_after = 4
+        task = asyncio.create_task(self._broadcaster(max_concurrency=2).run("2026-01-01"))
+        while len(self.server.sent) < 4 or not self.server.in_flight:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        first = [chat for chat, _ in self.server.sent]
+        self.server.hold_after = None
+        sent, skipped, failed = await self._broadcaster().run("2026-01-01")
+        self.assertEqual((sent, skipped, failed), (len(self.USERS) - 4, 4, 0))
+        self.assertEqual(sorted(chat for chat, _ in self.server.sent), self.USERS)
+        self.assertEqual(len(first), 4)
+        # a new run key starts over
+        self.assertEqual((await self._broadcaster().run("2026-01-02"))[0], len(self.USERS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import bulk_io
+from database_driver import DatabaseDriver
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+class TestBulkIO(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "main_db.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def _write_csv(self, name, text):
+        path = self._path(name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_csv_import_creates_variants_and_posteriors(self):
+        path = self._write_csv("log.csv", (
+            "optimization,variant,value,timestamp\n"
+            "Commute,Bus,45,2024-01-01 08:00:00\n"
+            "Commute,Bike,30,2024-01-02 08:00:00\n"
+            "Commute,Bus,00:41:00,1704268800\n"
+            "Coffee,Espresso,2,\n"
+        ))
+        db = DatabaseDriver(self.db_path)
+        try:
+            self.assertEqual(bulk_io.import_file(db, path, 7, chunk_size=2), 4)
+            self.assertEqual([row[0] for row in db.get_optimizations(7)], ["Commute", "Coffee"])
+            rows = db.get_all_samples_for_optimization(7, "Commute")
+            self.assertEqual([row[1:] for row in rows], [
+                ("Bus", 45, 1704096000), ("Bike", 30, 1704182400), ("Bus", "00:41:00", 1704268800),
+            ])
+            posterior = db.get_posterior("Commute", 7)
+            self.assertEqual([row[:3] for row in posterior], [("Bus", 1, 45.0), ("Bike", 1, 30.0)])
+            self.assertIsInstance(db.get_all_samples_for_optimization(7, "Coffee")[0][3], int)
+        finally:
+            db.close()
+
+    def test_csv_round_trip(self):
+        db = DatabaseDriver(self.db_path)
+        try:
+            rows = [("Commute", "Bus", 40 + i, 1704096000 + 3600 * i) for i in range(25)]
+            db.import_samples(1, rows, chunk_size=10)
+            path = self._path("export.csv")
+            self.assertEqual(bulk_io.export_file(db, path, 1, chunk_size=7), 25)
+            exported = list(bulk_io.read_csv_rows(path))
+            self.assertEqual(exported[0], ("Commute", "Bus", "40", "2024-01-01 08:00:00"))
+            db.import_samples(2, exported)
+            self.assertEqual(list(db.export_samples(2)), list(db.export_samples(1)))
+        finally:
+            db.close()
+
+    def test_missing_columns(self):
+        path = self._write_csv("bad.csv", "optimization,variant,value\nA,B,1\n")
+        with self.assertRaises(ValueError):
+            list(bulk_io.read_csv_rows(path))
+
+    def test_cli(self):
+        path = self._write_csv("log.csv", (
+            "optimization,variant,value,timestamp\n"
+            "Commute,Bus,45,2024-01-01 08:00:00\n"
+            "Other,Car,20,2024-01-01 08:00:00\n"
+        ))
+        out = io.StringIO()
+        with redirect_stdout(out):
+            bulk_io.main(["import", path, "--user", "3", "--db", self.db_path])
+            bulk_io.main(["export", self._path("out.csv"), "--user", "3",
+                          "--optimization", "Commute", "--db", self.db_path])
+        self.assertIn("Imported 2 samples", out.getvalue())
+        self.assertIn("Exported 1 samples", out.getvalue())
+        self.assertEqual(list(bulk_io.read_csv_rows(self._path("out.csv"))),
+                         [("Commute", "Bus", "45", "2024-01-01 08:00:00")])
+
+    @unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed")
+    def test_parquet_round_trip(self):
+        db = DatabaseDriver(self.db_path)
+        try:
+            db.import_samples(1, [("Commute", "Bus", 45, 1704096000), ("Commute", "Bus", "00:41:00", None)])
+            path = self._path("export.parquet")
+            self.assertEqual(bulk_io.export_file(db, path, 1), 2)
+            db.import_samples(2, bulk_io.read_rows(path))
+            self.assertEqual(list(db.export_samples(2)), list(db.export_samples(1)))
+        finally:
+            db.close()
+
+    @unittest.skipIf(HAS_PYARROW, "pyarrow is installed")
+    def test_parquet_needs_pyarrow(self):
+        with self.assertRaises(ImportError):
+            list(bulk_io.read_rows(self._path("log.parquet")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,12 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
 import unittest
-from database_driver import DatabaseDriver
+from datetime import datetime, timezone
+from database_driver import MIGRATIONS, AsyncDatabaseDriver, DatabaseDriver, to_epoch
+import mvsampling.mvsampling as mv
 
 class TestDatabaseDriver(unittest.TestCase):
     def setUp(self):
@@ -81,5 +88,670 @@ class TestDatabaseDriver(unittest.TestCase):
         retrieved_name = self.db.get_optimization_name(optimization_id)
         self.assertEqual(retrieved_name, opt_name)
 
+    def _add_samples(self, user_id, opt_name, samples):
+        self.db.add_optimization(opt_name, user_id)
+        for variant_name in sorted({name for name, _ in samples}):
+            self.db.add_variant(opt_name, variant_name, user_id)
+        for variant_name, value in samples:
+            self.db.add_option(opt_name, variant_name, value, user_id)
+
+    def test_add_option_maintains_posterior(self):
+        samples = [("A", "45"), ("B", 30), ("A", 50.5), ("A", 41), ("B", "32")]
+        self._add_samples(1, "Commute", samples)
+        table = mv.HandsTable(["A", "B"])
+        for variant_name, value in samples:
+            table.update_hands(variant_name, float(value))
+        posterior = self.db.get_posterior("Commute", 1)
+        self.assertEqual([row[0] for row in posterior], ["A", "B"])
+        for i, (_, te, mu, alpha, beta, last_sample_id) in enumerate(posterior):
+            self.assertEqual(te, table.Te[i])
+            self.assertAlmostEqual(mu, table.mu[i])
+            self.assertAlmostEqual(alpha, table.alpha[i])
+            self.assertAlmostEqual(beta, table.beta[i])
+        self.assertEqual(posterior[0][5], 4)
+        self.assertEqual(posterior[1][5], 5)
+
+    def test_posterior_for_new_variant_is_prior(self):
+        self.db.add_optimization("Opt", 1)
+        self.db.add_variant("Opt", "A", 1)
+        self.assertEqual(self.db.get_posterior("Opt", 1), [("A", 0, 0.0, 0.5, 0.5, 0)])
+
+    def test_non_numeric_sample_skips_posterior(self):
+        self._add_samples(1, "Opt", [("A", 10)])
+        self.db.add_option("Opt", "A", "00:45:00", 1)
+        self.assertEqual(len(self.db.get_all_samples_for_optimization(1, "Opt")), 2)
+        self.assertEqual(self.db.get_posterior("Opt", 1)[0][1], 1)
+
+    def test_posterior_counts_values_sqlite_stores_as_numbers(self):
+        self._add_samples(1, "Opt", [("A", 10)])
+        # text to SQLite, although Python's float() parses them
+        for value in ("nan", "infinity", "1_000"):
+            self.db.add_option("Opt", "A", value, 1)
+        incremental = self.db.get_posterior("Opt", 1)
+        self.assertEqual(incremental[0][1:3], (1, 10.0))
+        self.db.rebuild_posteriors()
+        self.assertEqual(self.db.get_posterior("Opt", 1), incremental)
+
+    def test_infinite_value_is_rejected(self):
+        self._add_samples(1, "Opt", [("A", 10)])
+        for value in ("1e400", float("inf")):
+            with self.assertRaises(ValueError):
+                self.db.add_option("Opt", "A", value, 1)
+        self.assertEqual(len(self.db.get_all_samples_for_optimization(1, "Opt")), 1)
+        self.assertEqual(self.db.get_posterior("Opt", 1)[0][1:3], (1, 10.0))
+
+    def test_rebuild_posteriors_matches_incremental(self):
+        samples = [("A", 10), ("B", 20), ("A", 14), ("B", 27), ("A", 9), ("C", 1)]
+        self._add_samples(1, "Opt", samples)
+        self._add_samples(2, "Other", [("A", 3)])
+        self.db.add_variant("Opt", "D", 1)
+        incremental = self.db.get_posterior("Opt", 1)
+        self.db.rebuild_posteriors()
+        rebuilt = self.db.get_posterior("Opt", 1)
+        self.assertEqual(len(rebuilt), 4)
+        for old, new in zip(incremental, rebuilt):
+            self.assertEqual(old[0], new[0])
+            self.assertEqual(old[1], new[1])
+            for a, b in zip(old[2:], new[2:]):
+                self.assertAlmostEqual(a, b)
+
+    def test_remove_variant_drops_posterior(self):
+        self._add_samples(1, "Opt", [("A", 10), ("B", 5)])
+        self.db.remove_variant("Opt", "A", 1)
+        count = self.db.conn.execute("SELECT COUNT(*) FROM variant_posterior").fetchone()[0]
+        self.assertEqual(count, 1)
+
+    def test_windowed_posterior_expires_old_samples(self):
+        self._add_samples(1, "Opt", [("A", 10), ("B", 20), ("A", 30), ("B", 25)])
+        self._add_samples(2, "Other", [("A", 1)])
+        # samples 1 and 2 of "Opt" are now 100 days older than the rest
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = change_datetime - 100 * 86400 WHERE id IN (1, 2)"
+        )
+        self.db.conn.commit()
+        self.db.add_option("Opt", "A", 12, 1)
+
+        expected = mv.HandsTable(["A", "B"])
+        expected.update_many(["A", "B", "A"], [30, 25, 12])
+        for _ in range(2):
+            posterior = self.db.get_posterior("Opt", 1, days=91)
+            for i, (_, te, mu, alpha, beta, _) in enumerate(posterior):
+                self.assertEqual(te, expected.Te[i])
+                self.assertAlmostEqual(mu, expected.mu[i])
+                self.assertAlmostEqual(alpha, expected.alpha[i])
+                self.assertAlmostEqual(beta, expected.beta[i])
+        # new samples keep accumulating on top of the moved window
+        self.db.add_option("Opt", "B", 40, 1)
+        expected.update_hands("B", 40)
+        posterior = self.db.get_posterior("Opt", 1, days=91)
+        self.assertEqual(posterior[1][1], 2)
+        self.assertAlmostEqual(posterior[1][4], expected.beta[1])
+        # the unwindowed read of another optimization is untouched
+        self.assertEqual(self.db.get_posterior("Other", 2)[0][1], 1)
+
+    def test_windowed_posterior_empties_variant(self):
+        self._add_samples(1, "Opt", [("A", 10), ("B", 20)])
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = change_datetime - 100 * 86400 WHERE id = 1"
+        )
+        self.db.conn.commit()
+        posterior = self.db.get_posterior("Opt", 1, days=91)
+        self.assertEqual(posterior[0][1:5], (0, 0.0, 0.5, 0.5))
+        self.assertEqual(posterior[1][1], 1)
+
+    def test_window_length_can_change(self):
+        self._add_samples(1, "Opt", [("A", 10), ("A", 20), ("A", 30), ("A", 40)])
+        # samples 1-3 are 28, 20 and 10 days older than sample 4
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = change_datetime - "
+            "CASE id WHEN 1 THEN 28 WHEN 2 THEN 20 WHEN 3 THEN 10 ELSE 0 END * 86400"
+        )
+        self.db.conn.commit()
+
+        def counts(days):
+            te, mu = self.db.get_posterior("Opt", 1, days=days)[0][1:3]
+            return te, mu
+        self.assertEqual(counts(7), (1, 40.0))
+        self.assertEqual(counts(30), (4, 25.0))
+        self.assertEqual(counts(15), (2, 35.0))
+        self.assertEqual(counts(21), (3, 30.0))
+        self.assertEqual(counts(None), (4, 25.0))
+        self.assertEqual(counts(7), (1, 40.0))
+        # all posteriors without a window are complete as well
+        self.assertEqual(self.db.get_all_posteriors()[0][4:6], (4, 25.0))
+        self.assertEqual(self.db.get_all_posteriors(days=15)[0][4:6], (2, 35.0))
+
+    def test_window_moves_back_when_newest_variant_is_removed(self):
+        self._add_samples(1, "Opt", [("A", 10), ("A", 20), ("A", 30), ("B", 5)])
+        # A's samples are 150 days older than B's
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = change_datetime - 150 * 86400 WHERE id <= 3"
+        )
+        self.db.conn.commit()
+        self.assertEqual(self.db.get_posterior("Opt", 1, days=91)[0][1], 0)
+        self.db.remove_variant("Opt", "B", 1)
+        self.assertEqual(self.db.get_posterior("Opt", 1, days=91), [("A", 3, 20.0, 2.0, 100.5, 3)])
+        self.assertEqual(len(self.db.get_samples_in_window(1, "Opt", days=91)), 3)
+
+    def test_samples_in_window(self):
+        self._add_samples(1, "Opt", [("A", 10), ("B", "20.5"), ("A", 30)])
+        self.db.add_option("Opt", "A", "00:45:00", 1)
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = 1704096000 WHERE id = 1"
+        )
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = 1709280000 WHERE id = 2"
+        )
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = 1713168000 WHERE id IN (3, 4)"
+        )
+        self.db.conn.commit()
+        rows = self.db.get_samples_in_window(1, "Opt", days=91)
+        self.assertEqual(rows, [("B", 20.5, 1709280000), ("A", 30.0, 1713168000)])
+        self.assertIsInstance(rows[1][1], float)
+        self.assertEqual(len(self.db.get_samples_in_window(1, "Opt", days=365)), 3)
+
+    def test_optimization_summaries(self):
+        self._add_samples(1, "Opt", [("A", 10), ("B", 20), ("A", 30)])
+        self.db.add_optimization("Empty", 1)
+        self.db.add_optimization("Other user", 2)
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = 1893484800 WHERE id = 2"
+        )
+        self.db.conn.commit()
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        summaries = self.db.get_optimization_summaries(1)
+        self.db.conn.set_trace_callback(None)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([row[0] for row in summaries], ["Opt", "Empty"])
+        self.assertEqual(summaries[0][3:], (2, 3, 1893484800))
+        self.assertEqual(summaries[1][3:5], (0, 0))
+        self.assertEqual(summaries[1][5], summaries[1][1])
+        self.assertEqual([row[:3] for row in summaries], self.db.get_optimizations(1))
+
+    def test_all_posteriors(self):
+        self._add_samples(1, "Opt", [("A", 10), ("B", 20), ("A", 30)])
+        self._add_samples(2, "Other", [("C", 5)])
+        self.db.add_optimization("Empty", 1)
+        rows = self.db.get_all_posteriors()
+        self.assertEqual([row[:4] for row in rows],
+                         [(1, 1, "Opt", "A"), (1, 1, "Opt", "B"), (2, 2, "Other", "C")])
+        self.assertEqual(rows[0][4:6], (2, 20.0))
+        self.db.conn.execute(
+            "UPDATE optimization_samples SET change_datetime = change_datetime - 100 * 86400 WHERE id = 1"
+        )
+        self.db.conn.commit()
+        self.assertEqual(self.db.get_all_posteriors(days=91)[0][4:6], (1, 30.0))
+
+    def test_posterior_version(self):
+        self.db.add_optimization("Opt", 1)
+        self.assertEqual(self.db.get_posterior_version("Opt", 1), (1, 0, 0))
+        self.db.add_variant("Opt", "A", 1)
+        self.db.add_variant("Opt", "B", 1)
+        self.assertEqual(self.db.get_posterior_version("Opt", 1), (1, 0, 2))
+        self.db.add_option("Opt", "B", 3, 1)
+        self.db.add_option("Opt", "A", 4, 1)
+        self.assertEqual(self.db.get_posterior_version("Opt", 1), (1, 2, 2))
+        self.db.remove_variant("Opt", "A", 1)
+        self.assertEqual(self.db.get_posterior_version("Opt", 1), (1, 1, 1))
+
+    def test_all_posteriors_pages_by_user(self):
+        for user_id in (3, 1, 2):
+            self._add_samples(user_id, "Opt", [("A", user_id)])
+        self._add_samples(1, "Second", [("B", 7)])
+        self.db.add_optimization("Empty", 4)
+        first = self.db.get_all_posteriors(limit=2)
+        self.assertEqual([row[:4] for row in first],
+                         [(1, 2, "Opt", "A"), (1, 4, "Second", "B"), (2, 3, "Opt", "A")])
+        second = self.db.get_all_posteriors(days=91, after_user_id=2, limit=2)
+        self.assertEqual([row[:4] for row in second], [(3, 1, "Opt", "A")])
+        self.assertEqual(self.db.get_all_posteriors(after_user_id=3, limit=2), [])
+
+    def test_broadcast_log(self):
+        self.db.mark_broadcast_sent("2026-01-01", 1)
+        self.db.mark_broadcast_sent("2026-01-01", 1)
+        self.db.mark_broadcast_sent("2026-01-02", 2)
+        self.assertEqual(self.db.get_broadcast_sent("2026-01-01"), [1])
+        self.assertEqual(self.db.get_broadcast_sent("2026-01-03"), [])
+        self.db.conn.execute(
+            "UPDATE broadcast_log SET sent_at = sent_at - 31 * 86400 WHERE run_key = '2026-01-01'"
+        )
+        self.db.conn.commit()
+        self.assertEqual(self.db.prune_broadcast_log(30), 1)
+        self.assertEqual(self.db.get_broadcast_sent("2026-01-01"), [])
+        self.assertEqual(self.db.get_broadcast_sent("2026-01-02"), [2])
+
+    def test_window_query_uses_time_index(self):
+        rows = self.db.conn.execute(
+            '''
+            EXPLAIN QUERY PLAN
+            SELECT id FROM optimization_samples
+            WHERE optimization_id = 1 AND change_datetime >= 1704067200
+            '''
+        ).fetchall()
+        plan = " ".join(str(row[-1]) for row in rows)
+        self.assertIn("idx_optimization_samples_opt_time", plan)
+
+    def test_transaction_commits_once(self):
+        self.db.add_optimization("Opt", 1)
+        with self.db.transaction():
+            self.db.add_variant("Opt", "A", 1)
+            self.db.add_option("Opt", "A", 1, 1)
+            self.assertTrue(self.db.conn.in_transaction)
+        self.assertFalse(self.db.conn.in_transaction)
+        self.assertEqual(self.db.get_posterior("Opt", 1)[0][1], 1)
+
+    def test_transaction_rolls_back_when_block_raises(self):
+        self.db.add_optimization("Opt", 1)
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.add_variant("Opt", "A", 1)
+                raise RuntimeError("abort")
+        self.assertEqual(self.db.get_variants("Opt", 1), [])
+
+    def test_transaction_rolls_back_when_commit_fails(self):
+        class BusyOnCommit:
+            def __init__(self, conn):
+                self._conn = conn
+
+            def commit(self):
+                raise sqlite3.OperationalError("database is locked")
+
+            def __getattr__(self, name):
+                return getattr(self._conn, name)
+
+        self.db.add_optimization("Opt", 1)
+        conn = self.db.conn
+        self.db.conn = BusyOnCommit(conn)
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                self.db.execute_batch([("add_variant", ("Opt", "A", 1), {})])
+            self.assertFalse(conn.in_transaction)
+        finally:
+            self.db.conn = conn
+        self.assertEqual(self.db.id_cache_info().currsize, 0)
+        # the next write must not persist the failed batch
+        self.db.add_variant("Opt", "B", 1)
+        self.assertEqual([row[0] for row in self.db.get_variants("Opt", 1)], ["B"])
+
+    def test_execute_batch_isolates_failures(self):
+        self.db.add_optimization("Opt", 1)
+        self.db.add_variant("Opt", "A", 1)
+        outcomes = self.db.execute_batch([
+            ("add_option", ("Opt", "A", 1, 1), {}),
+            ("add_option", ("Opt", "missing", 2, 1), {}),
+            ("add_option", ("Opt", "A", 3, 1), {}),
+        ])
+        self.assertIsNone(outcomes[0][1])
+        self.assertIsInstance(outcomes[1][1], ValueError)
+        self.assertIsNone(outcomes[2][1])
+        rows = self.db.get_all_samples_for_optimization(1, "Opt")
+        self.assertEqual([row[2] for row in rows], [1, 3])
+
+    def test_add_options_bulk(self):
+        self._add_samples(1, "Opt", [("A", 10), ("B", 20)])
+        inserted = self.db.add_options("Opt", 1, [
+            ("A", 12, "2024-01-01 08:00:00"),
+            ("B", 22, datetime(2024, 1, 2, 8)),
+            ("A", 14),
+        ])
+        self.assertEqual(inserted, 3)
+        expected = mv.HandsTable(["A", "B"])
+        expected.update_many(["A", "B", "A", "B", "A"], [10, 20, 12, 22, 14])
+        posterior = self.db.get_posterior("Opt", 1)
+        self.assertEqual([row[1] for row in posterior], [3, 2])
+        for i, row in enumerate(posterior):
+            self.assertAlmostEqual(row[2], expected.mu[i])
+            self.assertAlmostEqual(row[4], expected.beta[i])
+        rows = self.db.get_all_samples_for_optimization(1, "Opt")
+        self.assertEqual(rows[2][3], 1704096000)
+        self.assertEqual(rows[3][3], 1704182400)
+        self.assertIsInstance(rows[4][3], int)
+
+    def test_add_options_unknown_variant_inserts_nothing(self):
+        self._add_samples(1, "Opt", [("A", 10)])
+        with self.assertRaises(ValueError):
+            self.db.add_options("Opt", 1, [("A", 1), ("Z", 2)])
+        self.assertEqual(len(self.db.get_all_samples_for_optimization(1, "Opt")), 1)
+
+    def test_add_option_resolves_ids_from_cache(self):
+        self._add_samples(1, "Opt", [("A", 10)])
+        before = self.db.id_cache_info()
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        self.db.add_option("Opt", "A", 12, 1)
+        self.db.conn.set_trace_callback(None)
+        after = self.db.id_cache_info()
+        self.assertEqual(after.hits - before.hits, 2)
+        self.assertEqual(after.misses, before.misses)
+        lookups = [sql for sql in statements
+                   if "SELECT" in sql and ("user_optimization" in sql or "optimization_variant" in sql)]
+        self.assertFalse(lookups)
+
+    def test_id_cache_is_bounded(self):
+        db = DatabaseDriver(":memory:", id_cache_size=2)
+        for name in ("A", "B", "C"):
+            db.add_optimization(name, 1)
+            db.retrieve_optimization_id(name, 1)
+        self.assertEqual(db.id_cache_info().currsize, 2)
+        db.retrieve_optimization_id("A", 1)
+        self.assertEqual(db.id_cache_info().hits, 0)
+        db.close()
+
+    def test_remove_invalidates_cached_ids(self):
+        self._add_samples(1, "Opt", [("A", 10)])
+        self.db.remove_variant("Opt", "A", 1)
+        self.db.add_variant("Opt", "A", 1)
+        self.db.add_option("Opt", "A", 5, 1)
+        self.assertEqual(self.db.get_posterior("Opt", 1)[0][:3], ("A", 1, 5.0))
+
+        self.db.remove_optimization("Opt", 1)
+        self.db.add_optimization("Opt", 1)
+        with self.assertRaises(ValueError):
+            self.db.add_option("Opt", "A", 5, 1)
+        self.db.add_variant("Opt", "A", 1)
+        self.db.add_option("Opt", "A", 7, 1)
+        self.assertEqual(self.db.get_posterior("Opt", 1)[0][:3], ("A", 1, 7.0))
+
+    def test_rollback_clears_cached_ids(self):
+        self.db.add_optimization("Opt", 1)
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.add_variant("Opt", "A", 1)
+                self.db.add_option("Opt", "A", 1, 1)
+                raise RuntimeError("abort")
+        with self.assertRaises(ValueError):
+            self.db.add_option("Opt", "A", 1, 1)
+
+    def test_import_samples_keeps_committed_chunks(self):
+        rows = [("Opt", "A", i, 1704096000 + i) for i in range(5)] + [("Opt", "A", 1, "not a date")]
+        with self.assertRaises(ValueError):
+            self.db.import_samples(1, rows, chunk_size=5)
+        posterior = self.db.get_posterior("Opt", 1)
+        self.assertEqual(posterior[0][:3], ("A", 5, 2.0))
+        self.assertEqual(len(list(self.db.export_samples(1, "Opt"))), 5)
+
+    def test_export_samples_pages_by_id(self):
+        self._add_samples(1, "Opt", [("A", i) for i in range(5)])
+        self._add_samples(1, "Other", [("B", 9)])
+        self._add_samples(2, "Opt", [("A", 9)])
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        rows = list(self.db.export_samples(1, chunk_size=2))
+        self.db.conn.set_trace_callback(None)
+        self.assertEqual([row[:3] for row in rows], [("Opt", "A", i) for i in range(5)] + [("Other", "B", 9)])
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(len(list(self.db.export_samples(1, "Other"))), 1)
+
+    def test_existing_database_gets_posteriors(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "old.db")
+            old = DatabaseDriver(path)
+            old.add_optimization("Opt", 1)
+            old.add_variant("Opt", "A", 1)
+            old.add_option("Opt", "A", 10, 1)
+            old.add_option("Opt", "A", 20, 1)
+            # simulate a database from before the posterior table and migrations existed
+            old.conn.execute("DROP TABLE variant_posterior")
+            old.conn.execute("PRAGMA user_version = 0")
+            old.conn.commit()
+            old.close()
+            upgraded = DatabaseDriver(path)
+            try:
+                self.assertEqual(upgraded.get_posterior("Opt", 1), [("A", 2, 15.0, 1.5, 25.5, 2)])
+            finally:
+                upgraded.close()
+
+    def test_duplicate_names_are_rejected(self):
+        self._add_samples(1, "Opt", [("A", 10)])
+        with self.assertRaises(ValueError):
+            self.db.add_optimization("Opt", 1)
+        with self.assertRaises(ValueError):
+            self.db.add_variant("Opt", "A", 1)
+        # the same names are fine for another user
+        self._add_samples(2, "Opt", [("A", 10)])
+
+    def test_lookups_use_unique_indexes(self):
+        for sql, index in [
+            ("SELECT id FROM user_optimization WHERE optimization_name = 'x' AND telegram_user_id = 1",
+             "idx_user_optimization_user_name"),
+            ("SELECT id FROM optimization_variant WHERE optimization_id = 1 AND variant_name = 'x'",
+             "idx_optimization_variant_opt_name"),
+            ("SELECT variant_id, option_value FROM optimization_samples WHERE optimization_id = 1 AND change_datetime >= 0",
+             "COVERING INDEX idx_optimization_samples_opt_time"),
+        ]:
+            plan = " ".join(str(row[-1]) for row in self.db.conn.execute("EXPLAIN QUERY PLAN " + sql))
+            self.assertIn(index, plan)
+
+    def test_to_epoch(self):
+        self.assertIsNone(to_epoch(None))
+        self.assertEqual(to_epoch(1704096000.5), 1704096000)
+        self.assertEqual(to_epoch("2024-01-01 08:00:00"), 1704096000)
+        self.assertEqual(to_epoch(datetime(2024, 1, 1, 8)), 1704096000)
+        self.assertEqual(to_epoch(datetime(2024, 1, 1, 8, tzinfo=timezone.utc)), 1704096000)
+
+class TestMigrations(unittest.TestCase):
+    LEGACY_SCHEMA = '''
+        CREATE TABLE users (telegram_user_id INTEGER PRIMARY KEY);
+        CREATE TABLE user_optimization (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            optimization_name TEXT NOT NULL,
+            change_datetime TEXT DEFAULT (datetime('now')),
+            telegram_user_id INTEGER,
+            FOREIGN KEY (telegram_user_id) REFERENCES users(telegram_user_id) ON DELETE CASCADE
+        );
+        CREATE TABLE optimization_variant (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            optimization_id INTEGER NOT NULL,
+            variant_name TEXT NOT NULL,
+            change_datetime TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (optimization_id) REFERENCES user_optimization(id) ON DELETE CASCADE
+        );
+        CREATE TABLE optimization_samples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            optimization_id INTEGER NOT NULL,
+            variant_id INTEGER NOT NULL,
+            option_value NUMERIC,
+            change_datetime TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (optimization_id) REFERENCES user_optimization(id) ON DELETE CASCADE,
+            FOREIGN KEY (variant_id) REFERENCES optimization_variant(id) ON DELETE CASCADE
+        );
+        INSERT INTO users VALUES (1);
+        INSERT INTO user_optimization VALUES
+            (1, 'Opt', '2024-01-01 00:00:00', 1),
+            (2, 'Opt', '2024-01-02 00:00:00', 1),
+            (3, 'Gone', '2024-01-03 00:00:00', 1);
+        INSERT INTO optimization_variant VALUES
+            (1, 1, 'A', '2024-01-01 00:00:00'),
+            (2, 2, 'A', '2024-01-02 00:00:00'),
+            (3, 2, 'B', '2024-01-02 00:00:00');
+        INSERT INTO optimization_samples VALUES
+            (1, 1, 1, 10, '2024-01-01 08:00:00'),
+            (2, 2, 2, 20, '2024-01-02 08:00:00'),
+            (3, 2, 3, 5, '2024-01-02 09:00:00');
+        DELETE FROM user_optimization WHERE id = 3;
+    '''
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "legacy.db")
+        conn = sqlite3.connect(self.path)
+        conn.executescript(self.LEGACY_SCHEMA)
+        conn.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_upgrades_legacy_database_in_place(self):
+        db = DatabaseDriver(self.path)
+        try:
+            version = db.conn.execute("PRAGMA user_version").fetchone()[0]
+            self.assertEqual(version, len(MIGRATIONS))
+            self.assertEqual(db.get_optimizations(1), [("Opt", 1704067200, 1)])
+            self.assertEqual(db.get_variants("Opt", 1), [("A", 1704067200), ("B", 1704153600)])
+            rows = db.get_all_samples_for_optimization(1, "Opt")
+            self.assertEqual([row[1:] for row in rows],
+                             [("A", 10, 1704096000), ("A", 20, 1704182400), ("B", 5, 1704186000)])
+            self.assertEqual(db.get_posterior("Opt", 1), [("A", 2, 15.0, 1.5, 25.5, 2), ("B", 1, 5.0, 1.0, 0.5, 3)])
+            self.assertEqual(db.conn.execute("PRAGMA foreign_key_check").fetchall(), [])
+            # AUTOINCREMENT does not hand out the id of the deleted optimization again
+            db.add_optimization("New", 1)
+            self.assertEqual(db.retrieve_optimization_id("New", 1), 4)
+            # merged duplicates can't come back
+            with self.assertRaises(ValueError):
+                db.add_variant("Opt", "A", 1)
+            types = {row[1]: row[2] for row in db.conn.execute("PRAGMA table_info(optimization_samples)")}
+            self.assertEqual(types["change_datetime"], "INTEGER")
+        finally:
+            db.close()
+
+    def test_windows_without_length_are_rebuilt(self):
+        db = DatabaseDriver(self.path)
+        self.assertEqual([row[1] for row in db.get_posterior("Opt", 1, days=0.5)], [1, 1])
+        # a window cut before version 4, which didn't record its length
+        db.conn.execute("UPDATE variant_posterior SET window_days = NULL")
+        db.conn.execute("PRAGMA user_version = 3")
+        db.conn.commit()
+        db.close()
+        db = DatabaseDriver(self.path)
+        try:
+            self.assertEqual([row[1] for row in db.get_posterior("Opt", 1)], [2, 1])
+        finally:
+            db.close()
+
+    def test_migrations_run_once(self):
+        DatabaseDriver(self.path).close()
+        db = DatabaseDriver(self.path)
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        db.create_tables()
+        db.conn.set_trace_callback(None)
+        db.close()
+        self.assertEqual(statements, ["PRAGMA user_version"])
+
+    def test_migrations_are_idempotent(self):
+        db = DatabaseDriver(self.path)
+        db.conn.execute("PRAGMA user_version = 0")
+        db.conn.commit()
+        db.create_tables()
+        try:
+            rows = db.get_all_samples_for_optimization(1, "Opt")
+            self.assertEqual(rows[0][3], 1704096000)
+            self.assertEqual(db.get_posterior("Opt", 1)[0][:2], ("A", 2))
+        finally:
+            db.close()
+
+class TestPooledDatabaseDriver(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = DatabaseDriver(os.path.join(self.tmp.name, "pool.db"), pool_size=3)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_wal_and_pragmas(self):
+        self.assertEqual(self.db.conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(self.db.conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+        self.assertEqual(self.db._readers.qsize(), 3)
+
+    def test_readers_see_committed_writes(self):
+        self.db.add_optimization("Opt", 1)
+        self.db.add_variant("Opt", "A", 1)
+        self.db.add_option("Opt", "A", 5, 1)
+        self.assertEqual(self.db.get_variants("Opt", 1)[0][0], "A")
+        self.assertEqual(self.db.get_posterior("Opt", 1, days=91)[0][1:3], (1, 5.0))
+
+    def test_reads_proceed_while_writer_is_busy(self):
+        self.db.add_optimization("Opt", 1)
+        results = []
+        with self.db._write_lock:
+            # a write is in progress on another thread; readers must not wait for it
+            reader = threading.Thread(target=lambda: results.append(self.db.get_optimizations(1)))
+            reader.start()
+            reader.join(timeout=5)
+            self.assertFalse(reader.is_alive())
+        self.assertEqual(results[0][0][0], "Opt")
+
+    def test_readers_are_read_only(self):
+        with self.db._reading() as cursor:
+            with self.assertRaises(sqlite3.OperationalError):
+                cursor.execute("DELETE FROM users")
+
+    def test_memory_database_falls_back_to_one_connection(self):
+        db = DatabaseDriver(":memory:", pool_size=2)
+        try:
+            db.add_optimization("Opt", 1)
+            self.assertIsNone(db._readers)
+            self.assertEqual(len(db.get_optimizations(1)), 1)
+        finally:
+            db.close()
+
+
+class TestAsyncDatabaseDriver(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = AsyncDatabaseDriver(db_name=":memory:")
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_same_surface_as_sync_driver(self):
+        await self.db.add_optimization("Commute", 1)
+        await self.db.add_variant("Commute", "Bus", 1)
+        await self.db.add_option(optimization_name="Commute", variant_name="Bus", option_value="30", user_id=1)
+        optimizations = await self.db.get_optimizations(1)
+        self.assertEqual(optimizations[0][0], "Commute")
+        posterior = await self.db.get_posterior("Commute", 1, days=91)
+        self.assertEqual(posterior[0][:3], ("Bus", 1, 30.0))
+
+    async def test_calls_run_off_the_event_loop_in_order(self):
+        loop_thread = threading.get_ident()
+        await self.db.add_optimization("Opt", 1)
+        await self.db.add_variant("Opt", "A", 1)
+        await asyncio.gather(*(self.db.add_option("Opt", "A", i, 1) for i in range(20)))
+        rows = await self.db.get_all_samples_for_optimization(1, "Opt")
+        self.assertEqual([row[2] for row in rows], list(range(20)))
+        worker = await asyncio.get_running_loop().run_in_executor(self.db._executor, threading.get_ident)
+        self.assertNotEqual(worker, loop_thread)
+
+    async def test_pooled_reads_use_reader_threads(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = AsyncDatabaseDriver(os.path.join(tmp, "pool.db"), pool_size=2)
+            try:
+                await db.add_optimization("Opt", 1)
+                results = await asyncio.gather(*(db.get_optimizations(1) for _ in range(10)))
+                self.assertTrue(all(result[0][0] == "Opt" for result in results))
+                self.assertIsNot(db._read_executor, db._executor)
+            finally:
+                await db.close()
+
+    async def test_group_commit(self):
+        db = AsyncDatabaseDriver(":memory:", commit_delay=0.01)
+        batches = []
+        execute_batch = db._driver.execute_batch
+        db._driver.execute_batch = lambda calls: batches.append(len(calls)) or execute_batch(calls)
+        try:
+            await db.add_optimization("Opt", 1)
+            await db.add_variant("Opt", "A", 1)
+            results = await asyncio.gather(
+                *(db.add_option("Opt", "A", i, 1) for i in range(10)),
+                db.add_option("Opt", "missing", 0, 1),
+                return_exceptions=True,
+            )
+            self.assertEqual(results[:10], [None] * 10)
+            self.assertIsInstance(results[10], ValueError)
+            self.assertEqual(batches, [1, 1, 11])
+            rows = await db.get_all_samples_for_optimization(1, "Opt")
+            self.assertEqual([row[2] for row in rows], list(range(10)))
+        finally:
+            await db.close()
+
+    async def test_errors_propagate(self):
+        with self.assertRaises(TypeError):
+            await self.db.get_optimization_name(1)
+        with self.assertRaises(AttributeError):
+            self.db.no_such_method
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+from states import NewVariant
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=3)
+OTHER_KEY = StorageKey(bot_id=1, chat_id=5, user_id=5)
+
+
+class TestSQLiteStorage(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "fsm_state.db")
+        self.now = 1_700_000_000
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _storage(self, **kwargs):
+        return SQLiteStorage(self.path, clock=lambda: self.now, **kwargs)
+
+    def _rows(self, storage):
+        return storage._executor.submit(
+            lambda: storage._connection().execute("SELECT key, state, data FROM fsm_state ORDER BY key").fetchall()
+        ).result()
+
+    async def test_state_and_data_round_trip(self):
+        storage = self._storage()
+        try:
+            self.assertIsNone(await storage.get_state(KEY))
+            self.assertEqual(await storage.get_data(KEY), {})
+            await storage.set_state(KEY, NewVariant.waiting_for_variant_name)
+            await storage.update_data(KEY, {"optimization_name": "Commute"})
+            self.assertEqual(await storage.get_state(KEY), "NewVariant:waiting_for_variant_name")
+            self.assertEqual(await storage.get_data(KEY), {"optimization_name": "Commute"})
+            self.assertIsNone(await storage.get_state(OTHER_KEY))
+        finally:
+            await storage.close()
+
+    async def test_survives_restart(self):
+        storage = self._storage()
+        await storage.set_state(KEY, NewVariant.waiting_for_variant_name)
+        await storage.set_data(KEY, {"optimization_name": "Commute"})
+        await storage.close()
+        restarted = self._storage()
+        try:
+            self.assertEqual(await restarted.get_state(KEY), "NewVariant:waiting_for_variant_name")
+            self.assertEqual(await restarted.get_data(KEY), {"optimization_name": "Commute"})
+        finally:
+            await restarted.close()
+
+    async def test_writes_are_batched(self):
+        storage = self._storage(flush_interval=60)
+        try:
+            await storage.set_state(KEY, "a")
+            await storage.set_data(KEY, {"x": 1})
+            await storage.set_state(OTHER_KEY, "b")
+            self.assertEqual(self._rows(storage), [])
+            # reads see the buffered writes
+            self.assertEqual(await storage.get_state(KEY), "a")
+            await storage.flush()
+            self.assertEqual(self._rows(storage), [("1:2:3::default", "a", '{"x": 1}'),
+                                                   ("1:5:5::default", "b", "{}")])
+            # a partial write keeps the other field
+            await storage.set_state(KEY, "c")
+            await storage.flush()
+            self.assertEqual(self._rows(storage)[0], ("1:2:3::default", "c", '{"x": 1}'))
+        finally:
+            await storage.close()
+
+    async def test_cleared_keys_are_deleted(self):
+        storage = self._storage()
+        try:
+            await storage.set_state(KEY, "a")
+            await storage.set_data(KEY, {"x": 1})
+            await storage.flush()
+            await storage.set_state(KEY, None)
+            await storage.set_data(KEY, {})
+            await storage.flush()
+            self.assertEqual(self._rows(storage), [])
+        finally:
+            await storage.close()
+
+    async def test_abandoned_states_expire(self):
+        storage = self._storage(ttl=60)
+        try:
+            await storage.set_state(KEY, "a")
+            await storage.flush()
+            self.now += 61
+            self.assertIsNone(await storage.get_state(KEY))
+            await storage.set_state(OTHER_KEY, "b")
+            await storage.flush()
+            self.assertEqual([row[0] for row in self._rows(storage)], ["1:5:5::default"])
+        finally:
+            await storage.close()
+
+    async def test_data_must_be_json(self):
+        storage = self._storage()
+        try:
+            with self.assertRaises(TypeError):
+                await storage.set_data(KEY, {"x": object()})
+        finally:
+            await storage.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
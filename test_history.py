@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from mvsampling.history import HistoryLog
+
+
+class TestHistoryLog(unittest.TestCase):
+    def test_empty_log(self):
+        log = HistoryLog(['A', 'B'])
+        self.assertEqual(len(log), 0)
+        frame = log.to_frame()
+        self.assertTrue(frame.empty)
+        self.assertEqual(list(frame.columns), ['option', 'value'])
+
+    def test_append_grows_past_capacity(self):
+        log = HistoryLog(['A', 'B'], capacity=2)
+        for i in range(100):
+            log.append(i % 2, float(i))
+        self.assertEqual(len(log), 100)
+        frame = log.to_frame()
+        self.assertEqual(frame['option'].tolist()[:3], ['A', 'B', 'A'])
+        self.assertEqual(frame['value'].tolist(), [float(i) for i in range(100)])
+
+    def test_extend_matches_append(self):
+        appended = HistoryLog(['A', 'B'], 'reward', dtype=np.int64, capacity=1)
+        extended = HistoryLog(['A', 'B'], 'reward', dtype=np.int64, capacity=1)
+        codes = [0, 1, 1, 0, 1]
+        rewards = [1, 0, 1, 1, 0]
+        for code, reward in zip(codes, rewards):
+            appended.append(code, reward)
+        extended.extend(codes, rewards)
+        self.assertTrue(appended.to_frame().equals(extended.to_frame()))
+
+    def test_maxlen_keeps_most_recent(self):
+        log = HistoryLog(['A', 'B'], maxlen=5)
+        for i in range(50):
+            log.append(0, float(i))
+        log.extend([1, 1, 1], [100.0, 101.0, 102.0])
+        self.assertEqual(len(log), 5)
+        self.assertEqual(log.values.tolist(), [48.0, 49.0, 100.0, 101.0, 102.0])
+        self.assertLessEqual(len(log._codes), 20)
+
+    def test_maxlen_zero_disables(self):
+        log = HistoryLog(['A'], maxlen=0)
+        log.append(0, 1.0)
+        log.extend([0, 0], [2.0, 3.0])
+        self.assertEqual(len(log), 0)
+        self.assertTrue(log.to_frame().empty)
+
+    def test_negative_maxlen(self):
+        with self.assertRaises(ValueError):
+            HistoryLog(['A'], maxlen=-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
 import unittest  # The test framework
 
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import unittest
 
 import mvsampling.mvsampling as mv  # The code to test
+from mvsampling.events import EVENT_DTYPE
 
 
 class Test_TestIncrementDecrement(unittest.TestCase):
@@ -40,6 +42,75 @@ class Test_TestIncrementDecrement(unittest.TestCase):
         c = a.grade()
         self.assertFalse(b.equals(c))
 
+    def test_hands_view_reflects_arrays(self):
+        a = mv.HandsTable(['1', '2'], minimize=False)
+        a.update_hands('1', 80)
+        self.assertEqual(a.Te.tolist(), [1, 0])
+        self.assertEqual(a.hands.loc[0, 'mu'], 80.0)
+        # the view is a copy, so editing it must not touch the posterior
+        view = a.hands
+        view['mu'] = 0.0
+        self.assertEqual(a.mu[0], 80.0)
+
+    def test_update_unknown_option(self):
+        a = mv.HandsTable(['1', '2'], minimize=False)
+        with self.assertRaises(ValueError):
+            a.update_hands('3', 10)
+
+    def test_update_many_matches_sequential(self):
+        names = ['1', '2', '1', '1', '2', '1']
+        values = [80, 100, 70, "01:15:00", 90.5, 64]
+        a = mv.HandsTable(['1', '2', '3'], minimize=False)
+        b = mv.HandsTable(['1', '2', '3'], minimize=False)
+        a.update_hands('2', 95)
+        b.update_hands('2', 95)
+        for name, value in zip(names, values):
+            a.update_hands(name, value)
+        b.update_many(names, values)
+        pd.testing.assert_frame_equal(a.hands, b.hands, check_exact=False)
+        self.assertEqual(len(b.history), len(names) + 1)
+
+    def test_update_many_rejects_bad_input(self):
+        a = mv.HandsTable(['1', '2'], minimize=False)
+        with self.assertRaises(ValueError):
+            a.update_many(['1', '2'], [1.0])
+        with self.assertRaises(ValueError):
+            a.update_many(['1', '3'], [1.0, 2.0])
+
+    def test_seeded_grade_is_reproducible(self):
+        def graded(rng):
+            a = mv.HandsTable(['1', '2', '3'], minimize=False, rng=rng)
+            a.update_many(['1', '2', '3', '1', '2', '3'], [80, 100, 90, 70, 95, 85])
+            return a.grade()
+        pd.testing.assert_frame_equal(graded(42), graded(42))
+        pd.testing.assert_frame_equal(graded(np.random.default_rng(7)), graded(np.random.default_rng(7)))
+        self.assertFalse(graded(1).equals(graded(2)))
+
+    def test_prob_best(self):
+        a = mv.HandsTable(['1', '2', '3'], minimize=False, rng=0)
+        a.update_many(['1', '2', '3'] * 20, [80, 100, 60] * 20)
+        a.update_many(['1', '2', '3'], [85, 95, 65])
+        result = a.grade(n_draws=20000)
+        self.assertTrue({'name', 'mu', 'var95', 'prob_best'}.issubset(result.columns))
+        self.assertAlmostEqual(result['prob_best'].sum(), 1.0)
+        self.assertEqual(result.iloc[0]['name'], '2')
+        self.assertTrue(result['prob_best'].is_monotonic_decreasing)
+        # maximizing uses the lower quantile, so var95 sits below the mean
+        self.assertTrue((result['var95'] < result['mu']).all())
+
+    def test_prob_best_cold_start_follows_te(self):
+        a = mv.HandsTable(['A', 'B', 'C'], minimize=True, rng=0)
+        a.update_hands('A', 10)
+        result = a.prob_best(1000)
+        self.assertEqual(result['Te'].tolist(), [0, 0, 1])
+        # the order follows Te, the shares are still the Monte Carlo ones:
+        # A wins only when both options without samples draw badly
+        self.assertAlmostEqual(result['prob_best'].sum(), 1.0)
+        for name, share in (('B', 0.5), ('C', 0.25), ('A', 0.25)):
+            self.assertAlmostEqual(result.set_index('name').loc[name, 'prob_best'], share, delta=0.05)
+        with self.assertRaises(ValueError):
+            a.prob_best(0)
+
     def test_update_shape(self):
         a = mv.HandsTable(['1', '2'], minimize=False)
         b = a.update_shape(10)
@@ -87,6 +158,15 @@ class Test_TestIncrementDecrement(unittest.TestCase):
         self.assertIn('1', a.history['option'].values)
         self.assertIn(100, a.history['value'].values)
 
+    def test_history_limit(self):
+        a = mv.HandsTable(['1', '2'], minimize=False, history_limit=2)
+        a.update_many(['1', '2', '1'], [10, 20, 30])
+        self.assertEqual(a.history['value'].tolist(), [20.0, 30.0])
+        b = mv.HandsTable(['1', '2'], minimize=False, history_limit=0)
+        b.update_hands('1', 10)
+        self.assertTrue(b.history.empty)
+        self.assertEqual(b.Te.tolist(), [1, 0])
+
     def test_str_method(self):
         a = mv.HandsTable(['1', '2'], minimize=False)
         a.update_hands('1', 100)
@@ -119,7 +199,7 @@ class Test_TestIncrementDecrement(unittest.TestCase):
         """
         ht = mv.HandsTable(['A', 'B'], minimize=True)
         # Manually set mu values to non-zero to force the else branch.
-        ht.hands['mu'] = [1.0, 1.0]
+        ht.mu[:] = [1.0, 1.0]
         result = ht.grade()
         # Validate that 'var95' column exists.
         self.assertIn('var95', result.columns)
@@ -133,7 +213,7 @@ class Test_TestIncrementDecrement(unittest.TestCase):
         """
         ht = mv.HandsTable(['A', 'B'], minimize=False)
         # Set mu to non-zero values to force the else branch.
-        ht.hands['mu'] = [1.0, 2.0]
+        ht.mu[:] = [1.0, 2.0]
         result = ht.grade()
         # Check that 'var95' exists.
         self.assertIn('var95', result.columns)
@@ -141,5 +221,56 @@ class Test_TestIncrementDecrement(unittest.TestCase):
         self.assertEqual(len(result), len(ht.hands))
 
 
+    def test_process_events_columns_keep_same_second_events(self):
+        t = datetime(2024, 3, 1, 8, 0, 0)
+        times = [t, t, t, t - timedelta(days=100)]
+        a = mv.HandsTable(['1', '2'], minimize=False)
+        a.process_events((times, ['1', '1', '2', '2'], [10, 20, 30, 99]))
+        self.assertEqual(a.Te.tolist(), [2, 1])
+        self.assertEqual(a.mu.tolist(), [15.0, 30.0])
+        # the same events as a structured array with arm positions
+        events = np.array([(t, 0, 10), (t, 0, 20), (t, 1, 30), (t - timedelta(days=100), 1, 99)],
+                          dtype=EVENT_DTYPE)
+        b = mv.HandsTable(['1', '2'], minimize=False)
+        b.process_events(events)
+        np.testing.assert_array_equal(a.beta, b.beta)
+        np.testing.assert_array_equal(a.mu, b.mu)
+        # epoch seconds work as timestamps too
+        c = mv.HandsTable(['1', '2'], minimize=False)
+        c.process_events((np.array([0, 0, 86400]), ['1', '2', '2'], np.array([1.0, 2.0, 3.0])), days=0.5)
+        self.assertEqual(c.Te.tolist(), [0, 1])
+
+    def test_process_events_dict_with_time_strings(self):
+        t = datetime(2024, 1, 1)
+        a = mv.HandsTable(['a'])
+        a.process_events({t: ('a', '00:30:00')})
+        self.assertEqual(a.mu.tolist(), [30.0])
+        b = mv.HandsTable(['a', 'b'])
+        b.process_events({t: ('a', '00:30:00'), t + timedelta(hours=1): ('b', 30)})
+        self.assertEqual(b.mu.tolist(), [30.0, 30.0])
+
+    def test_process_events_integer_names(self):
+        t = datetime(2024, 1, 1)
+        a = mv.HandsTable([1, 2])
+        a.process_events({t: (1, 30.0)})
+        self.assertEqual(a.Te.tolist(), [1, 0])
+        b = mv.HandsTable([10, 20])
+        b.process_events(([t], [20], [1.0]))
+        self.assertEqual(b.Te.tolist(), [0, 1])
+        with self.assertRaises(ValueError):
+            b.process_events(([t], [0], [1.0]))
+
+    def test_process_events_invalid_columns(self):
+        a = mv.HandsTable(['1', '2'])
+        t = datetime(2024, 3, 1)
+        with self.assertRaises(ValueError):
+            a.process_events(np.array([(t, 2, 1.0)], dtype=EVENT_DTYPE))
+        with self.assertRaises(ValueError):
+            a.process_events(([t], ['3'], [1.0]))
+        with self.assertRaises(ValueError):
+            a.process_events(([t, t], ['1'], [1.0]))
+        self.assertEqual(len(a.process_events(([], [], []))), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from handlers.render_cache import RenderCache
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = RenderCache(maxsize=2, ttl=10, clock=lambda: self.now)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get((1, 5, 2, 91)))
+        self.cache.put((1, 5, 2, 91), ("table", ["A", "B"]))
+        self.assertEqual(self.cache.get((1, 5, 2, 91)), ("table", ["A", "B"]))
+        # a new sample moves the key on
+        self.assertIsNone(self.cache.get((1, 6, 2, 91)))
+        self.assertEqual(self.cache.info()[:2], (1, 2))
+
+    def test_entries_expire(self):
+        self.cache.put((1, 5, 2, 91), "table")
+        self.now = 10
+        self.assertEqual(self.cache.get((1, 5, 2, 91)), "table")
+        self.now = 10.5
+        self.assertIsNone(self.cache.get((1, 5, 2, 91)))
+        self.assertEqual(self.cache.info(), (1, 1, 2, 0))
+
+    def test_lru_bound_and_invalidation(self):
+        self.cache.put((1, 5, 2, 91), "one")
+        self.cache.put((2, 7, 1, 91), "two")
+        self.cache.get((1, 5, 2, 91))
+        self.cache.put((3, 1, 1, 91), "three")
+        self.assertIsNone(self.cache.get((2, 7, 1, 91)))
+        self.cache.invalidate_optimization(1)
+        self.assertIsNone(self.cache.get((1, 5, 2, 91)))
+        self.assertEqual(self.cache.get((3, 1, 1, 91)), "three")
+
+
+if __name__ == "__main__":
+    unittest.main()
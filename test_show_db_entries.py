@@ -3,9 +3,11 @@ import sqlite3
 import tempfile
 import unittest
 import io
+import json
 from contextlib import redirect_stdout
 
-from show_db_entries import show_db_entries  # Import the function to test
+from database_driver import DatabaseDriver
+from show_db_entries import connect_read_only, main, show_db_entries  # Import the functions to test
 
 class TestShowDBEntries(unittest.TestCase):
     def test_db_file_not_exist(self):
@@ -61,5 +63,82 @@ class TestShowDBEntries(unittest.TestCase):
         finally:
             os.remove(temp_db_path)
 
+class TestShowDBEntriesOptions(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "main_db.db")
+        db = DatabaseDriver(self.path)
+        for user_id, name in [(1, "Commute"), (1, "Coffee"), (2, "Commute")]:
+            db.add_optimization(name, user_id)
+            db.add_variant(name, "A", user_id)
+            for value in range(5):
+                db.add_option(name, "A", value, user_id)
+        for run_key, user_id in [("2026-01-02", 1), ("2026-01-01", 2), ("2026-01-01", 1)]:
+            db.mark_broadcast_sent(run_key, user_id)
+        db.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _show(self, *args, **kwargs):
+        f = io.StringIO()
+        show_db_entries(self.path, *args, out=f, **kwargs)
+        return f.getvalue()
+
+    def test_pages_and_limit(self):
+        output = self._show(tables=["optimization_samples"], limit=7, page_size=3)
+        lines = output.splitlines()
+        self.assertEqual(lines[0], "Entries in table 'optimization_samples':")
+        self.assertEqual(len([line for line in lines if line.startswith("(")]), 7)
+        self.assertIn("7 rows shown of ~15", output)
+
+    def test_after_rowid(self):
+        output = self._show(tables=["optimization_samples"], after=13)
+        self.assertIn("(14, ", output)
+        self.assertNotIn("(13, ", output)
+
+    def test_filters(self):
+        output = self._show(user_id=1, optimization_name="Coffee", json_lines=True)
+        records = [json.loads(line) for line in output.splitlines()]
+        samples = [r["row"] for r in records if r["table"] == "optimization_samples"]
+        self.assertEqual(len(samples), 5)
+        self.assertTrue(all(sample["optimization_id"] == 2 for sample in samples))
+        self.assertEqual([r["row"]["optimization_name"] for r in records if r["table"] == "user_optimization"],
+                         ["Coffee"])
+        self.assertNotIn("sqlite_sequence", {r["table"] for r in records})
+
+    def test_exact_counts(self):
+        output = self._show(tables=["users"], exact_counts=True)
+        self.assertIn("2 rows shown of 2", output)
+
+    def test_opens_read_only(self):
+        conn = connect_read_only(self.path)
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM users")
+        finally:
+            conn.close()
+
+    def test_without_rowid_table_pages_by_primary_key(self):
+        output = self._show(tables=["broadcast_log"], page_size=2, json_lines=True)
+        rows = [json.loads(line)["row"] for line in output.splitlines()]
+        self.assertEqual([(row["run_key"], row["telegram_user_id"]) for row in rows],
+                         [("2026-01-01", 1), ("2026-01-01", 2), ("2026-01-02", 1)])
+        self.assertIn("2 rows shown", self._show(tables=["broadcast_log"], limit=2))
+
+    def test_cli_json_has_only_json_lines(self):
+        f = io.StringIO()
+        with redirect_stdout(f):
+            main([self.path, "--json"])
+        tables = {json.loads(line)["table"] for line in f.getvalue().splitlines()}
+        self.assertIn("broadcast_log", tables)
+
+    def test_cli(self):
+        f = io.StringIO()
+        with redirect_stdout(f):
+            main([self.path, "--table", "users", "--json"])
+        self.assertEqual([json.loads(line)["row"] for line in f.getvalue().splitlines()],
+                         [{"telegram_user_id": 1}, {"telegram_user_id": 2}])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+# Modules of this repository, whose own import time counts against the budget.
+PROJECT_MODULES = ("main", "config", "handlers", "states", "database_driver", "fsm_storage", "broadcaster", "mvsampling")
+# Loaded on first recommendation, never at startup.
+LAZY_MODULES = ("numpy", "pandas", "mvsampling.mvsampling")
+
+# Seconds; generous so that slow CI machines pass, low enough to catch an
+# eager pandas import. Override with the environment variables for profiling.
+PROJECT_IMPORT_BUDGET = float(os.getenv("PROJECT_IMPORT_BUDGET", "0.25"))
+TOTAL_IMPORT_BUDGET = float(os.getenv("TOTAL_IMPORT_BUDGET", "5.0"))
+
+
+def import_main():
+    """
+    Import main in a fresh interpreter, like `python -X importtime main.py`
+    without starting to poll. Returns (stdout, importtime report) and runs
+    in an empty directory so that stray database files would show up.
+    """
+    env = dict(os.environ, BOT_TOKEN="123456:TEST", PYTHONPATH=REPO)
+    code = ("import sys, main; "
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                cwd=cwd, env=env, capture_output=True, text=True, check=True)
+        created = os.listdir(cwd)
+    return result.stdout.strip(), result.stderr, created
+
+
+def parse_importtime(report):
+    """{module: (self_us, cumulative_us)} from a -X importtime report."""
+    times = {}
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+class TestStartup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.lazy_loaded, report, cls.created = import_main()
+        cls.times = parse_importtime(report)
+
+    def test_numeric_modules_are_lazy(self):
+        self.assertEqual(self.lazy_loaded, "")
+
+    def test_no_database_opened_at_import(self):
+        self.assertEqual(self.created, [])
+
+    def test_import_time_budget(self):
+        own = sum(self_us for name, (self_us, _) in self.times.items()
+                  if name.split(".")[0] in PROJECT_MODULES) / 1e6
+        total = self.times["main"][1] / 1e6
+        self.assertLess(own, PROJECT_IMPORT_BUDGET, f"project modules took {own:.3f}s to import")
+        self.assertLess(total, TOTAL_IMPORT_BUDGET, f"import main took {total:.3f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -51,5 +51,10 @@ class TestStringProcessor(unittest.TestCase):
         self.assertLess(len(result.encode("utf-8")), 64)
         self.assertTrue(s.startswith(result))
 
+    def test_format_epoch(self):
+        self.assertEqual(self.processor.format_epoch(1792342915), "2026-10-18 17:01:55")
+        self.assertEqual(self.processor.format_epoch(0), "1970-01-01 00:00:00")
+        self.assertEqual(self.processor.format_epoch(None), "")
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
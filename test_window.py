@@ -0,0 +1,89 @@
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import mvsampling.mvsampling as mv
+from mvsampling.binomial_sampling import BinomialBandit
+from mvsampling.window import SlidingWindow
+
+
+def make_events(start, count, seed=0):
+    rng = np.random.default_rng(seed)
+    names = rng.choice(['A', 'B', 'C'], count)
+    values = rng.normal(40, 8, count)
+    return {start + timedelta(hours=12 * i): (str(name), float(value))
+            for i, (name, value) in enumerate(zip(names, values))}
+
+
+class TestSlidingWindow(unittest.TestCase):
+    def test_matches_full_rebuild(self):
+        events = make_events(datetime(2024, 1, 1), 600)
+        items = sorted(events.items())
+        window = SlidingWindow(mv.HandsTable(['A', 'B', 'C'], history_limit=0), days=91)
+        for chunk_start in range(0, len(items), 75):
+            window.add(dict(items[chunk_start:chunk_start + 75]))
+            seen = dict(items[:chunk_start + 75])
+            rebuilt = mv.HandsTable(['A', 'B', 'C'])
+            rebuilt.process_events(seen, days=91)
+            np.testing.assert_array_equal(window.sampler.Te, rebuilt.Te)
+            np.testing.assert_allclose(window.sampler.mu, rebuilt.mu)
+            np.testing.assert_allclose(window.sampler.alpha, rebuilt.alpha)
+            np.testing.assert_allclose(window.sampler.beta, rebuilt.beta)
+        self.assertEqual(len(window), 183)
+
+    def test_expired_option_returns_to_prior(self):
+        table = mv.HandsTable(['A', 'B'])
+        window = SlidingWindow(table, days=10)
+        start = datetime(2024, 1, 1)
+        window.add({start: ('A', 30.0), start + timedelta(days=1): ('A', 35.0)})
+        window.add({start + timedelta(days=20): ('B', 50.0)})
+        self.assertEqual(table.Te.tolist(), [0, 1])
+        self.assertEqual((table.mu[0], table.alpha[0], table.beta[0]), (0.0, 0.5, 0.5))
+
+    def test_out_of_order_events(self):
+        window = SlidingWindow(mv.HandsTable(['A']), days=10)
+        window.add({datetime(2024, 1, 5): ('A', 1.0)})
+        with self.assertRaises(ValueError):
+            window.add({datetime(2024, 1, 4): ('A', 2.0)})
+
+    def test_binomial_with_clock(self):
+        now = datetime(2024, 6, 1)
+        clock = [now]
+        bandit = BinomialBandit(['A', 'B'])
+        window = SlidingWindow(bandit, days=91, clock=lambda: clock[0])
+        window.add([(now - timedelta(days=100), 'A', 1),
+                    (now - timedelta(days=50), 'A', 1),
+                    (now - timedelta(days=10), 'B', 0)])
+        self.assertEqual(bandit.runs.tolist(), [1, 1])
+        clock[0] = now + timedelta(days=45)
+        graded = window.grade()
+        self.assertEqual(bandit.alpha.tolist(), [1.0, 1.0])
+        self.assertEqual(bandit.runs.tolist(), [0, 1])
+        self.assertIn('theta_sample', graded.columns)
+
+
+class TestRemoveMany(unittest.TestCase):
+    def test_hands_table_remove_is_inverse(self):
+        table = mv.HandsTable(['A', 'B'])
+        table.update_many(['A', 'B', 'A'], [10, 20, 14])
+        before = table.hands
+        table.update_many(['A', 'B', 'B'], [11, 30, 25])
+        table.remove_many(['A', 'B', 'B'], [11, 30, 25])
+        np.testing.assert_allclose(table.hands[['mu', 'alpha', 'beta']], before[['mu', 'alpha', 'beta']])
+        with self.assertRaises(ValueError):
+            table.remove_many(['B', 'B'], [1, 2])
+
+    def test_binomial_remove_is_inverse(self):
+        bandit = BinomialBandit(['A', 'B'])
+        bandit.update_many(['A', 'B', 'A'], [1, 0, 0])
+        bandit.remove_many(['A', 'B'], [1, 0])
+        self.assertEqual(bandit.alpha.tolist(), [1.0, 1.0])
+        self.assertEqual(bandit.beta.tolist(), [2.0, 1.0])
+        self.assertEqual(bandit.runs.tolist(), [1, 0])
+        with self.assertRaises(ValueError):
+            bandit.remove_many(['B'], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()